@@ -3,10 +3,12 @@ Enhanced API Routes for TGFX Trade Lab
 Handles additional AJAX requests and API endpoints
 """
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 from flask_login import login_required, current_user
-from app import db, User, Video, Category, VideoFile, UserProgress, UserFavorite, UserActivity, Notification, Recommendation, RecommendationClick
-from datetime import datetime
+from app import db, User, Video, Category, VideoFile, UserProgress, UserFavorite, Recommendation, RecommendationClick
+from app import analytics_cache, get_recent_user_activity, get_user_notification_feed, mark_broadcast_read, mark_notification_read as mark_user_notification_read, mark_all_notifications_read as mark_all_user_notifications_read
+from datetime import datetime, timedelta
+import json
 import os
 
 api = Blueprint('api', __name__, url_prefix='/api')
@@ -145,9 +147,7 @@ def get_user_activity():
     try:
         limit = min(int(request.args.get('limit', 10)), 50)
         
-        activities = UserActivity.query.filter_by(user_id=current_user.id)\
-                                     .order_by(UserActivity.timestamp.desc())\
-                                     .limit(limit).all()
+        activities = get_recent_user_activity(current_user.id, limit=limit)
         
         results = []
         for activity in activities:
@@ -218,23 +218,19 @@ def get_notifications():
         limit = min(int(request.args.get('limit', 20)), 50)
         unread_only = request.args.get('unread_only', 'false').lower() == 'true'
         
-        query = Notification.query.filter_by(user_id=current_user.id)
-        
-        if unread_only:
-            query = query.filter_by(is_read=False)
-        
-        notifications = query.order_by(Notification.created_at.desc()).limit(limit).all()
+        notifications = get_user_notification_feed(current_user, limit=limit, unread_only=unread_only)
         
         results = []
         for notification in notifications:
             results.append({
-                'id': notification.id,
-                'title': notification.title,
-                'message': notification.message,
-                'type': notification.notification_type,
-                'is_read': notification.is_read,
-                'created_at': notification.created_at.isoformat(),
-                'time_ago': get_time_ago(notification.created_at)
+                'id': notification['id'],
+                'source': notification['source'],
+                'title': notification['title'],
+                'message': notification['message'],
+                'type': notification['type'],
+                'is_read': notification['is_read'],
+                'created_at': notification['created_at'].isoformat(),
+                'time_ago': get_time_ago(notification['created_at'])
             })
         
         return jsonify({'notifications': results})
@@ -247,12 +243,25 @@ def get_notifications():
 def mark_notification_read(notification_id):
     """Mark notification as read"""
     try:
-        notification = Notification.query.filter_by(
-            id=notification_id,
-            user_id=current_user.id
-        ).first_or_404()
+        if not mark_user_notification_read(current_user, notification_id):
+            return jsonify({'error': 'Notification not found'}), 404
+        
+        db.session.commit()
+        
+        return jsonify({'success': True})
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/notifications/broadcast/<int:broadcast_id>/read', methods=['POST'])
+@login_required
+def mark_broadcast_notification_read(broadcast_id):
+    """Mark broadcast notification as read"""
+    try:
+        if not mark_broadcast_read(current_user, broadcast_id):
+            return jsonify({'error': 'Notification not found'}), 404
         
-        notification.is_read = True
         db.session.commit()
         
         return jsonify({'success': True})
@@ -266,10 +275,7 @@ def mark_notification_read(notification_id):
 def mark_all_notifications_read():
     """Mark all notifications as read"""
     try:
-        Notification.query.filter_by(
-            user_id=current_user.id,
-            is_read=False
-        ).update({'is_read': True})
+        mark_all_user_notifications_read(current_user)
         
         db.session.commit()
         
@@ -288,53 +294,56 @@ def admin_analytics_overview():
         return jsonify({'error': 'Admin access required'}), 403
     
     try:
-        # Basic counts
-        total_users = User.query.count()
-        premium_users = User.query.filter_by(has_subscription=True).count()
-        total_videos = Video.query.count()
-        total_categories = Category.query.count()
-        
-        # Recent activity
-        recent_signups = User.query.filter(
-            User.created_at >= datetime.utcnow() - timedelta(days=7)
-        ).count()
-        
-        recent_video_views = UserProgress.query.filter(
-            UserProgress.last_watched >= datetime.utcnow() - timedelta(days=7)
-        ).count()
-        
-        # Popular videos
-        popular_videos = db.session.query(
-            Video.title, 
-            db.func.count(UserProgress.id).label('view_count')
-        ).join(UserProgress).group_by(Video.id, Video.title)\
-         .order_by(db.desc('view_count')).limit(5).all()
-        
-        # Popular categories
-        popular_categories = db.session.query(
-            Category.name,
-            db.func.count(UserProgress.id).label('view_count')
-        ).join(Video).join(UserProgress)\
-         .group_by(Category.id, Category.name)\
-         .order_by(db.desc('view_count')).limit(5).all()
-        
-        return jsonify({
-            'overview': {
-                'total_users': total_users,
-                'premium_users': premium_users,
-                'total_videos': total_videos,
-                'total_categories': total_categories,
-                'conversion_rate': round((premium_users / total_users) * 100, 1) if total_users > 0 else 0
-            },
-            'recent_activity': {
-                'new_signups_week': recent_signups,
-                'video_views_week': recent_video_views
-            },
-            'popular_content': {
-                'videos': [{'title': v.title, 'views': v.view_count} for v in popular_videos],
-                'categories': [{'name': c.name, 'views': c.view_count} for c in popular_categories]
+        def build_overview():
+            # Basic counts
+            total_users = User.query.count()
+            premium_users = User.query.filter_by(has_subscription=True).count()
+            total_videos = Video.query.count()
+            total_categories = Category.query.count()
+        
+            # Recent activity
+            recent_signups = User.query.filter(
+                User.created_at >= datetime.utcnow() - timedelta(days=7)
+            ).count()
+        
+            recent_video_views = UserProgress.query.filter(
+                UserProgress.last_watched >= datetime.utcnow() - timedelta(days=7)
+            ).count()
+        
+            # Popular videos
+            popular_videos = db.session.query(
+                Video.title, 
+                db.func.count(UserProgress.id).label('view_count')
+            ).join(UserProgress).group_by(Video.id, Video.title)\
+             .order_by(db.desc('view_count')).limit(5).all()
+        
+            # Popular categories
+            popular_categories = db.session.query(
+                Category.name,
+                db.func.count(UserProgress.id).label('view_count')
+            ).join(Video).join(UserProgress)\
+             .group_by(Category.id, Category.name)\
+             .order_by(db.desc('view_count')).limit(5).all()
+        
+            return {
+                'overview': {
+                    'total_users': total_users,
+                    'premium_users': premium_users,
+                    'total_videos': total_videos,
+                    'total_categories': total_categories,
+                    'conversion_rate': round((premium_users / total_users) * 100, 1) if total_users > 0 else 0
+                },
+                'recent_activity': {
+                    'new_signups_week': recent_signups,
+                    'video_views_week': recent_video_views
+                },
+                'popular_content': {
+                    'videos': [{'title': v.title, 'views': v.view_count} for v in popular_videos],
+                    'categories': [{'name': c.name, 'views': c.view_count} for c in popular_categories]
+                }
             }
-        })
+        
+        return jsonify(analytics_cache.get_or_compute('overview', build_overview))
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -409,36 +418,100 @@ def bulk_delete_videos():
         return jsonify({'error': str(e)}), 500
 
 # Export/Import API
+EXPORT_BATCH_SIZE = 500
+
+
+def iter_export_batches(query, id_column, batch_size=EXPORT_BATCH_SIZE):
+    """Yield lists of rows in id order, one keyset-paginated batch at a time"""
+    last_id = 0
+    while True:
+        batch = query.filter(id_column > last_id).order_by(id_column).limit(batch_size).all()
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1].id
+
+
+def stream_export(name, batches, serialize, export_format):
+    """
+    Stream export rows as NDJSON (one object per line) or as the original
+    {name: [...], exported_at, total_count} document, chunked per batch.
+    The JSON opening goes out before the first query runs.
+    """
+    exported_at = datetime.utcnow().isoformat()
+    
+    if export_format == 'ndjson':
+        for batch in batches:
+            yield ''.join(json.dumps(serialize(row)) + '\n' for row in batch)
+        return
+    
+    yield '{"%s": [' % name
+    count = 0
+    for batch in batches:
+        yield (',' if count else '') + ','.join(json.dumps(serialize(row)) for row in batch)
+        count += len(batch)
+    yield '], "exported_at": %s, "total_count": %d}' % (json.dumps(exported_at), count)
+
+
+def export_response(name, batches, serialize):
+    """Streaming response for an export; ?format=ndjson switches to newline-delimited JSON"""
+    export_format = 'ndjson' if request.args.get('format') == 'ndjson' else 'json'
+    return Response(
+        stream_with_context(stream_export(name, batches, serialize, export_format)),
+        mimetype='application/x-ndjson' if export_format == 'ndjson' else 'application/json',
+        headers={'X-Accel-Buffering': 'no'}
+    )
+
+
+def serialize_video_export(video):
+    return {
+        'title': video.title,
+        'description': video.description,
+        's3_url': video.s3_url,
+        'thumbnail_url': video.thumbnail_url,
+        'duration': video.duration,
+        'is_free': video.is_free,
+        'order_index': video.order_index,
+        'category_name': video.category.name,
+        'tags': [tag.name for tag in video.tags],
+        'created_at': video.created_at.isoformat()
+    }
+
+
+def serialize_recommendation_export(rec):
+    return {
+        'title': rec.title,
+        'description': rec.description,
+        'category': rec.category,
+        'affiliate_url': rec.affiliate_url,
+        'image_url': rec.image_url,
+        'demo_url': rec.demo_url,
+        'price_info': rec.price_info,
+        'coupon_code': rec.coupon_code,
+        'discount_percentage': rec.discount_percentage,
+        'features': rec.features,
+        'is_featured': rec.is_featured,
+        'is_active': rec.is_active,
+        'order_index': rec.order_index,
+        'click_count': rec.click_count,
+        'created_at': rec.created_at.isoformat()
+    }
+
+
 @api.route('/admin/export/videos', methods=['GET'])
 @login_required
 def export_videos():
-    """Export videos data as JSON"""
+    """Export videos data as streamed JSON or NDJSON"""
     if not current_user.is_admin:
         return jsonify({'error': 'Admin access required'}), 403
     
     try:
-        videos = Video.query.all()
-        
-        export_data = []
-        for video in videos:
-            export_data.append({
-                'title': video.title,
-                'description': video.description,
-                's3_url': video.s3_url,
-                'thumbnail_url': video.thumbnail_url,
-                'duration': video.duration,
-                'is_free': video.is_free,
-                'order_index': video.order_index,
-                'category_name': video.category.name,
-                'tags': [tag.name for tag in video.tags],
-                'created_at': video.created_at.isoformat()
-            })
-        
-        return jsonify({
-            'videos': export_data,
-            'exported_at': datetime.utcnow().isoformat(),
-            'total_count': len(export_data)
-        })
+        # Category and tags load with each batch; tags don't pull their own videos back in
+        query = Video.query.options(
+            db.joinedload(Video.category),
+            db.selectinload(Video.tags).lazyload('*')
+        )
+        return export_response('videos', iter_export_batches(query, Video.id), serialize_video_export)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -446,38 +519,16 @@ def export_videos():
 @api.route('/admin/export/recommendations', methods=['GET'])
 @login_required
 def export_recommendations():
-    """Export recommendations data"""
+    """Export recommendations data as streamed JSON or NDJSON"""
     if not current_user.is_admin:
         return jsonify({'error': 'Admin access required'}), 403
     
     try:
-        recommendations = Recommendation.query.all()
-        
-        export_data = []
-        for rec in recommendations:
-            export_data.append({
-                'title': rec.title,
-                'description': rec.description,
-                'category': rec.category,
-                'affiliate_url': rec.affiliate_url,
-                'image_url': rec.image_url,
-                'demo_url': rec.demo_url,
-                'price_info': rec.price_info,
-                'coupon_code': rec.coupon_code,
-                'discount_percentage': rec.discount_percentage,
-                'features': rec.features,
-                'is_featured': rec.is_featured,
-                'is_active': rec.is_active,
-                'order_index': rec.order_index,
-                'click_count': rec.click_count,
-                'created_at': rec.created_at.isoformat()
-            })
-        
-        return jsonify({
-            'recommendations': export_data,
-            'exported_at': datetime.utcnow().isoformat(),
-            'total_count': len(export_data)
-        })
+        return export_response(
+            'recommendations',
+            iter_export_batches(Recommendation.query, Recommendation.id),
+            serialize_recommendation_export
+        )
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -9,7 +9,7 @@ try:
 except ImportError:
     print("⚠ Gevent not available, using default threading")
 
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, g, session
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_wtf import FlaskForm
@@ -19,7 +19,10 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from datetime import datetime, timedelta
 import boto3
+from botocore.config import Config as BotoConfig
 from botocore.exceptions import NoCredentialsError, ClientError
+from sqlalchemy import event as sqlalchemy_event
+from sqlalchemy.exc import IntegrityError
 import stripe
 from config import get_config
 import re
@@ -33,13 +36,35 @@ from datetime import datetime, timedelta
 import logging
 import signal
 import threading
+import hashlib
+import queue
+import heapq
+import zlib
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import smtplib
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from collections import OrderedDict, deque
+from decimal import Decimal
 import requests
 import base64
 from PIL import Image, ImageDraw, ImageFont
 from io import BytesIO
 import textwrap
 
-from flask_mail import Mail, Message
+from flask_mail import Mail
+from flask_caching import Cache
+
+# pandas powers the cohort analytics engine; the rest of the app runs without it
+try:
+    import pandas as pd
+    import numpy as np
+    PANDAS_AVAILABLE = True
+except ImportError:
+    pd = None
+    np = None
+    PANDAS_AVAILABLE = False
 from itsdangerous import URLSafeTimedSerializer
 
 
@@ -82,6 +107,9 @@ except Exception as e:
 # FIXED: Initialize Stripe with error handling
 try:
     stripe.api_key = app.config.get('STRIPE_SECRET_KEY')
+    if app.config.get('STRIPE_API_BASE'):
+        stripe.api_base = app.config['STRIPE_API_BASE']  # e.g. a local stripe-mock server
+        print(f"✓ Stripe API base set to {stripe.api_base}")
     if stripe.api_key:
         print("✓ Stripe API key configured")
     else:
@@ -164,6 +192,14 @@ except Exception as e:
     print(f"❌ Flask-Mail initialization error: {e}")
     mail = None
 
+# Initialize Flask-Caching (CACHE_TYPE comes from config)
+try:
+    cache = Cache(app)
+    print("✓ Flask-Caching initialized")
+except Exception as e:
+    print(f"⚠️ Flask-Caching initialization error: {e}")
+    cache = None
+
 # Association table for many-to-many relationship between videos and tags
 video_tags = db.Table('video_tags',
     db.Column('video_id', db.Integer, db.ForeignKey('videos.id'), primary_key=True),
@@ -264,6 +300,14 @@ class User(UserMixin, db.Model):
     created_streams = db.relationship('Stream', backref='creator', lazy=True, cascade='all, delete-orphan')
     activities = db.relationship('UserActivity', backref='user', lazy=True, cascade='all, delete-orphan')
     notifications = db.relationship('Notification', backref='user', lazy=True, cascade='all, delete-orphan')
+    
+    # Keyset pagination for the admin user list: newest first, optionally filtered
+    __table_args__ = (
+        db.Index('ix_users_created_id', 'created_at', 'id'),
+        db.Index('ix_users_status_created_id', 'subscription_status', 'created_at', 'id'),
+        db.Index('ix_users_plan_created_id', 'subscription_plan', 'created_at', 'id'),
+        db.Index('ix_users_admin_created_id', 'is_admin', 'created_at', 'id'),
+    )
 
     def has_active_subscription(self):
         """Check if user has an active subscription - updated for lifetime"""
@@ -345,6 +389,118 @@ def migrate_stream_recording_id():
         db.session.rollback()
         return False
 
+def migrate_notification_indexes():
+    """Add composite notification indexes and the unread counter column to existing tables"""
+    statements = [
+        ('ix_notifications_user_read_created',
+         'CREATE INDEX ix_notifications_user_read_created ON notifications (user_id, is_read, created_at)'),
+        ('ix_notifications_user_created',
+         'CREATE INDEX ix_notifications_user_created ON notifications (user_id, created_at)'),
+        ('notification_states.unread_count',
+         'ALTER TABLE notification_states ADD COLUMN unread_count INTEGER NOT NULL DEFAULT 0'),
+    ]
+    
+    try:
+        with app.app_context():
+            for name, statement in statements:
+                try:
+                    db.session.execute(db.text(statement))
+                    db.session.commit()
+                    print(f"✅ Added {name}")
+                except Exception as e:
+                    message = str(e).lower()
+                    if "already exists" in message or "duplicate" in message:
+                        print(f"ℹ️ {name} already exists")
+                    else:
+                        print(f"⚠️ Error adding {name}: {e}")
+                    db.session.rollback()
+        
+        return True
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        db.session.rollback()
+        return False
+
+def migrate_user_indexes():
+    """Add the composite indexes behind the paginated admin user list"""
+    statements = [
+        ('ix_users_created_id',
+         'CREATE INDEX ix_users_created_id ON users (created_at, id)'),
+        ('ix_users_status_created_id',
+         'CREATE INDEX ix_users_status_created_id ON users (subscription_status, created_at, id)'),
+        ('ix_users_plan_created_id',
+         'CREATE INDEX ix_users_plan_created_id ON users (subscription_plan, created_at, id)'),
+        ('ix_users_admin_created_id',
+         'CREATE INDEX ix_users_admin_created_id ON users (is_admin, created_at, id)'),
+    ]
+    
+    try:
+        with app.app_context():
+            for name, statement in statements:
+                try:
+                    db.session.execute(db.text(statement))
+                    db.session.commit()
+                    print(f"✅ Added {name}")
+                except Exception as e:
+                    message = str(e).lower()
+                    if "already exists" in message or "duplicate" in message:
+                        print(f"ℹ️ {name} already exists")
+                    else:
+                        print(f"⚠️ Error adding {name}: {e}")
+                    db.session.rollback()
+        
+        return True
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        db.session.rollback()
+        return False
+
+def migrate_subscription_event_ids():
+    """Add the stripe_event_id dedupe column and the extracted Stripe fields to subscription_events"""
+    statements = [
+        ('subscription_events.stripe_event_id',
+         'ALTER TABLE subscription_events ADD COLUMN stripe_event_id VARCHAR(100) NULL'),
+        ('ux_subscription_events_stripe_event_id',
+         'CREATE UNIQUE INDEX ux_subscription_events_stripe_event_id ON subscription_events (stripe_event_id)'),
+        ('subscription_events.stripe_object_id',
+         'ALTER TABLE subscription_events ADD COLUMN stripe_object_id VARCHAR(100) NULL'),
+        ('ix_subscription_events_stripe_object_id',
+         'CREATE INDEX ix_subscription_events_stripe_object_id ON subscription_events (stripe_object_id)'),
+        ('subscription_events.object_status',
+         'ALTER TABLE subscription_events ADD COLUMN object_status VARCHAR(50) NULL'),
+        ('subscription_events.stripe_price_id',
+         'ALTER TABLE subscription_events ADD COLUMN stripe_price_id VARCHAR(100) NULL'),
+        ('ix_subscription_events_type_created',
+         'CREATE INDEX ix_subscription_events_type_created ON subscription_events (event_type, created_at)'),
+        ('subscription_events.updated_at',
+         'ALTER TABLE subscription_events ADD COLUMN updated_at DATETIME NULL'),
+        ('subscription_events.updated_at values',
+         'UPDATE subscription_events SET updated_at = created_at WHERE updated_at IS NULL'),
+        ('ix_subscription_events_updated_at',
+         'CREATE INDEX ix_subscription_events_updated_at ON subscription_events (updated_at)'),
+    ]
+    
+    try:
+        with app.app_context():
+            for name, statement in statements:
+                try:
+                    db.session.execute(db.text(statement))
+                    db.session.commit()
+                    print(f"✅ Added {name}")
+                except Exception as e:
+                    message = str(e).lower()
+                    if "already exists" in message or "duplicate" in message:
+                        print(f"ℹ️ {name} already exists")
+                    else:
+                        print(f"⚠️ Error adding {name}: {e}")
+                    db.session.rollback()
+        
+        return True
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        db.session.rollback()
+        return False
+
 class SubscriptionEvent(db.Model):
     __tablename__ = 'subscription_events'
     
@@ -352,15 +508,124 @@ class SubscriptionEvent(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True, index=True)
     stripe_customer_id = db.Column(db.String(100), nullable=True, index=True)
     stripe_subscription_id = db.Column(db.String(100), nullable=True, index=True)
+    stripe_event_id = db.Column(db.String(100), nullable=True, unique=True)  # Dedupe key for webhook retries
     event_type = db.Column(db.String(50), nullable=False, index=True)  # created, updated, deleted, payment_succeeded, etc.
-    event_data = db.Column(db.Text, nullable=True)  # JSON data from Stripe
+    event_data = db.deferred(db.Column(db.Text, nullable=True))  # Small app-generated JSON; Stripe payloads live in subscription_event_payloads
     amount = db.Column(db.Numeric(10, 2), nullable=True)
     currency = db.Column(db.String(3), default='usd', nullable=False)
     processed = db.Column(db.Boolean, default=False, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=True, index=True)  # Revenue rollup watermark
+    
+    # Fields extracted from the Stripe object at ingest
+    stripe_object_id = db.Column(db.String(100), nullable=True, index=True)  # in_..., sub_..., cs_...
+    object_status = db.Column(db.String(50), nullable=True)
+    stripe_price_id = db.Column(db.String(100), nullable=True)
     
     # Relationship
     user = db.relationship('User', backref='subscription_events')
+    payload = db.relationship('SubscriptionEventPayload', uselist=False, lazy='select',
+                              cascade='all, delete-orphan', backref='event')
+    
+    __table_args__ = (
+        db.Index('ix_subscription_events_type_created', 'event_type', 'created_at'),
+    )
+    
+    def set_stripe_object(self, event_object):
+        """Extract the queried fields and store the full object compressed"""
+        self.stripe_object_id = event_object.get('id')
+        self.object_status = event_object.get('status')
+        
+        price_id = None
+        items = (event_object.get('items') or {}).get('data') or (event_object.get('lines') or {}).get('data') or []
+        if items:
+            price = items[0].get('price') or {}
+            price_id = price.get('id') if isinstance(price, dict) else price
+        self.stripe_price_id = price_id
+        
+        self.event_data = None
+        if self.payload is None:
+            self.payload = SubscriptionEventPayload()
+        self.payload.set_json(event_object)
+    
+    def get_event_payload(self):
+        """Full event object, from the compressed payload or the legacy event_data column"""
+        if self.payload is not None:
+            return self.payload.get_json()
+        return json.loads(self.event_data) if self.event_data else {}
+
+class SubscriptionEventPayload(db.Model):
+    """Compressed raw Stripe object for a subscription event, loaded only when needed"""
+    __tablename__ = 'subscription_event_payloads'
+    
+    COMPRESSION_LEVEL = 6
+    
+    event_id = db.Column(db.Integer, db.ForeignKey('subscription_events.id', ondelete='CASCADE'), primary_key=True)
+    encoding = db.Column(db.String(10), default='zlib', nullable=False)
+    data = db.Column(db.LargeBinary(length=16777215), nullable=False)  # MEDIUMBLOB on MySQL
+    raw_size = db.Column(db.Integer, nullable=False)
+    
+    def set_json(self, value):
+        raw = json.dumps(value, separators=(',', ':')).encode('utf-8')
+        self.encoding = 'zlib'
+        self.data = zlib.compress(raw, self.COMPRESSION_LEVEL)
+        self.raw_size = len(raw)
+    
+    def get_json(self):
+        return json.loads(zlib.decompress(self.data).decode('utf-8'))
+
+class Invoice(db.Model):
+    """Local mirror of a Stripe invoice, kept current from invoice.* webhooks"""
+    __tablename__ = 'invoices'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    stripe_invoice_id = db.Column(db.String(100), nullable=False, unique=True)
+    stripe_customer_id = db.Column(db.String(100), nullable=False)
+    stripe_subscription_id = db.Column(db.String(100), nullable=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True, index=True)
+    status = db.Column(db.String(20), nullable=True)  # draft, open, paid, uncollectible, void
+    amount_paid = db.Column(db.Numeric(10, 2), default=0, nullable=False)
+    amount_due = db.Column(db.Numeric(10, 2), default=0, nullable=False)
+    currency = db.Column(db.String(3), default='usd', nullable=False)
+    description = db.Column(db.String(255), nullable=True)
+    invoice_pdf = db.Column(db.String(500), nullable=True)
+    hosted_invoice_url = db.Column(db.String(500), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)  # Stripe's invoice creation time
+    stripe_updated_at = db.Column(db.Integer, default=0, nullable=False)  # Unix time of the event or fetch this state came from
+    
+    __table_args__ = (
+        db.Index('ix_invoices_customer_created', 'stripe_customer_id', 'created_at'),
+    )
+
+class StripeInvoiceBackfill(db.Model):
+    """Customers whose invoice history has been copied from Stripe once"""
+    __tablename__ = 'stripe_invoice_backfills'
+    
+    stripe_customer_id = db.Column(db.String(100), primary_key=True)
+    invoice_count = db.Column(db.Integer, default=0, nullable=False)
+    backfilled_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+class StripeWebhookInbox(db.Model):
+    """Verified Stripe webhook events stored before processing"""
+    __tablename__ = 'stripe_webhook_inbox'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    stripe_event_id = db.Column(db.String(100), nullable=False, unique=True)
+    event_type = db.Column(db.String(100), nullable=False)
+    source = db.Column(db.String(20), default='stripe', nullable=False)  # Endpoint that received it: stripe, whop, enhanced
+    ordering_key = db.Column(db.String(100), nullable=False)  # Customer id; events per key run in order
+    payload = db.Column(db.Text, nullable=False)  # Raw verified event JSON
+    status = db.Column(db.String(20), default='received', nullable=False)  # received, processing (leased), running (claimed), processed, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    last_error = db.Column(db.String(500), nullable=True)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    processed_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        db.Index('ix_stripe_inbox_status_due', 'status', 'next_attempt_at'),
+        db.Index('ix_stripe_inbox_ordering', 'ordering_key', 'status', 'id'),
+    )
 
 # NEW: Model to track revenue analytics
 class RevenueAnalytics(db.Model):
@@ -378,6 +643,13 @@ class RevenueAnalytics(db.Model):
     
     __table_args__ = (db.UniqueConstraint('date', name='unique_daily_analytics'),)
     
+class RollupWatermark(db.Model):
+    """How far an incremental rollup job has read its source table"""
+    __tablename__ = 'rollup_watermarks'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    last_source_id = db.Column(db.Integer, default=0, nullable=False)
+    last_run_at = db.Column(db.DateTime, nullable=True)
 
 class Category(db.Model):
     __tablename__ = 'categories'
@@ -492,6 +764,48 @@ class Notification(db.Model):
     
     # Foreign Keys
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    
+    # Composite indexes for the per-user feed and unread lookups
+    __table_args__ = (
+        db.Index('ix_notifications_user_read_created', 'user_id', 'is_read', 'created_at'),
+        db.Index('ix_notifications_user_created', 'user_id', 'created_at'),
+    )
+
+class BroadcastMessage(db.Model):
+    """A notification sent to an audience, stored once instead of once per user"""
+    __tablename__ = 'broadcast_messages'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    title = db.Column(db.String(200), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    notification_type = db.Column(db.String(50), nullable=False)  # 'new_video', 'live_stream', 'system'
+    audience = db.Column(db.String(20), default='all', nullable=False, index=True)  # 'all', 'premium', 'free', 'direct'
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+class BroadcastReceipt(db.Model):
+    """Per-user delivery/read state for a broadcast; only written when it differs from the watermarks"""
+    __tablename__ = 'broadcast_receipts'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    is_read = db.Column(db.Boolean, default=False, nullable=False)
+    is_cleared = db.Column(db.Boolean, default=False, nullable=False)
+    
+    # Foreign Keys
+    broadcast_id = db.Column(db.Integer, db.ForeignKey('broadcast_messages.id', ondelete='CASCADE'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    
+    # Composite unique constraint (also serves user_id lookups)
+    __table_args__ = (db.UniqueConstraint('user_id', 'broadcast_id', name='unique_user_broadcast_receipt'),)
+
+class NotificationState(db.Model):
+    """Per-user broadcast watermarks: everything at or below an id is read / cleared"""
+    __tablename__ = 'notification_states'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    broadcast_read_through = db.Column(db.Integer, default=0, nullable=False)
+    broadcast_cleared_through = db.Column(db.Integer, default=0, nullable=False)
+    unread_count = db.Column(db.Integer, default=0, nullable=False)  # Unread direct notifications, kept in step on insert/read
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
 class Recommendation(db.Model):
     __tablename__ = 'recommendations'
@@ -868,54 +1182,59 @@ def stripe_webhook_whop():
         print(f"❌ Webhook signature verification failed: {e}")
         return jsonify({'error': 'Invalid signature'}), 400
     
-    try:
-        event_type = event['type']
-        event_data = event['data']['object']
-        
-        print(f"📡 Received webhook: {event_type}")
-        
-        if event_type == 'customer.subscription.created':
-            # Get customer data
-            customer = stripe.Customer.retrieve(event_data['customer'])
-            
-            # Check if this is a Whop transaction
-            is_whop, whop_price_id = is_whop_transaction(event_data, customer)
-            
-            if is_whop:
-                print(f"🛍️ Detected Whop transaction!")
-                handle_whop_subscription_created(event_data, customer)
-            else:
-                print(f"💳 Processing direct subscription")
-                handle_subscription_created(event_data)
+    # Store the verified event and acknowledge; a background worker processes it
+    if stripe_webhook_queue.ingest(event, payload, source='whop') is None:
+        print(f"↩️ Duplicate Stripe event {event['id']} acknowledged")
+        return jsonify({'success': True, 'duplicate': True})
+    
+    return jsonify({'success': True, 'queued': True})
+
+
+def dispatch_whop_stripe_event(event):
+    """Process a stored event received on the Whop webhook endpoint"""
+    event_type = event['type']
+    event_data = event['data']['object']
+    
+    print(f"📡 Processing webhook: {event_type}")
+    
+    if event_type == 'customer.subscription.created':
+        # Get customer data
+        customer = stripe.Customer.retrieve(event_data['customer'])
         
-        elif event_type == 'invoice.payment_succeeded':
-            # Check if this could be a Whop payment
-            customer = stripe.Customer.retrieve(event_data['customer'])
-            
-            # Look for existing Whop transaction
-            whop_transaction = WhopTransaction.query.filter_by(
-                stripe_customer_id=customer['id']
-            ).first()
-            
-            if whop_transaction:
-                print(f"🛍️ Processing Whop payment for existing transaction")
-                handle_whop_payment_succeeded(event_data, customer, whop_transaction)
-            else:
-                print(f"💳 Processing direct payment")
-                handle_payment_succeeded(event_data)
+        # Check if this is a Whop transaction
+        is_whop, whop_price_id = is_whop_transaction(event_data, customer)
         
+        if is_whop:
+            print(f"🛍️ Detected Whop transaction!")
+            handle_whop_subscription_created(event_data, customer)
         else:
-            # Handle other webhook events normally
-            if event_type == 'customer.subscription.updated':
-                handle_subscription_updated(event['data']['object'])
-            elif event_type == 'customer.subscription.deleted':
-                handle_subscription_deleted(event['data']['object'])
+            print(f"💳 Processing direct subscription")
+            handle_subscription_created(event_data)
+    
+    elif event_type == 'invoice.payment_succeeded':
+        # Check if this could be a Whop payment
+        customer = stripe.Customer.retrieve(event_data['customer'])
         
-        return jsonify({'success': True})
+        # Look for existing Whop transaction
+        whop_transaction = WhopTransaction.query.filter_by(
+            stripe_customer_id=customer['id']
+        ).first()
         
-    except Exception as e:
-        print(f"❌ Error processing webhook: {e}")
-        return jsonify({'error': str(e)}), 500
+        if whop_transaction:
+            print(f"🛍️ Processing Whop payment for existing transaction")
+            handle_whop_payment_succeeded(event_data, customer, whop_transaction)
+        else:
+            print(f"💳 Processing direct payment")
+            handle_payment_succeeded(event_data)
+    
+    else:
+        # Handle other webhook events normally
+        if event_type == 'customer.subscription.updated':
+            handle_subscription_updated(event['data']['object'])
+        elif event_type == 'customer.subscription.deleted':
+            handle_subscription_deleted(event['data']['object'])
+    
+    log_stripe_event(event)
 
 def create_serializer():
     return URLSafeTimedSerializer(app.config['SECRET_KEY'])
@@ -934,174 +1253,309 @@ def verify_reset_token(token, expiration=3600):
     except:
         return None
 
+# Compiled email templates, loaded once per process
+_email_templates = {}
+_email_templates_lock = threading.Lock()
+
+
+def get_email_template(name):
+    """Return a compiled template from templates/emails, compiling it only once"""
+    template = _email_templates.get(name)
+    if template is None:
+        with _email_templates_lock:
+            template = _email_templates.get(name)
+            if template is None:
+                template = app.jinja_env.get_template(f'emails/{name}')
+                _email_templates[name] = template
+    return template
+
+
 def send_reset_email(user, token):
-    """Send password reset email to user"""
+    """Queue password reset email to user"""
     try:
         reset_url = url_for('reset_password', token=token, _external=True)
         
-        # Create HTML email content
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>Password Reset - TGFX Trade Lab</title>
-            <style>
-                body {{
-                    font-family: 'Inter', -apple-system, BlinkMacSystemFont, sans-serif;
-                    background-color: #0a0a0a;
-                    color: #ffffff;
-                    margin: 0;
-                    padding: 20px;
-                }}
-                .container {{
-                    max-width: 600px;
-                    margin: 0 auto;
-                    background: linear-gradient(135deg, #141414 0%, #1a1a1a 100%);
-                    border-radius: 20px;
-                    padding: 40px;
-                    border: 1px solid rgba(16, 185, 129, 0.2);
-                }}
-                .logo {{
-                    text-align: center;
-                    font-size: 2rem;
-                    font-weight: 800;
-                    background: linear-gradient(135deg, #10B981 0%, #059669 100%);
-                    -webkit-background-clip: text;
-                    -webkit-text-fill-color: transparent;
-                    margin-bottom: 30px;
-                }}
-                .content {{
-                    line-height: 1.6;
-                    color: #e5e7eb;
-                }}
-                .button {{
-                    display: inline-block;
-                    background: linear-gradient(135deg, #10B981 0%, #059669 100%);
-                    color: white;
-                    padding: 12px 32px;
-                    text-decoration: none;
-                    border-radius: 12px;
-                    font-weight: 600;
-                    margin: 20px 0;
-                    text-align: center;
-                }}
-                .button:hover {{
-                    transform: translateY(-2px);
-                    box-shadow: 0 8px 25px rgba(16, 185, 129, 0.3);
-                }}
-                .footer {{
-                    margin-top: 30px;
-                    padding-top: 20px;
-                    border-top: 1px solid rgba(255, 255, 255, 0.08);
-                    font-size: 0.875rem;
-                    color: #9ca3af;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="logo">TGFX Trade Lab</div>
-                
-                <div class="content">
-                    <h2 style="color: #ffffff; margin-bottom: 20px;">Reset Your Password</h2>
-                    
-                    <p>Hello {user.username},</p>
-                    
-                    <p>You requested a password reset for your TGFX Trade Lab account. Click the button below to reset your password:</p>
-                    
-                    <div style="text-align: center;">
-                        <a href="{reset_url}" class="button">Reset My Password</a>
-                    </div>
-                    
-                    <p><strong>This link will expire in 1 hour.</strong></p>
-                    
-                    <p>If you didn't request this password reset, you can safely ignore this email. Your password will remain unchanged.</p>
-                    
-                    <p>If the button doesn't work, you can copy and paste this link into your browser:</p>
-                    <p style="word-break: break-all; color: #10B981;">{reset_url}</p>
-                </div>
-                
-                <div class="footer">
-                    <p>This email was sent by TGFX Trade Lab. If you have any questions, please contact our support team.</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-        
-        # Create plain text version
-        text_content = f"""
-        TGFX Trade Lab - Password Reset
-        
-        Hello {user.username},
-        
-        You requested a password reset for your TGFX Trade Lab account.
-        
-        Click this link to reset your password: {reset_url}
-        
-        This link will expire in 1 hour.
-        
-        If you didn't request this password reset, you can safely ignore this email.
-        
-        Best regards,
-        TGFX Trade Lab Team
-        """
+        html_content = get_email_template('reset_password.html').render(username=user.username, reset_url=reset_url)
+        text_content = get_email_template('reset_password.txt').render(username=user.username, reset_url=reset_url)
         
-        # Send using Flask-Mail if configured, otherwise use basic SMTP
-        try:
-            msg = Message(
-                subject='Reset Your Password - TGFX Trade Lab',
-                recipients=[user.email],
-                html=html_content,
-                body=text_content
-            )
-            mail.send(msg)
-            print(f"✅ Password reset email sent to {user.email}")
-            return True
-        except Exception as e:
-            print(f"❌ Flask-Mail failed: {e}")
-            # Fallback to basic SMTP
-            return send_email_smtp(user.email, 'Reset Your Password - TGFX Trade Lab', html_content, text_content)
+        return send_email_smtp(user.email, 'Reset Your Password - TGFX Trade Lab', html_content, text_content)
             
     except Exception as e:
         print(f"❌ Error sending reset email: {e}")
         return False
 
-def send_email_smtp(to_email, subject, html_content, text_content):
-    """Fallback SMTP email sending"""
-    try:
-        from_email = app.config.get('MAIL_USERNAME')
-        password = app.config.get('MAIL_PASSWORD')
-        smtp_server = app.config.get('MAIL_SERVER', 'smtp.gmail.com')
-        smtp_port = app.config.get('MAIL_PORT', 587)
+
+class SMTPConnectionPool:
+    """
+    Keeps authenticated SMTP sessions open so STARTTLS and login happen once
+    per connection instead of once per email. Connections are health-checked
+    with NOOP before reuse and recycled after MAX_MESSAGES_PER_CONNECTION
+    messages or MAX_IDLE_SECONDS of inactivity.
+    """
+    
+    MAX_MESSAGES_PER_CONNECTION = 100
+    MAX_IDLE_SECONDS = 60
+    CONNECT_TIMEOUT = 15
+    
+    def __init__(self, flask_app, size=2):
+        self.app = flask_app
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = 0
+    
+    def _settings(self):
+        config = self.app.config
+        return {
+            'server': config.get('MAIL_SERVER', 'smtp.gmail.com'),
+            'port': config.get('MAIL_PORT', 587),
+            'use_tls': config.get('MAIL_USE_TLS', True),
+            'use_ssl': config.get('MAIL_USE_SSL', False),
+            'username': config.get('MAIL_USERNAME'),
+            'password': config.get('MAIL_PASSWORD')
+        }
+    
+    def _connect(self):
+        settings = self._settings()
+        if settings['use_ssl']:
+            server = smtplib.SMTP_SSL(settings['server'], settings['port'], timeout=self.CONNECT_TIMEOUT)
+        else:
+            server = smtplib.SMTP(settings['server'], settings['port'], timeout=self.CONNECT_TIMEOUT)
+            if settings['use_tls']:
+                server.starttls()
         
-        if not all([from_email, password]):
-            print("❌ Email credentials not configured")
-            return False
+        # Local sinks used in development don't advertise AUTH
+        server.ehlo_or_helo_if_needed()
+        if settings['username'] and settings['password'] and server.has_extn('auth'):
+            server.login(settings['username'], settings['password'])
+        
+        print(f"📡 SMTP connection opened to {settings['server']}:{settings['port']}")
+        return {'server': server, 'sent': 0, 'last_used': time.time()}
+    
+    def acquire(self):
+        """Return a healthy pooled connection, opening one if none are idle"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            
+            if time.time() - conn['last_used'] > self.MAX_IDLE_SECONDS:
+                self._close(conn)
+                continue
+            try:
+                if conn['server'].noop()[0] == 250:
+                    return conn
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            self._close(conn)
+        
+        with self._lock:
+            self._open += 1
+        try:
+            return self._connect()
+        except Exception:
+            with self._lock:
+                self._open -= 1
+            raise
+    
+    def release(self, conn, broken=False):
+        """Return a connection to the pool, or close it if broken or worn out"""
+        conn['last_used'] = time.time()
+        if broken or conn['sent'] >= self.MAX_MESSAGES_PER_CONNECTION or self._idle.qsize() >= self.size:
+            self._close(conn)
+        else:
+            self._idle.put(conn)
+    
+    def _close(self, conn):
+        with self._lock:
+            self._open = max(self._open - 1, 0)
+        try:
+            conn['server'].quit()
+        except Exception:
+            try:
+                conn['server'].close()
+            except Exception:
+                pass
+    
+    def send(self, msg):
+        """Send one MIME message over a pooled connection"""
+        conn = self.acquire()
+        try:
+            conn['server'].send_message(msg)
+            conn['sent'] += 1
+        except smtplib.SMTPRecipientsRefused:
+            # The session is fine; the address is not
+            self.release(conn)
+            raise
+        except Exception:
+            self.release(conn, broken=True)
+            raise
+        self.release(conn)
+    
+    def prune_idle(self):
+        """Close connections idle longer than MAX_IDLE_SECONDS so servers don't drop them on us"""
+        keep = []
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if time.time() - conn['last_used'] > self.MAX_IDLE_SECONDS:
+                self._close(conn)
+            else:
+                keep.append(conn)
+        for conn in reversed(keep):
+            self._idle.put(conn)
+    
+    def close_all(self):
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                return
+    
+    @property
+    def open_connections(self):
+        return self._open
+
+
+class MailQueue:
+    """
+    Background email delivery over SMTPConnectionPool.
+    
+    Requests only build the message and enqueue it. A worker sends queued
+    mail over pooled connections and retries transient failures with
+    exponential backoff up to MAX_ATTEMPTS.
+    
+    The queue is in memory only: mail still queued or waiting on a retry
+    when the process stops (password resets included) is lost, and the user
+    has to request it again.
+    """
+    
+    MAX_ATTEMPTS = 5
+    BASE_BACKOFF_SECONDS = 5
+    MAX_BACKOFF_SECONDS = 600
+    
+    def __init__(self, flask_app, pool=None):
+        self.app = flask_app
+        self.pool = pool or SMTPConnectionPool(flask_app)
+        self._queue = queue.Queue()
+        self._retry_heap = []  # (due_at, seq, job) waiting for backoff to elapse
+        self._retry_lock = threading.Lock()
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._started = False
+        self.metrics = {
+            'enqueued': 0,
+            'sent': 0,
+            'retries': 0,
+            'failed': 0,
+            'last_error': None
+        }
+    
+    def build_message(self, to_email, subject, html_content, text_content):
+        from_email = self.app.config.get('MAIL_DEFAULT_SENDER') or self.app.config.get('MAIL_USERNAME')
         
-        msg = MimeMultipart('alternative')
+        msg = MIMEMultipart('alternative')
         msg['Subject'] = subject
         msg['From'] = from_email
         msg['To'] = to_email
         
         # Add both plain text and HTML versions
-        text_part = MimeText(text_content, 'plain')
-        html_part = MimeText(html_content, 'html')
-        
-        msg.attach(text_part)
-        msg.attach(html_part)
+        msg.attach(MIMEText(text_content, 'plain'))
+        msg.attach(MIMEText(html_content, 'html'))
+        return msg
+    
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            if socketio:
+                socketio.start_background_task(self._run)
+            else:
+                threading.Thread(target=self._run, name='mail-queue', daemon=True).start()
+            self._started = True
+    
+    def enqueue(self, to_email, subject, html_content, text_content):
+        msg = self.build_message(to_email, subject, html_content, text_content)
+        self._queue.put({'msg': msg, 'to': to_email, 'attempts': 0})
+        self.metrics['enqueued'] += 1
+        self.start()
+        return True
+    
+    def send_now(self, to_email, subject, html_content, text_content):
+        """Deliver synchronously over the pool (for admin test emails)"""
+        self.pool.send(self.build_message(to_email, subject, html_content, text_content))
+        self.metrics['sent'] += 1
+        return True
+    
+    def _next_job(self, timeout):
+        with self._retry_lock:
+            if self._retry_heap and self._retry_heap[0][0] <= time.time():
+                return heapq.heappop(self._retry_heap)[2]
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+    
+    def _run(self):
+        while True:
+            job = self._next_job(timeout=1)
+            if job is None:
+                self.pool.prune_idle()
+                continue
+            self._deliver(job)
+    
+    def _deliver(self, job):
+        job['attempts'] += 1
+        try:
+            self.pool.send(job['msg'])
+            self.metrics['sent'] += 1
+            print(f"✅ SMTP email sent successfully to {job['to']}")
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused) as e:
+            self._record_failure(job, e)
+        except Exception as e:
+            if job['attempts'] >= self.MAX_ATTEMPTS:
+                self._record_failure(job, e)
+                return
+            delay = min(self.BASE_BACKOFF_SECONDS * (2 ** (job['attempts'] - 1)), self.MAX_BACKOFF_SECONDS)
+            self.metrics['retries'] += 1
+            self.metrics['last_error'] = str(e)[:500]
+            print(f"⚠️ SMTP send to {job['to']} failed ({e}), retrying in {delay}s")
+            with self._retry_lock:
+                self._seq += 1
+                heapq.heappush(self._retry_heap, (time.time() + delay, self._seq, job))
+    
+    def _record_failure(self, job, error):
+        self.metrics['failed'] += 1
+        self.metrics['last_error'] = str(error)[:500]
+        print(f"❌ SMTP email to {job['to']} failed after {job['attempts']} attempt(s): {error}")
+    
+    def stats(self):
+        return dict(
+            self.metrics,
+            queued=self._queue.qsize(),
+            waiting_retry=len(self._retry_heap),
+            open_connections=self.pool.open_connections
+        )
+
+
+mail_queue = MailQueue(app)
+
+
+def send_email_smtp(to_email, subject, html_content, text_content):
+    """Queue an email for background SMTP delivery"""
+    try:
+        from_email = app.config.get('MAIL_DEFAULT_SENDER') or app.config.get('MAIL_USERNAME')
         
-        # Send email
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        server.login(from_email, password)
-        server.send_message(msg)
-        server.quit()
+        if not from_email:
+            print("❌ Email credentials not configured")
+            return False
         
-        print(f"✅ SMTP email sent successfully to {to_email}")
-        return True
+        return mail_queue.enqueue(to_email, subject, html_content, text_content)
         
     except Exception as e:
         print(f"❌ SMTP email failed: {e}")
@@ -1267,23 +1721,26 @@ def api_test_email():
         <p>If you receive this, your email configuration is working correctly!</p>
         """
         
-        success = send_email_smtp(
-            current_user.email,
-            'TGFX Trade Lab - Email Test',
-            test_content,
-            'This is a test email from TGFX Trade Lab.'
-        )
-        
-        if success:
-            return jsonify({
-                'success': True,
-                'message': f'Test email sent successfully to {current_user.email}'
-            })
-        else:
+        # Sent inline so configuration problems surface in the response
+        try:
+            mail_queue.send_now(
+                current_user.email,
+                'TGFX Trade Lab - Email Test',
+                test_content,
+                'This is a test email from TGFX Trade Lab.'
+            )
+        except Exception as send_error:
             return jsonify({
                 'success': False,
-                'message': 'Failed to send test email. Check your email configuration.'
+                'message': f'Failed to send test email. Check your email configuration. ({send_error})',
+                'mail_queue': mail_queue.stats()
             })
+        
+        return jsonify({
+            'success': True,
+            'message': f'Test email sent successfully to {current_user.email}',
+            'mail_queue': mail_queue.stats()
+        })
             
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1691,6 +2148,85 @@ class StreamViewer(db.Model):
     # Composite unique constraint
     __table_args__ = (db.UniqueConstraint('stream_id', 'user_id', name='unique_stream_viewer'),)
 
+class RecordingUpload(db.Model):
+    """Tracks a resumable S3 multipart upload of a client-side stream recording"""
+    __tablename__ = 'recording_uploads'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    upload_id = db.Column(db.String(512), unique=True, nullable=False, index=True)  # S3 multipart UploadId
+    bucket = db.Column(db.String(255), nullable=False)
+    s3_key = db.Column(db.String(500), nullable=False)
+    content_type = db.Column(db.String(100), default='video/webm', nullable=False)
+    status = db.Column(db.String(20), default='in_progress', nullable=False, index=True)  # in_progress, completed, aborted
+    s3_url = db.Column(db.String(500), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    
+    # Foreign Keys
+    stream_id = db.Column(db.Integer, db.ForeignKey('streams.id'), nullable=True, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    
+    # Relationships
+    parts = db.relationship('RecordingUploadPart', backref='upload', lazy=True, cascade='all, delete-orphan',
+                            order_by='RecordingUploadPart.part_number')
+
+class RecordingUploadPart(db.Model):
+    """ETag of one uploaded part, so an interrupted upload can resume where it stopped"""
+    __tablename__ = 'recording_upload_parts'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    part_number = db.Column(db.Integer, nullable=False)
+    etag = db.Column(db.String(100), nullable=False)
+    size = db.Column(db.BigInteger, default=0, nullable=False)
+    uploaded_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    # Foreign Keys
+    recording_upload_id = db.Column(db.Integer, db.ForeignKey('recording_uploads.id'), nullable=False, index=True)
+    
+    # Composite unique constraint
+    __table_args__ = (db.UniqueConstraint('recording_upload_id', 'part_number', name='unique_upload_part'),)
+
+class RecordingFinalizeJob(db.Model):
+    """Durable state of a stopped stream's recording pipeline, so a restart can resume it"""
+    __tablename__ = 'recording_finalize_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    job_id = db.Column(db.String(12), unique=True, nullable=False)
+    duration_minutes = db.Column(db.Integer, default=0, nullable=False)
+    status = db.Column(db.String(20), default='queued', nullable=False)  # queued, running, completed, failed
+    stage = db.Column(db.String(20), nullable=True)  # Last stage started; earlier stages are done
+    recording_url = db.Column(db.String(500), nullable=True)
+    recording_saved = db.Column(db.Boolean, default=False, nullable=False)
+    video_created = db.Column(db.Boolean, default=False, nullable=False)
+    video_id = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.String(500), nullable=True)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    lease_until = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # A 'running' job past this was abandoned
+    queued_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    # Foreign Keys
+    stream_id = db.Column(db.Integer, db.ForeignKey('streams.id'), nullable=False, index=True)
+    
+    __table_args__ = (db.Index('ix_recording_jobs_status_lease', 'status', 'lease_until'),)
+    
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'stream_id': self.stream_id,
+            'duration_minutes': self.duration_minutes,
+            'status': self.status,
+            'stage': self.stage,
+            'recording_url': self.recording_url,
+            'recording_saved': self.recording_saved,
+            'video_created': self.video_created,
+            'video_id': self.video_id,
+            'error': self.error,
+            'attempts': self.attempts,
+            'queued_at': self.queued_at.isoformat() if self.queued_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
 # Forms
 class LoginForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired()])
@@ -1864,9 +2400,265 @@ def migrate_category_background_images():
         print(f"❌ Error migrating category background images: {e}")
         return False
 
-def send_discord_webhook(title, description, color=5814783, fields=None, thumbnail_url=None, footer_text=None):
-    """
-    Send Discord webhook with simplified, public-friendly messaging
+class DiscordWebhookOutbox(db.Model):
+    """Durable queue of Discord embeds waiting to be delivered"""
+    __tablename__ = 'discord_webhook_outbox'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    webhook_url = db.Column(db.String(500), nullable=False)
+    embed = db.Column(db.Text, nullable=False)  # JSON-encoded Discord embed
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    last_error = db.Column(db.String(500), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    sent_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (db.Index('ix_discord_outbox_status_due', 'status', 'next_attempt_at'),)
+
+
+class DiscordWebhookDispatcher:
+    """
+    Delivers queued Discord embeds from a background worker.
+    
+    Embeds are persisted to discord_webhook_outbox so nothing is lost on
+    restart, sent over one pooled requests.Session, batched up to Discord's
+    10 embeds per message, and retried with exponential backoff. 429
+    responses honor Discord's retry_after before the next attempt.
+    """
+    
+    MAX_EMBEDS_PER_MESSAGE = 10
+    MAX_CHARS_PER_MESSAGE = 6000  # Discord's total embed text limit per message
+    MAX_ATTEMPTS = 6
+    BASE_BACKOFF_SECONDS = 2
+    MAX_BACKOFF_SECONDS = 300
+    SENDING_LEASE_SECONDS = 60
+    IDLE_POLL_SECONDS = 5
+    REQUEST_TIMEOUT = (3, 10)
+    
+    def __init__(self, flask_app, session=None):
+        self.app = flask_app
+        self.session = session or self._build_session()
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._started = False
+        self._rate_limited_until = {}  # webhook_url -> epoch seconds
+        self.metrics = {
+            'enqueued': 0,
+            'messages_sent': 0,
+            'embeds_sent': 0,
+            'rate_limited': 0,
+            'retries': 0,
+            'failed': 0,
+            'last_latency_ms': None,
+            'last_error': None
+        }
+    
+    @staticmethod
+    def _build_session():
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=10, max_retries=0)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({"Content-Type": "application/json"})
+        return session
+    
+    def start(self):
+        """Start the delivery worker once per process"""
+        with self._lock:
+            if self._started:
+                return
+            if socketio:
+                socketio.start_background_task(self._run)
+            else:
+                threading.Thread(target=self._run, name='discord-dispatcher', daemon=True).start()
+            self._started = True
+    
+    def enqueue(self, embed, webhook_url):
+        """Persist an embed for delivery and wake the worker"""
+        row = DiscordWebhookOutbox(webhook_url=webhook_url, embed=json.dumps(embed))
+        db.session.add(row)
+        db.session.commit()
+        
+        self.metrics['enqueued'] += 1
+        self.start()
+        self._wakeup.set()
+        return row.id
+    
+    def _run(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    try:
+                        delivered = self.flush()
+                    finally:
+                        db.session.remove()
+            except Exception as e:
+                self.metrics['last_error'] = str(e)[:500]
+                print(f"❌ Discord dispatcher error: {e}")
+                delivered = 0
+            
+            if not delivered:
+                self._wakeup.wait(self.IDLE_POLL_SECONDS)
+                self._wakeup.clear()
+    
+    def flush(self, limit=50):
+        """Deliver due embeds once; returns how many were sent. Call inside an app context."""
+        now = datetime.utcnow()
+        rows = DiscordWebhookOutbox.query.filter(
+            DiscordWebhookOutbox.status.in_(['pending', 'sending']),
+            DiscordWebhookOutbox.next_attempt_at <= now
+        ).order_by(DiscordWebhookOutbox.id).limit(limit).all()
+        
+        if not rows:
+            return 0
+        
+        # Claim the rows so a crashed send is retried after the lease expires
+        lease_until = now + timedelta(seconds=self.SENDING_LEASE_SECONDS)
+        for row in rows:
+            row.status = 'sending'
+            row.next_attempt_at = lease_until
+        db.session.commit()
+        
+        delivered = 0
+        for batch in self._batches(rows):
+            delivered += self._send_batch(batch)
+        return delivered
+    
+    def _batches(self, rows):
+        """Group rows per webhook URL into messages within Discord's limits"""
+        by_url = OrderedDict()
+        for row in rows:
+            by_url.setdefault(row.webhook_url, []).append(row)
+        
+        for url_rows in by_url.values():
+            batch, batch_chars = [], 0
+            for row in url_rows:
+                embed_chars = self._embed_chars(json.loads(row.embed))
+                if batch and (len(batch) >= self.MAX_EMBEDS_PER_MESSAGE or batch_chars + embed_chars > self.MAX_CHARS_PER_MESSAGE):
+                    yield batch
+                    batch, batch_chars = [], 0
+                batch.append(row)
+                batch_chars += embed_chars
+            if batch:
+                yield batch
+    
+    @staticmethod
+    def _embed_chars(embed):
+        chars = len(embed.get('title') or '') + len(embed.get('description') or '')
+        chars += len((embed.get('footer') or {}).get('text') or '')
+        for field in embed.get('fields') or []:
+            chars += len(str(field.get('name', ''))) + len(str(field.get('value', '')))
+        return chars
+    
+    def _send_batch(self, batch):
+        webhook_url = batch[0].webhook_url
+        
+        # Respect an active rate limit without spending an attempt
+        wait_until = self._rate_limited_until.get(webhook_url, 0)
+        if wait_until > time.time():
+            self._reschedule(batch, wait_until - time.time(), count_attempt=False)
+            return 0
+        
+        payload = {
+            "embeds": [json.loads(row.embed) for row in batch],
+            "username": "TGFX Trade Lab",
+            "avatar_url": "https://tgfx-tradelab.s3.amazonaws.com/logo.png"
+        }
+        
+        started = time.perf_counter()
+        try:
+            response = self.session.post(webhook_url, json=payload, timeout=self.REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            self._reschedule(batch, None, error=str(e))
+            return 0
+        self.metrics['last_latency_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        
+        if response.status_code in (200, 204):
+            sent_at = datetime.utcnow()
+            for row in batch:
+                row.status = 'sent'
+                row.sent_at = sent_at
+                row.attempts += 1
+                row.last_error = None
+            db.session.commit()
+            
+            self.metrics['messages_sent'] += 1
+            self.metrics['embeds_sent'] += len(batch)
+            print(f"✅ Discord webhook sent: {len(batch)} embed(s)")
+            return len(batch)
+        
+        if response.status_code == 429:
+            retry_after = self._retry_after(response)
+            self._rate_limited_until[webhook_url] = time.time() + retry_after
+            self.metrics['rate_limited'] += 1
+            print(f"⏳ Discord rate limited, retrying in {retry_after:.1f}s")
+            self._reschedule(batch, retry_after, count_attempt=False, error='rate limited')
+            return 0
+        
+        error = f"HTTP {response.status_code}: {response.text[:200]}"
+        if 400 <= response.status_code < 500:
+            # Client errors won't succeed on retry (bad payload, deleted webhook)
+            self._fail(batch, error)
+        else:
+            self._reschedule(batch, None, error=error)
+        return 0
+    
+    @staticmethod
+    def _retry_after(response):
+        try:
+            return max(float(response.json().get('retry_after', 1)), 0.5)
+        except ValueError:
+            return max(float(response.headers.get('Retry-After') or response.headers.get('X-RateLimit-Reset-After') or 1), 0.5)
+    
+    def _reschedule(self, batch, delay, count_attempt=True, error=None):
+        now = datetime.utcnow()
+        for row in batch:
+            if count_attempt:
+                row.attempts += 1
+                self.metrics['retries'] += 1
+            if row.attempts >= self.MAX_ATTEMPTS:
+                row.status = 'failed'
+                self.metrics['failed'] += 1
+            else:
+                row.status = 'pending'
+                backoff = delay if delay is not None else min(
+                    self.BASE_BACKOFF_SECONDS * (2 ** max(row.attempts - 1, 0)),
+                    self.MAX_BACKOFF_SECONDS
+                )
+                row.next_attempt_at = now + timedelta(seconds=backoff)
+            if error:
+                row.last_error = error[:500]
+        if error:
+            self.metrics['last_error'] = error[:500]
+            print(f"⚠️ Discord webhook deferred: {error}")
+        db.session.commit()
+    
+    def _fail(self, batch, error):
+        for row in batch:
+            row.status = 'failed'
+            row.attempts += 1
+            row.last_error = error[:500]
+        db.session.commit()
+        self.metrics['failed'] += len(batch)
+        self.metrics['last_error'] = error[:500]
+        print(f"❌ Discord webhook failed: {error}")
+    
+    def queue_depth(self):
+        return DiscordWebhookOutbox.query.filter(
+            DiscordWebhookOutbox.status.in_(['pending', 'sending'])
+        ).count()
+
+
+discord_dispatcher = DiscordWebhookDispatcher(app)
+
+
+def send_discord_webhook(title, description, color=5814783, fields=None, thumbnail_url=None, footer_text=None):
+    """
+    Send Discord webhook with simplified, public-friendly messaging
+    
+    The embed is queued for the background dispatcher, so this returns as
+    soon as it is stored rather than waiting on Discord.
     """
     try:
         # FIXED: Use app.config instead of current_app.config
@@ -1894,30 +2686,13 @@ def send_discord_webhook(title, description, color=5814783, fields=None, thumbna
         if thumbnail_url:
             embed["thumbnail"] = {"url": thumbnail_url}
         
-        # Create webhook payload
-        webhook_data = {
-            "embeds": [embed],
-            "username": "TGFX Trade Lab",
-            "avatar_url": "https://tgfx-tradelab.s3.amazonaws.com/logo.png"
-        }
-        
-        # Send webhook
-        response = requests.post(
-            webhook_url,
-            json=webhook_data,
-            headers={"Content-Type": "application/json"},
-            timeout=10
-        )
-        
-        if response.status_code == 204:
-            print(f"✅ Discord webhook sent: {title}")
-            return True
-        else:
-            print(f"❌ Discord webhook failed: {response.status_code}")
-            return False
+        discord_dispatcher.enqueue(embed, webhook_url)
+        print(f"📨 Discord webhook queued: {title}")
+        return True
             
     except Exception as e:
         print(f"❌ Discord webhook error: {e}")
+        db.session.rollback()
         return False
 
 def migrate_trading_signals_to_dual_rr():
@@ -2732,8 +3507,8 @@ def sync_user_with_stripe(user_id, stripe_customer_id=None):
             user.subscription_cancel_at_period_end = subscription.cancel_at_period_end
             
             # Determine plan type
-            if subscription.items.data:
-                price_id = subscription.items.data[0].price.id
+            if subscription['items'].data:
+                price_id = subscription['items'].data[0].price.id
                 price_ids = initialize_stripe_price_ids()
                 
                 for plan_name, plan_price_id in price_ids.items():
@@ -2763,35 +3538,75 @@ def sync_user_with_stripe(user_id, stripe_customer_id=None):
         
 
 # Manual LiveKit token generation (works perfectly without SDK)
-def generate_livekit_token(room_name, participant_identity, participant_name, is_publisher=False):
-    """Generate LiveKit JWT access token manually (100% compatible)"""
-    try:
-        livekit_api_key = app.config.get('LIVEKIT_API_KEY')
-        livekit_api_secret = app.config.get('LIVEKIT_API_SECRET')
-        
-        if not all([livekit_api_key, livekit_api_secret]):
-            print("⚠ LiveKit credentials missing - using development token")
-            return "development-token-" + uuid.uuid4().hex[:16]
-        
-        # Create video grants exactly as LiveKit expects
-        video_grants = {
+class LiveKitTokenService:
+    """Signs LiveKit access tokens and caches viewer tokens per (user, room, client) until near expiry"""
+    
+    TOKEN_TTL_SECONDS = 4 * 60 * 60  # 4 hours
+    REFRESH_MARGIN_SECONDS = 15 * 60  # Re-issue when less than 15 minutes remain
+    MAX_CACHED_TOKENS = 5000
+    
+    # Static grant templates, copied and given a room per token
+    _GRANT_TEMPLATES = {
+        True: {
             "roomJoin": True,
-            "room": room_name,
-            "canPublish": is_publisher,
-            "canPublishData": is_publisher,
+            "canPublish": True,
+            "canPublishData": True,
+            "canSubscribe": True,
+            "canUpdateOwnMetadata": False,
+            "hidden": False,
+            "recorder": False
+        },
+        False: {
+            "roomJoin": True,
+            "canPublish": False,
+            "canPublishData": False,
             "canSubscribe": True,
             "canUpdateOwnMetadata": False,
             "hidden": False,
             "recorder": False
         }
+    }
+    
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self._credentials = None
+        self._cache = OrderedDict()  # (user_id, room_name, client_id) -> token info
+        self._lock = threading.Lock()
+        self.stats = {'signed': 0, 'cache_hits': 0}
+    
+    def _get_credentials(self):
+        """Read the API key/secret once instead of on every token"""
+        if self._credentials is None:
+            api_key = self.app.config.get('LIVEKIT_API_KEY')
+            api_secret = self.app.config.get('LIVEKIT_API_SECRET')
+            if not all([api_key, api_secret]):
+                return None
+            self._credentials = (api_key, api_secret)
+        return self._credentials
+    
+    def reset(self):
+        """Drop cached credentials and tokens (e.g. after rotating the API secret)"""
+        with self._lock:
+            self._credentials = None
+            self._cache.clear()
+    
+    def sign(self, room_name, participant_identity, participant_name, is_publisher=False, now=None):
+        """Sign a single token, returning (token, expires_at)"""
+        credentials = self._get_credentials()
+        if not credentials:
+            print("⚠ LiveKit credentials missing - using development token")
+            return "development-token-" + uuid.uuid4().hex[:16], 0
         
-        # Create JWT payload
-        now = int(time.time())
-        exp = now + (4 * 60 * 60)  # 4 hours
+        api_key, api_secret = credentials
+        now = int(now or time.time())
+        exp = now + self.TOKEN_TTL_SECONDS
+        
+        video_grants = dict(self._GRANT_TEMPLATES[bool(is_publisher)])
+        video_grants["room"] = room_name
         
         payload = {
             "exp": exp,
-            "iss": livekit_api_key,
+            "iss": api_key,
             "sub": participant_identity,
             "nbf": now,
             "iat": now,
@@ -2800,32 +3615,126 @@ def generate_livekit_token(room_name, participant_identity, participant_name, is
             "metadata": ""
         }
         
-        # Generate JWT token
-        token = jwt.encode(
-            payload,
-            livekit_api_secret,
-            algorithm='HS256'
-        )
+        token = jwt.encode(payload, api_secret, algorithm='HS256')
         
         # Handle both string and bytes return
         if isinstance(token, bytes):
             token = token.decode('utf-8')
         
+        with self._lock:
+            self.stats['signed'] += 1
+        return token, exp
+    
+    def get_viewer_token(self, user_id, room_name, participant_name, client_id=None):
+        """Return a viewer token for (user, room, client), minting one when missing or near expiry.
+        
+        The token carries the participant identity, and LiveKit disconnects an
+        existing participant when another joins with the same identity. Tokens
+        are therefore only reused for the same client (the livestream page passes
+        a per-session id); without a client_id every call mints a fresh identity.
+        """
+        key = (user_id, room_name, client_id)
+        now = int(time.time())
+        
+        if client_id is not None:
+            with self._lock:
+                cached = self._cache.get(key)
+                if cached and cached['expires_at'] - now > self.REFRESH_MARGIN_SECONDS:
+                    self._cache.move_to_end(key)
+                    self.stats['cache_hits'] += 1
+                    return cached
+        
+        participant_identity = f"viewer-{user_id}-{uuid.uuid4().hex[:8]}"
+        token, expires_at = self.sign(room_name, participant_identity, participant_name, is_publisher=False, now=now)
+        token_info = {
+            'token': token,
+            'participant_identity': participant_identity,
+            'room_name': room_name,
+            'expires_at': expires_at
+        }
+        
+        # Development tokens have no expiry and aren't worth caching
+        if expires_at and client_id is not None:
+            with self._lock:
+                self._cache[key] = token_info
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.MAX_CACHED_TOKENS:
+                    self._cache.popitem(last=False)
+        
+        return token_info
+    
+    def issue_viewer_tokens(self, user_id, participant_name, streams, client_id=None):
+        """Issue viewer tokens for every stream on a page in one call, keyed by stream id"""
+        tokens_by_stream = {}
+        for stream in streams:
+            if not stream.room_name:
+                continue
+            tokens_by_stream[stream.id] = self.get_viewer_token(
+                user_id, stream.room_name, participant_name, client_id=client_id
+            )
+        return tokens_by_stream
+    
+    def invalidate_room(self, room_name):
+        """Forget cached tokens for a room that has been deleted"""
+        with self._lock:
+            for key in [key for key in self._cache if key[1] == room_name]:
+                del self._cache[key]
+
+
+livekit_tokens = LiveKitTokenService(app)
+
+
+def generate_livekit_token(room_name, participant_identity, participant_name, is_publisher=False):
+    """Generate LiveKit JWT access token manually (100% compatible)"""
+    try:
+        token, _ = livekit_tokens.sign(room_name, participant_identity, participant_name, is_publisher=is_publisher)
         return token
         
     except Exception as e:
         print(f"Error generating LiveKit token: {e}")
         return "fallback-token-" + uuid.uuid4().hex[:16]
         
+# Shared S3 clients, one per region. boto3 clients are thread-safe once built,
+# so every request reuses the same parsed service model and connection pool.
+_s3_clients = {}
+_s3_clients_lock = threading.Lock()
+
+
+def get_s3_client(region_name=None):
+    """Return the shared, pooled S3 client for a region, creating it on first use"""
+    region_name = region_name or app.config.get('AWS_REGION', 'us-east-1')
+    
+    s3_client = _s3_clients.get(region_name)
+    if s3_client is not None:
+        return s3_client
+    
+    with _s3_clients_lock:
+        s3_client = _s3_clients.get(region_name)
+        if s3_client is None:
+            client_config = BotoConfig(
+                region_name=region_name,
+                max_pool_connections=app.config.get('S3_MAX_POOL_CONNECTIONS', 50),
+                connect_timeout=app.config.get('S3_CONNECT_TIMEOUT', 5),
+                read_timeout=app.config.get('S3_READ_TIMEOUT', 60),
+                retries={'max_attempts': app.config.get('S3_MAX_ATTEMPTS', 3), 'mode': 'standard'},
+                tcp_keepalive=True
+            )
+            # Sessions aren't thread-safe, so each client gets its own
+            session = boto3.session.Session(
+                aws_access_key_id=app.config['AWS_ACCESS_KEY_ID'],
+                aws_secret_access_key=app.config['AWS_SECRET_ACCESS_KEY'],
+                region_name=region_name
+            )
+            s3_client = session.client('s3', config=client_config)
+            _s3_clients[region_name] = s3_client
+            print(f"✓ Shared S3 client created for {region_name}")
+    
+    return s3_client
+
+
 def init_s3_client():
     try:
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=app.config['AWS_ACCESS_KEY_ID'],
-            aws_secret_access_key=app.config['AWS_SECRET_ACCESS_KEY'],
-            region_name=app.config['AWS_REGION']
-        )
-        return s3_client
+        return get_s3_client()
     except (NoCredentialsError, KeyError):
         return None
 
@@ -2993,20 +3902,136 @@ def process_video_tags(video, tags_string):
             tag = get_or_create_tag(tag_name)
             video.tags.append(tag)
 
-def create_user_activity(user_id, activity_type, description):
-    """Create a new user activity record"""
-    try:
+class ActivityLogWriter:
+    """
+    Buffers user activity in-process and writes it with bulk INSERTs.
+    
+    create_user_activity() only appends to the buffer, so hot paths no longer
+    pay for a second commit. A background task flushes every FLUSH_INTERVAL
+    seconds or as soon as FLUSH_BATCH events are waiting; when the buffer hits
+    MAX_BUFFER the caller flushes inline instead of dropping events. Unflushed
+    events stay visible to reads through a small per-user ring buffer.
+    """
+    
+    FLUSH_INTERVAL = 2
+    FLUSH_BATCH = 200
+    MAX_BUFFER = 2000
+    RECENT_PER_USER = 20
+    
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self._buffer = []
+        self._recent = {}  # user_id -> deque of unflushed UserActivity objects
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._started = False
+    
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        if socketio:
+            socketio.start_background_task(self._run)
+        else:
+            threading.Thread(target=self._run, name='activity-log', daemon=True).start()
+    
+    def append(self, user_id, activity_type, description):
         activity = UserActivity(
             user_id=user_id,
             activity_type=activity_type,
             description=description,
             timestamp=datetime.utcnow()
         )
-        db.session.add(activity)
-        db.session.commit()
+        with self._lock:
+            self._buffer.append(activity)
+            self._recent.setdefault(user_id, deque(maxlen=self.RECENT_PER_USER)).append(activity)
+            pending = len(self._buffer)
+        
+        if pending >= self.MAX_BUFFER:
+            # Apply backpressure rather than growing without bound
+            self.flush()
+        else:
+            self.start()
+            if pending >= self.FLUSH_BATCH:
+                self._wakeup.set()
+    
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.FLUSH_INTERVAL)
+            self._wakeup.clear()
+            try:
+                with self.app.app_context():
+                    try:
+                        self.flush()
+                    finally:
+                        db.session.remove()
+            except Exception as e:
+                print(f"❌ Activity log flush error: {e}")
+    
+    def flush(self):
+        """Write every buffered event in one INSERT; returns the number written"""
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return 0
+        
+        rows = [{
+            'user_id': activity.user_id,
+            'activity_type': activity.activity_type,
+            'description': activity.description[:500],
+            'timestamp': activity.timestamp
+        } for activity in batch]
+        
+        try:
+            # Separate connection so a caller's open transaction isn't committed early
+            with db.engine.begin() as connection:
+                connection.execute(db.insert(UserActivity.__table__), rows)
+        except Exception as e:
+            print(f"❌ Error writing {len(rows)} user activities: {e}")
+            with self._lock:
+                # Keep them for the next flush, without exceeding the bound
+                self._buffer = (batch + self._buffer)[-self.MAX_BUFFER:]
+            return 0
+        
+        flushed = set(map(id, batch))
+        with self._lock:
+            for user_id in {activity.user_id for activity in batch}:
+                recent = self._recent.get(user_id)
+                if recent is None:
+                    continue
+                remaining = [activity for activity in recent if id(activity) not in flushed]
+                if remaining:
+                    self._recent[user_id] = deque(remaining, maxlen=self.RECENT_PER_USER)
+                else:
+                    del self._recent[user_id]
+        return len(rows)
+    
+    def pending_for_user(self, user_id):
+        with self._lock:
+            return list(self._recent.get(user_id, ()))
+
+
+activity_log = ActivityLogWriter(app)
+
+
+def create_user_activity(user_id, activity_type, description):
+    """Record a user activity; written to the database in the next batch"""
+    try:
+        activity_log.append(user_id, activity_type, description)
     except Exception as e:
         print(f"Error creating user activity: {e}")
-        db.session.rollback()
+
+
+def get_recent_user_activity(user_id, limit=5):
+    """Most recent activity for a user, including events not yet flushed"""
+    pending = activity_log.pending_for_user(user_id)
+    stored = UserActivity.query.filter_by(user_id=user_id)\
+                               .order_by(UserActivity.timestamp.desc())\
+                               .limit(limit).all()
+    
+    combined = sorted(pending + stored, key=lambda activity: activity.timestamp, reverse=True)
+    return combined[:limit]
 
 def convert_empty_strings_to_none(data, integer_fields):
     """Convert empty strings to None for integer fields"""
@@ -3030,21 +4055,204 @@ def create_notification(user_id, title, message, notification_type):
         notification_type=notification_type
     )
     db.session.add(notification)
+    db.session.flush()
+    adjust_unread_counter(user_id, 1)
     db.session.commit()
 
-def broadcast_notification(title, message, notification_type, target_users='all'):
-    """Send notification to multiple users"""
-    if target_users == 'all':
-        users = User.query.all()
-    elif target_users == 'premium':
-        users = User.query.filter_by(has_subscription=True).all()
-    elif target_users == 'free':
-        users = User.query.filter_by(has_subscription=False).all()
-    else:
-        users = []
+def get_notification_state(user_id, create=False):
+    """Load a user's broadcast watermarks and unread counter; missing rows read as zero"""
+    state = NotificationState.query.get(user_id)
+    if state is None:
+        state = NotificationState(user_id=user_id, broadcast_read_through=0, broadcast_cleared_through=0, unread_count=0)
+        if create:
+            # First touch backfills the counter from the (user_id, is_read, created_at) index
+            state.unread_count = Notification.query.filter_by(user_id=user_id, is_read=False).count()
+            db.session.add(state)
+    return state
+
+def adjust_unread_counter(user_id, delta):
+    """Atomically move a user's unread counter, never below zero"""
+    new_count = NotificationState.unread_count + delta
+    updated = NotificationState.query.filter_by(user_id=user_id).update(
+        {NotificationState.unread_count: db.case((new_count < 0, 0), else_=new_count)},
+        synchronize_session=False
+    )
+    if not updated:
+        # No state row yet; creating one counts the rows already written
+        get_notification_state(user_id, create=True)
+
+def reset_unread_counter(user_id):
+    state = get_notification_state(user_id, create=True)
+    state.unread_count = 0
+
+def user_broadcast_audiences(user):
+    """Broadcast audiences a user belongs to, evaluated at read time"""
+    return ['all', 'premium' if user.has_subscription else 'free']
+
+def visible_broadcasts_query(user, state, unread_only=False):
+    """
+    Broadcasts a user can see, with their receipt's read flag.
+    
+    Audience broadcasts are visible from signup onwards; 'direct' ones only
+    through a receipt. Everything at or below the cleared watermark is hidden,
+    and everything at or below the read watermark counts as read.
+    """
+    query = db.session.query(BroadcastMessage, BroadcastReceipt.is_read).outerjoin(
+        BroadcastReceipt,
+        db.and_(
+            BroadcastReceipt.broadcast_id == BroadcastMessage.id,
+            BroadcastReceipt.user_id == user.id
+        )
+    ).filter(
+        BroadcastMessage.id > state.broadcast_cleared_through,
+        db.or_(BroadcastReceipt.is_cleared.is_(None), BroadcastReceipt.is_cleared == False),
+        db.or_(
+            db.and_(
+                BroadcastMessage.audience.in_(user_broadcast_audiences(user)),
+                BroadcastMessage.created_at >= user.created_at
+            ),
+            BroadcastReceipt.id.isnot(None)
+        )
+    )
     
-    for user in users:
-        create_notification(user.id, title, message, notification_type)
+    if unread_only:
+        query = query.filter(
+            BroadcastMessage.id > state.broadcast_read_through,
+            db.or_(BroadcastReceipt.is_read.is_(None), BroadcastReceipt.is_read == False)
+        )
+    
+    return query
+
+def notification_feed_item(source, item_id, title, message, notification_type, is_read, created_at):
+    return {
+        'id': item_id,
+        'source': source,  # 'direct' rows live in notifications, 'broadcast' rows in broadcast_messages
+        'title': title,
+        'message': message,
+        'notification_type': notification_type,
+        'type': notification_type,
+        'is_read': is_read,
+        'created_at': created_at
+    }
+
+def get_user_notification_feed(user, limit=20, unread_only=False):
+    """Newest direct notifications and broadcasts for a user, merged by time"""
+    state = get_notification_state(user.id)
+    
+    direct_query = Notification.query.filter_by(user_id=user.id)
+    if unread_only:
+        direct_query = direct_query.filter_by(is_read=False)
+    direct = direct_query.order_by(Notification.created_at.desc()).limit(limit).all()
+    
+    broadcasts = visible_broadcasts_query(user, state, unread_only=unread_only)\
+        .order_by(BroadcastMessage.id.desc()).limit(limit).all()
+    
+    feed = [
+        notification_feed_item('direct', n.id, n.title, n.message, n.notification_type, n.is_read, n.created_at)
+        for n in direct
+    ]
+    feed.extend(
+        notification_feed_item(
+            'broadcast', b.id, b.title, b.message, b.notification_type,
+            bool(receipt_read) or b.id <= state.broadcast_read_through, b.created_at
+        )
+        for b, receipt_read in broadcasts
+    )
+    feed.sort(key=lambda item: item['created_at'], reverse=True)
+    return feed[:limit]
+
+def count_unread_notifications(user):
+    """
+    Unread count for the notification bell: the cached direct counter (one
+    primary key lookup) plus broadcasts above the read watermark.
+    """
+    state = NotificationState.query.get(user.id)
+    if state is None:
+        state = get_notification_state(user.id, create=True)
+        db.session.commit()
+    
+    broadcast_unread = visible_broadcasts_query(user, state, unread_only=True).count()
+    return state.unread_count + broadcast_unread
+
+def mark_notification_read(user, notification_id):
+    """Mark one direct notification read; returns False if it doesn't belong to the user"""
+    updated = Notification.query.filter_by(
+        id=notification_id,
+        user_id=user.id,
+        is_read=False
+    ).update({'is_read': True}, synchronize_session=False)
+    
+    if updated:
+        adjust_unread_counter(user.id, -1)
+        return True
+    
+    return db.session.query(
+        Notification.query.filter_by(id=notification_id, user_id=user.id).exists()
+    ).scalar()
+
+def mark_all_notifications_read(user):
+    """One UPDATE for direct notifications, one watermark move for broadcasts"""
+    Notification.query.filter_by(
+        user_id=user.id,
+        is_read=False
+    ).update({'is_read': True}, synchronize_session=False)
+    reset_unread_counter(user.id)
+    mark_all_broadcasts_read(user)
+
+def clear_all_notifications(user):
+    Notification.query.filter_by(user_id=user.id).delete(synchronize_session=False)
+    reset_unread_counter(user.id)
+    clear_all_broadcasts(user)
+
+def _latest_broadcast_id():
+    return db.session.query(db.func.max(BroadcastMessage.id)).scalar() or 0
+
+def mark_broadcast_read(user, broadcast_id):
+    """Record a read receipt for one broadcast; returns False if it isn't visible to the user"""
+    state = get_notification_state(user.id)
+    if not visible_broadcasts_query(user, state).filter(BroadcastMessage.id == broadcast_id).first():
+        return False
+    
+    if broadcast_id <= state.broadcast_read_through:
+        return True
+    
+    receipt = BroadcastReceipt.query.filter_by(user_id=user.id, broadcast_id=broadcast_id).first()
+    if receipt:
+        receipt.is_read = True
+    else:
+        db.session.add(BroadcastReceipt(user_id=user.id, broadcast_id=broadcast_id, is_read=True))
+    return True
+
+def mark_all_broadcasts_read(user):
+    """Advance the read watermark past every existing broadcast"""
+    state = get_notification_state(user.id, create=True)
+    state.broadcast_read_through = max(state.broadcast_read_through, _latest_broadcast_id())
+    below_watermark = db.and_(
+        BroadcastReceipt.user_id == user.id,
+        BroadcastReceipt.broadcast_id <= state.broadcast_read_through,
+        BroadcastReceipt.is_cleared == False
+    )
+    direct_ids = db.select(BroadcastMessage.id).where(BroadcastMessage.audience == 'direct')
+    
+    # Audience receipts below the watermark carry no extra information; direct
+    # broadcasts are only visible through their receipt, so those are kept as read
+    BroadcastReceipt.query.filter(
+        below_watermark, BroadcastReceipt.broadcast_id.not_in(direct_ids)
+    ).delete(synchronize_session=False)
+    BroadcastReceipt.query.filter(
+        below_watermark, BroadcastReceipt.broadcast_id.in_(direct_ids), BroadcastReceipt.is_read == False
+    ).update({'is_read': True}, synchronize_session=False)
+
+def clear_all_broadcasts(user):
+    """Hide every existing broadcast for the user"""
+    state = get_notification_state(user.id, create=True)
+    latest_id = _latest_broadcast_id()
+    state.broadcast_cleared_through = max(state.broadcast_cleared_through, latest_id)
+    state.broadcast_read_through = max(state.broadcast_read_through, latest_id)
+    BroadcastReceipt.query.filter(
+        BroadcastReceipt.user_id == user.id,
+        BroadcastReceipt.broadcast_id <= state.broadcast_cleared_through
+    ).delete(synchronize_session=False)
 
 def get_category_progress(category_id, user_progress):
     category = Category.query.get(category_id)
@@ -3133,67 +4341,13 @@ def create_livekit_room(room_name, streamer_name):
 def delete_livekit_room(room_name):
     """Mark room as deleted - actual deletion handled by LiveKit server"""
     try:
+        livekit_tokens.invalidate_room(room_name)
         print(f"✓ Room marked for cleanup: {room_name}")
         return True
     except Exception as e:
         print(f"Error in room cleanup: {e}")
         return True
 
-def generate_livekit_token(room_name, participant_identity, participant_name, is_publisher=False):
-    """Generate LiveKit JWT access token manually (100% compatible)"""
-    try:
-        livekit_api_key = app.config.get('LIVEKIT_API_KEY')
-        livekit_api_secret = app.config.get('LIVEKIT_API_SECRET')
-        
-        if not all([livekit_api_key, livekit_api_secret]):
-            print("⚠ LiveKit credentials missing - using development token")
-            return "development-token-" + uuid.uuid4().hex[:16]
-        
-        # Create video grants exactly as LiveKit expects
-        video_grants = {
-            "roomJoin": True,
-            "room": room_name,
-            "canPublish": is_publisher,
-            "canPublishData": is_publisher,
-            "canSubscribe": True,
-            "canUpdateOwnMetadata": False,
-            "hidden": False,
-            "recorder": False
-        }
-        
-        # Create JWT payload following LiveKit specification
-        now = int(time.time())
-        exp = now + (4 * 60 * 60)  # 4 hours
-        
-        payload = {
-            "exp": exp,
-            "iss": livekit_api_key,
-            "sub": participant_identity,
-            "nbf": now,
-            "iat": now,
-            "name": participant_name,
-            "video": video_grants,
-            "metadata": ""
-        }
-        
-        # Generate JWT token
-        token = jwt.encode(
-            payload,
-            livekit_api_secret,
-            algorithm='HS256'
-        )
-        
-        # Handle both string and bytes return
-        if isinstance(token, bytes):
-            token = token.decode('utf-8')
-        
-        print(f"✓ Generated LiveKit token for {participant_name}")
-        return token
-        
-    except Exception as e:
-        print(f"Error generating LiveKit token: {e}")
-        return "fallback-token-" + uuid.uuid4().hex[:16]
-
 def start_livekit_recording(room_name):
     """Recording handled by LiveKit Cloud"""
     print(f"Recording for {room_name} - handled by LiveKit Cloud")
@@ -3243,9 +4397,334 @@ def upload_recording_to_s3(local_file_path, stream_id, streamer_name):
         s3_url = f"https://{bucket}.s3.amazonaws.com/{s3_key}"
         return s3_url
         
-    except ClientError as e:
-        print(f"Error uploading recording to S3: {e}")
-        return None
+    except ClientError as e:
+        print(f"Error uploading recording to S3: {e}")
+        return None
+
+class StripeEventDeduplicator:
+    """
+    Makes Stripe webhook handling idempotent by event id.
+    
+    A small in-process LRU answers repeat deliveries without a query; the
+    unique index on stripe_webhook_inbox.stripe_event_id is the source of
+    truth across processes, so a concurrent or retried delivery loses the
+    insert race and is acknowledged as a duplicate.
+    """
+    
+    MAX_CACHED_EVENTS = 10000
+    
+    def __init__(self):
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def seen(self, event_id):
+        with self._lock:
+            if event_id in self._seen:
+                self._seen.move_to_end(event_id)
+                return True
+        return False
+    
+    def remember(self, event_id):
+        if not event_id:
+            return
+        with self._lock:
+            self._seen[event_id] = True
+            self._seen.move_to_end(event_id)
+            while len(self._seen) > self.MAX_CACHED_EVENTS:
+                self._seen.popitem(last=False)
+
+
+stripe_event_deduplicator = StripeEventDeduplicator()
+
+
+class StripeWebhookQueue:
+    """
+    Acknowledge-then-process pipeline for Stripe webhooks.
+    
+    ingest() stores the verified raw event in stripe_webhook_inbox and the
+    route returns 200 straight away. Background lanes process stored events
+    with the same dispatch code the routes used to run inline. Events for one
+    customer always hash to the same lane and are handled in id order; an
+    event waits while an earlier one for that customer is still pending.
+    Failures retry with backoff and end up as 'failed' after MAX_ATTEMPTS,
+    from where replay() can requeue them. Leasing and claiming are
+    conditional UPDATEs, so an event's handlers run in exactly one place
+    even when a replay and the poller reach it at the same time.
+    """
+    
+    LANES = 4
+    POLL_SECONDS = 5
+    BATCH_SIZE = 100
+    MAX_ATTEMPTS = 8
+    BASE_BACKOFF_SECONDS = 10
+    MAX_BACKOFF_SECONDS = 3600
+    LEASE_SECONDS = 300
+    # Statuses an event can be picked up from; 'running' only once its lease has expired
+    PENDING_STATUSES = ('received', 'processing', 'running')
+    
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self._lanes = [queue.Queue() for _ in range(self.LANES)]
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._started = False
+        self.metrics = {'ingested': 0, 'duplicates': 0, 'processed': 0, 'retries': 0, 'failed': 0}
+    
+    @staticmethod
+    def ordering_key(event):
+        """Customer the event belongs to, used to keep that customer's events in order"""
+        event_object = event['data']['object']
+        if event_object.get('customer'):
+            return event_object['customer']
+        if event_object.get('object') == 'customer':
+            return event_object['id']
+        return event['id']
+    
+    def ingest(self, event, payload, source='stripe'):
+        """Durably store a verified event; returns None if it was already received"""
+        event_id = event['id']
+        if stripe_event_deduplicator.seen(event_id):
+            self.metrics['duplicates'] += 1
+            return None
+        
+        record = StripeWebhookInbox(
+            stripe_event_id=event_id,
+            event_type=event['type'],
+            source=source,
+            ordering_key=self.ordering_key(event),
+            payload=payload
+        )
+        db.session.add(record)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            stripe_event_deduplicator.remember(event_id)
+            self.metrics['duplicates'] += 1
+            return None
+        
+        stripe_event_deduplicator.remember(event_id)
+        self.metrics['ingested'] += 1
+        self.start()
+        self._wakeup.set()
+        return record
+    
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        
+        for lane in range(self.LANES):
+            self._spawn(self._run_lane, lane)
+        self._spawn(self._run_poller)
+    
+    @staticmethod
+    def _spawn(target, *args):
+        if socketio:
+            socketio.start_background_task(target, *args)
+        else:
+            threading.Thread(target=target, args=args, daemon=True).start()
+    
+    def _run_poller(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    try:
+                        self._dispatch_due()
+                    finally:
+                        db.session.remove()
+            except Exception as e:
+                print(f"❌ Stripe webhook poller error: {e}")
+            
+            self._wakeup.wait(self.POLL_SECONDS)
+            self._wakeup.clear()
+    
+    def _dispatch_due(self):
+        """Lease due events and hand them to their customer's lane"""
+        now = datetime.utcnow()
+        rows = StripeWebhookInbox.query.filter(
+            StripeWebhookInbox.status.in_(self.PENDING_STATUSES),
+            StripeWebhookInbox.next_attempt_at <= now
+        ).order_by(StripeWebhookInbox.id).limit(self.BATCH_SIZE).all()
+        
+        if not rows:
+            return
+        
+        lease_until = now + timedelta(seconds=self.LEASE_SECONDS)
+        leased = []
+        for row in rows:
+            # Skip rows someone else claimed since they were read
+            result = db.session.execute(
+                db.update(StripeWebhookInbox).where(
+                    StripeWebhookInbox.id == row.id,
+                    StripeWebhookInbox.status.in_(self.PENDING_STATUSES),
+                    StripeWebhookInbox.next_attempt_at <= now
+                ).values(status='processing', next_attempt_at=lease_until)
+            )
+            if result.rowcount == 1:
+                leased.append((row.id, row.ordering_key))
+        db.session.commit()
+        
+        for inbox_id, ordering_key in leased:
+            lane = int(hashlib.md5(ordering_key.encode()).hexdigest(), 16) % self.LANES
+            self._lanes[lane].put(inbox_id)
+    
+    def _run_lane(self, lane):
+        while True:
+            inbox_id = self._lanes[lane].get()
+            try:
+                with self.app.app_context():
+                    try:
+                        self.process(inbox_id)
+                    finally:
+                        db.session.remove()
+            except Exception as e:
+                print(f"❌ Stripe webhook lane {lane} error: {e}")
+    
+    def process(self, inbox_id):
+        """Run the handlers for one stored event. Call inside an app context."""
+        row = StripeWebhookInbox.query.get(inbox_id)
+        if not row or row.status in ('processed', 'running'):
+            return False
+        claimable = db.and_(
+            StripeWebhookInbox.id == row.id,
+            StripeWebhookInbox.status.in_(['received', 'processing'])
+        )
+        
+        # Keep per-customer order: wait for earlier events that are still pending
+        earlier = StripeWebhookInbox.query.filter(
+            StripeWebhookInbox.ordering_key == row.ordering_key,
+            StripeWebhookInbox.id < row.id,
+            StripeWebhookInbox.status.in_(self.PENDING_STATUSES)
+        ).order_by(StripeWebhookInbox.id).first()
+        if earlier:
+            db.session.execute(db.update(StripeWebhookInbox).where(claimable).values(
+                status='received',
+                next_attempt_at=max(earlier.next_attempt_at, datetime.utcnow()) + timedelta(seconds=1)
+            ))
+            db.session.commit()
+            return False
+        
+        # Claim the event; if another worker or a replay got there first, leave it to them
+        claimed = db.session.execute(db.update(StripeWebhookInbox).where(claimable).values(
+            status='running',
+            next_attempt_at=datetime.utcnow() + timedelta(seconds=self.LEASE_SECONDS),
+            attempts=StripeWebhookInbox.attempts + 1
+        ))
+        db.session.commit()
+        if claimed.rowcount != 1:
+            return False
+        db.session.refresh(row)
+        
+        # get_stripe_event_user caches per event; callers may share one app
+        # context across events and remove the session in between
+        g.pop('stripe_event_users', None)
+        try:
+            event = stripe.Event.construct_from(json.loads(row.payload), stripe.api_key)
+            dispatch = get_stripe_event_dispatcher(row.source)
+            dispatch(event)
+        except Exception as e:
+            db.session.rollback()
+            self._record_failure(row, e)
+            return False
+        finally:
+            g.pop('stripe_event_users', None)
+        
+        row.status = 'processed'
+        row.processed_at = datetime.utcnow()
+        row.last_error = None
+        db.session.commit()
+        self.metrics['processed'] += 1
+        
+        # Outside the handler try: a mirror failure must never re-dispatch the event
+        if event['type'].startswith('invoice.'):
+            try:
+                mirror_stripe_invoice(event['data']['object'], event['created'])
+            except Exception as e:
+                db.session.rollback()
+                print(f"⚠️ Could not mirror invoice from {row.stripe_event_id}: {e}")
+        invalidate_analytics_cache()
+        return True
+    
+    def _record_failure(self, row, error):
+        row = StripeWebhookInbox.query.get(row.id)
+        row.last_error = str(error)[:500]
+        if row.attempts >= self.MAX_ATTEMPTS:
+            row.status = 'failed'
+            self.metrics['failed'] += 1
+            print(f"❌ Stripe event {row.stripe_event_id} failed after {row.attempts} attempts: {error}")
+        else:
+            delay = min(self.BASE_BACKOFF_SECONDS * (2 ** (row.attempts - 1)), self.MAX_BACKOFF_SECONDS)
+            row.status = 'received'
+            row.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+            self.metrics['retries'] += 1
+            print(f"⚠️ Stripe event {row.stripe_event_id} failed ({error}), retrying in {delay}s")
+        db.session.commit()
+    
+    def replay(self, query, hold=False):
+        """
+        Requeue stored events matching an inbox query; returns how many were queued.
+        
+        With hold=True the rows are leased to the caller instead ('processing'
+        with a future lease) so the worker leaves them alone while the caller
+        runs process() on them itself; the lease expiring hands them back.
+        """
+        count = 0
+        now = datetime.utcnow()
+        for row in query.filter(StripeWebhookInbox.status != 'running').order_by(StripeWebhookInbox.id).all():
+            row.status = 'processing' if hold else 'received'
+            row.attempts = 0
+            row.last_error = None
+            row.next_attempt_at = now + timedelta(seconds=self.LEASE_SECONDS) if hold else now
+            count += 1
+        db.session.commit()
+        if not hold:
+            self._wakeup.set()
+        return count
+    
+    def stats(self):
+        counts = dict(db.session.query(
+            StripeWebhookInbox.status, db.func.count(StripeWebhookInbox.id)
+        ).group_by(StripeWebhookInbox.status).all())
+        return dict(self.metrics, by_status=counts)
+
+
+stripe_webhook_queue = StripeWebhookQueue(app)
+
+
+def get_stripe_event_dispatcher(source):
+    """Dispatch function for events received on each webhook endpoint"""
+    return {
+        'stripe': dispatch_stripe_event,
+        'whop': dispatch_whop_stripe_event,
+        'enhanced': dispatch_enhanced_stripe_event
+    }[source]
+
+
+def get_stripe_event_user(customer_id=None, subscription_id=None):
+    """User for a Stripe customer or subscription id, looked up at most once per event"""
+    cache = g.setdefault('stripe_event_users', {})
+    key = ('customer', customer_id) if customer_id else ('subscription', subscription_id)
+    if key in cache:
+        return cache[key]
+    
+    if customer_id:
+        user = User.query.filter_by(stripe_customer_id=customer_id).first()
+    elif subscription_id:
+        user = User.query.filter_by(stripe_subscription_id=subscription_id).first()
+    else:
+        user = None
+    
+    cache[key] = user
+    if user:
+        # Later handlers for the same event may look the user up the other way
+        if user.stripe_customer_id:
+            cache[('customer', user.stripe_customer_id)] = user
+        if user.stripe_subscription_id:
+            cache[('subscription', user.stripe_subscription_id)] = user
+    return user
+
 
 def handle_subscription_created(subscription):
     """Handle new subscription creation"""
@@ -3253,7 +4732,7 @@ def handle_subscription_created(subscription):
         print(f"🆕 New subscription created: {subscription['id']}")
         
         # Find user by customer ID
-        user = User.query.filter_by(stripe_customer_id=subscription['customer']).first()
+        user = get_stripe_event_user(customer_id=subscription['customer'])
         if not user:
             print(f"⚠️ User not found for customer {subscription['customer']}")
             return
@@ -3308,7 +4787,7 @@ def handle_subscription_updated(subscription):
         print(f"🔄 Subscription updated: {subscription['id']}")
         
         # Find user by subscription ID
-        user = User.query.filter_by(stripe_subscription_id=subscription['id']).first()
+        user = get_stripe_event_user(subscription_id=subscription['id'])
         if not user:
             print(f"⚠️ User not found for subscription {subscription['id']}")
             return
@@ -3375,7 +4854,7 @@ def handle_subscription_deleted(subscription):
         print(f"❌ Subscription deleted: {subscription['id']}")
         
         # Find user by subscription ID
-        user = User.query.filter_by(stripe_subscription_id=subscription['id']).first()
+        user = get_stripe_event_user(subscription_id=subscription['id'])
         if not user:
             print(f"⚠️ User not found for subscription {subscription['id']}")
             return
@@ -3418,7 +4897,7 @@ def handle_payment_succeeded(invoice):
         print(f"💰 Payment succeeded: {invoice['id']}")
         
         # Find user by customer ID
-        user = User.query.filter_by(stripe_customer_id=invoice['customer']).first()
+        user = get_stripe_event_user(customer_id=invoice['customer'])
         if not user:
             print(f"⚠️ User not found for customer {invoice['customer']}")
             return
@@ -3453,7 +4932,7 @@ def handle_payment_failed(invoice):
         print(f"⚠️ Payment failed: {invoice['id']}")
         
         # Find user by customer ID
-        user = User.query.filter_by(stripe_customer_id=invoice['customer']).first()
+        user = get_stripe_event_user(customer_id=invoice['customer'])
         if not user:
             print(f"⚠️ User not found for customer {invoice['customer']}")
             return
@@ -3487,7 +4966,7 @@ def handle_trial_will_end(subscription):
         print(f"⏰ Trial ending soon: {subscription['id']}")
         
         # Find user by subscription ID
-        user = User.query.filter_by(stripe_subscription_id=subscription['id']).first()
+        user = get_stripe_event_user(subscription_id=subscription['id'])
         if not user:
             return
         
@@ -3528,8 +5007,8 @@ def handle_checkout_completed(session):
     except Exception as e:
         print(f"❌ Error handling checkout completed: {e}")
 
-def log_stripe_event(event):
-    """Log Stripe events for analytics"""
+def log_stripe_event(event, event_record=None):
+    """Log Stripe events for analytics, filling in the dedupe record claimed for the event"""
     try:
         # Determine user if possible
         user_id = None
@@ -3542,7 +5021,7 @@ def log_stripe_event(event):
         # Extract customer info
         if 'customer' in event_object:
             stripe_customer_id = event_object['customer']
-            user = User.query.filter_by(stripe_customer_id=stripe_customer_id).first()
+            user = get_stripe_event_user(customer_id=stripe_customer_id)
             if user:
                 user_id = user.id
         
@@ -3559,15 +5038,17 @@ def log_stripe_event(event):
             amount = event_object['amount'] / 100
         
         # Create event record
-        subscription_event = SubscriptionEvent(
-            user_id=user_id,
-            stripe_customer_id=stripe_customer_id,
-            stripe_subscription_id=stripe_subscription_id,
-            event_type=event['type'],
-            event_data=json.dumps(event_object),
-            amount=amount,
-            processed=True
-        )
+        subscription_event = event_record \
+            or SubscriptionEvent.query.filter_by(stripe_event_id=event.get('id')).first() \
+            or SubscriptionEvent(stripe_event_id=event.get('id'))
+        subscription_event.user_id = user_id
+        subscription_event.stripe_customer_id = stripe_customer_id
+        subscription_event.stripe_subscription_id = stripe_subscription_id
+        subscription_event.event_type = event['type']
+        subscription_event.set_stripe_object(event_object)
+        subscription_event.amount = amount
+        subscription_event.processed = True
+        subscription_event.updated_at = datetime.utcnow()  # Re-roll the day even if nothing else changed
         
         db.session.add(subscription_event)
         db.session.commit()
@@ -3578,6 +5059,405 @@ def log_stripe_event(event):
         print(f"❌ Error logging Stripe event: {e}")
         db.session.rollback()
 
+# Event types that feed the daily revenue rollup
+REVENUE_EVENT_TYPES = ('invoice.payment_succeeded',)
+NEW_SUBSCRIPTION_EVENT_TYPES = ('customer.subscription.created',)
+CANCELED_SUBSCRIPTION_EVENT_TYPES = ('customer.subscription.deleted',)
+REVENUE_ROLLUP_INTERVAL_SECONDS = 900
+# Changes are re-read this far behind the watermark, so events committed
+# slightly out of updated_at order are still picked up
+REVENUE_ROLLUP_OVERLAP_SECONDS = 300
+
+
+def update_revenue_analytics():
+    """
+    Incrementally roll subscription_events up into one revenue_analytics row per day.
+    
+    The watermark (last_source_id, as a unix time) is how far
+    subscription_events.updated_at has been read. Replays and corrections
+    update existing rows, which bumps updated_at, so each run finds the
+    earliest day touched by any new or changed event and recomputes every day
+    from there to today with one GROUP BY query, upserting the rows.
+    Recomputing whole days keeps the job idempotent. Active subscriptions are
+    anchored to today's count in users and walked back through the daily
+    changes. Returns the number of days written.
+    """
+    started_ts = int(time.time())
+    run_started = datetime.utcfromtimestamp(started_ts)
+    watermark = RollupWatermark.query.get('revenue_analytics')
+    if watermark is None:
+        watermark = RollupWatermark(name='revenue_analytics', last_source_id=0)
+        db.session.add(watermark)
+    
+    changed_since = datetime.utcfromtimestamp(max(watermark.last_source_id - REVENUE_ROLLUP_OVERLAP_SECONDS, 0))
+    first_changed = db.session.query(db.func.min(SubscriptionEvent.created_at)).filter(
+        SubscriptionEvent.updated_at > changed_since
+    ).scalar()
+    if first_changed is None:
+        watermark.last_run_at = run_started
+        db.session.commit()
+        return 0
+    
+    start_day = first_changed.date()
+    end_day = run_started.date()
+    
+    def count_if(condition):
+        return db.func.coalesce(db.func.sum(db.case((condition, 1), else_=0)), 0)
+    
+    day_column = db.func.date(SubscriptionEvent.created_at)
+    rows = db.session.query(
+        day_column,
+        db.func.coalesce(db.func.sum(db.case(
+            (SubscriptionEvent.event_type.in_(REVENUE_EVENT_TYPES), SubscriptionEvent.amount), else_=0
+        )), 0),
+        count_if(SubscriptionEvent.event_type.in_(NEW_SUBSCRIPTION_EVENT_TYPES)),
+        count_if(SubscriptionEvent.event_type.in_(CANCELED_SUBSCRIPTION_EVENT_TYPES))
+    ).filter(
+        SubscriptionEvent.created_at >= datetime.combine(start_day, datetime.min.time())
+    ).group_by(day_column).all()
+    
+    daily = {}
+    for day, revenue, new_subs, canceled_subs in rows:
+        if isinstance(day, str):
+            day = datetime.strptime(day[:10], '%Y-%m-%d').date()
+        elif isinstance(day, datetime):
+            day = day.date()
+        daily[day] = (Decimal(revenue or 0), int(new_subs or 0), int(canceled_subs or 0))
+    
+    # Seed running values from the rows just before the recomputed range
+    history_start = start_day - timedelta(days=29)
+    existing = {row.date: row for row in RevenueAnalytics.query.filter(
+        RevenueAnalytics.date >= history_start
+    ).all()}
+    
+    # Active subscriptions today, walked back to the day before start_day
+    active = User.query.filter(
+        User.stripe_subscription_id.isnot(None),
+        User.subscription_status == 'active'
+    ).count()
+    active -= sum(new_subs - canceled_subs for day, (_, new_subs, canceled_subs) in daily.items() if day <= end_day)
+    
+    trailing = deque(maxlen=30)  # daily revenue for the trailing 30-day window
+    day = history_start
+    while day < start_day:
+        row = existing.get(day)
+        trailing.append(Decimal(row.daily_revenue) if row else Decimal('0'))
+        day += timedelta(days=1)
+    
+    written = 0
+    day = start_day
+    while day <= end_day:
+        revenue, new_subs, canceled_subs = daily.get(day, (Decimal('0'), 0, 0))
+        active_at_start = active
+        active = active + new_subs - canceled_subs
+        trailing.append(revenue)
+        
+        row = existing.get(day)
+        if row is None:
+            row = RevenueAnalytics(date=day)
+            db.session.add(row)
+        row.daily_revenue = revenue
+        row.monthly_revenue = sum(trailing)
+        row.new_subscriptions = new_subs
+        row.canceled_subscriptions = canceled_subs
+        row.active_subscriptions = max(active, 0)
+        row.churn_rate = round(Decimal(canceled_subs * 100) / max(active_at_start, 1), 2) if canceled_subs else 0
+        
+        written += 1
+        day += timedelta(days=1)
+    
+    watermark.last_source_id = started_ts
+    watermark.last_run_at = run_started
+    db.session.commit()
+    
+    print(f"📈 Revenue rollup updated {written} day(s) from {start_day}")
+    return written
+
+
+def run_revenue_rollup_loop():
+    """Keep revenue_analytics current in the background"""
+    while True:
+        try:
+            with app.app_context():
+                try:
+                    update_revenue_analytics()
+                finally:
+                    db.session.remove()
+        except Exception as e:
+            print(f"❌ Revenue rollup error: {e}")
+        time.sleep(REVENUE_ROLLUP_INTERVAL_SECONDS)
+
+
+def start_revenue_rollup():
+    if socketio:
+        socketio.start_background_task(run_revenue_rollup_loop)
+    else:
+        threading.Thread(target=run_revenue_rollup_loop, name='revenue-rollup', daemon=True).start()
+
+
+def get_revenue_series(start_date, end_date):
+    """Daily rollup rows for a date range, with days missing from the rollup filled in"""
+    start_day = start_date.date() if isinstance(start_date, datetime) else start_date
+    end_day = end_date.date() if isinstance(end_date, datetime) else end_date
+    
+    rows = {row.date: row for row in RevenueAnalytics.query.filter(
+        RevenueAnalytics.date.between(start_day, end_day)
+    ).order_by(RevenueAnalytics.date).all()}
+    
+    previous = RevenueAnalytics.query.filter(RevenueAnalytics.date < start_day)\
+                                     .order_by(RevenueAnalytics.date.desc()).first()
+    active = previous.active_subscriptions if previous else 0
+    
+    series = []
+    day = start_day
+    while day <= end_day:
+        row = rows.get(day)
+        if row:
+            active = row.active_subscriptions
+        series.append({
+            'date': day,
+            'revenue': float(row.daily_revenue) if row else 0.0,
+            'new_subscriptions': row.new_subscriptions if row else 0,
+            'canceled_subscriptions': row.canceled_subscriptions if row else 0,
+            'active_subscriptions': active,
+            'churn_rate': float(row.churn_rate) if row else 0.0
+        })
+        day += timedelta(days=1)
+    return series
+
+class CohortAnalyticsEngine:
+    """
+    Signup-month cohort retention and MRR movement from subscription history.
+    
+    One columnar extract of users and payment events is loaded into pandas and
+    everything else is vectorized group-bys: each payment is spread over the
+    months it covers (1 for monthly, 12 for annual, every month since purchase
+    for lifetime), giving a user x month table of paid coverage and normalized
+    MRR. Retention, new/expansion/contraction/churn/reactivation MRR, logo
+    churn and ARPU all derive from that table. Results are cached for the day;
+    once stale, the old report keeps being served while a background task
+    rebuilds it, so only the very first request computes inline.
+    """
+    
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self._lock = threading.Lock()
+        self._cache_day = None
+        self._cache = None
+        self._refreshing = False
+    
+    def invalidate(self):
+        """Mark the report stale; the next get_report() rebuilds it in the background"""
+        with self._lock:
+            self._cache_day = None
+    
+    def get_report(self):
+        """Cached report, computed inline only when there is none yet"""
+        report = self._cache
+        if report is not None:
+            if self._cache_day != datetime.utcnow().date():
+                self._refresh_in_background()
+            return report
+        
+        with self._lock:
+            if self._cache is None:
+                self._cache = self.compute()
+                self._cache_day = datetime.utcnow().date()
+            return self._cache
+    
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        
+        def refresh():
+            with self.app.app_context():
+                try:
+                    report = self.compute()
+                    with self._lock:
+                        self._cache = report
+                        self._cache_day = datetime.utcnow().date()
+                except Exception as e:
+                    print(f"⚠️ Cohort report refresh failed: {e}")
+                finally:
+                    db.session.remove()
+                    with self._lock:
+                        self._refreshing = False
+        
+        if socketio:
+            socketio.start_background_task(refresh)
+        else:
+            threading.Thread(target=refresh, daemon=True).start()
+    
+    def _extract(self):
+        users = pd.DataFrame(
+            db.session.execute(db.select(User.id, User.created_at)).all(),
+            columns=['user_id', 'created_at']
+        )
+        payments = pd.DataFrame(
+            db.session.execute(db.select(
+                SubscriptionEvent.user_id, SubscriptionEvent.amount, SubscriptionEvent.created_at
+            ).where(
+                SubscriptionEvent.event_type.in_(REVENUE_EVENT_TYPES),
+                SubscriptionEvent.user_id.isnot(None),
+                SubscriptionEvent.amount > 0
+            )).all(),
+            columns=['user_id', 'amount', 'created_at']
+        )
+        return users, payments
+    
+    def compute(self):
+        if not PANDAS_AVAILABLE:
+            return {'available': False, 'error': 'pandas is not installed'}
+        
+        users, payments = self._extract()
+        now = datetime.utcnow()
+        current_month = now.year * 12 + now.month - 1
+        
+        if users.empty or payments.empty:
+            return {'available': True, 'generated_at': datetime.utcnow().isoformat(),
+                    'months': [], 'retention': [], 'mrr_movement': [], 'arpu': []}
+        
+        users['cohort'] = self._month_index(users['created_at'])
+        payments['month'] = self._month_index(payments['created_at'])
+        payments['amount'] = payments['amount'].astype(float)
+        
+        # Months each payment covers; lifetime covers every month since purchase and adds no MRR
+        is_lifetime = payments['amount'] >= PLAN_LIFETIME_PRICE
+        payments['coverage'] = np.where(
+            is_lifetime, current_month - payments['month'] + 1,
+            np.where(payments['amount'] >= PLAN_ANNUAL_PRICE, 12, 1)
+        ).astype(int)
+        payments['monthly_value'] = np.where(is_lifetime, 0.0, payments['amount'] / payments['coverage'])
+        
+        # Expand each payment into one row per covered month
+        covered = payments.loc[payments.index.repeat(payments['coverage'])].copy()
+        covered['active_month'] = covered['month'] + covered.groupby(level=0).cumcount()
+        covered = covered[covered['active_month'] <= current_month]
+        
+        # User x month normalized MRR (0 where the user had no paid coverage)
+        all_months = list(range(int(covered['active_month'].min()), current_month + 1))
+        mrr = covered.groupby(['user_id', 'active_month'])['monthly_value'].sum()\
+                     .unstack(fill_value=0.0).reindex(columns=all_months, fill_value=0.0)
+        active = covered.groupby(['user_id', 'active_month']).size()\
+                        .unstack(fill_value=0).reindex(columns=all_months, fill_value=0) > 0
+        
+        retention = self._retention(users, active)
+        movement = self._mrr_movement(mrr, active)
+        
+        revenue_by_month = payments.groupby('month')['amount'].sum().reindex(all_months, fill_value=0.0)
+        active_counts = active.sum(axis=0)
+        arpu = (revenue_by_month / active_counts.replace(0, np.nan)).fillna(0.0)
+        
+        return {
+            'available': True,
+            'generated_at': datetime.utcnow().isoformat(),
+            'months': [self._month_label(month) for month in all_months],
+            'retention': retention,
+            'mrr_movement': movement,
+            'arpu': [{'month': self._month_label(month), 'arpu': round(float(value), 2),
+                      'active_users': int(active_counts[month])}
+                     for month, value in arpu.items()]
+        }
+    
+    @staticmethod
+    def _month_index(timestamps):
+        """Months since year 0 as integers, so month arithmetic stays vectorized"""
+        timestamps = pd.to_datetime(timestamps)
+        return timestamps.dt.year * 12 + timestamps.dt.month - 1
+    
+    @staticmethod
+    def _month_label(month):
+        return f"{month // 12}-{month % 12 + 1:02d}"
+    
+    @classmethod
+    def _retention(cls, users, active):
+        """Share of each signup cohort with paid coverage N months after signup"""
+        cohort_sizes = users.groupby('cohort').size()
+        
+        activity = active.stack()
+        activity = activity[activity].reset_index()
+        activity.columns = ['user_id', 'active_month', 'is_active']
+        activity = activity.merge(users[['user_id', 'cohort']], on='user_id')
+        activity['age'] = activity['active_month'] - activity['cohort']
+        activity = activity[activity['age'] >= 0]
+        
+        counts = activity.groupby(['cohort', 'age'])['user_id'].nunique().unstack(fill_value=0)
+        
+        rows = []
+        for cohort, size in cohort_sizes.items():
+            if cohort in counts.index:
+                retained = counts.loc[cohort]
+                retained = retained.iloc[:int(retained.to_numpy().nonzero()[0].max()) + 1] if retained.any() else retained.iloc[:0]
+            else:
+                retained = pd.Series(dtype=int)
+            rows.append({
+                'cohort': cls._month_label(int(cohort)),
+                'size': int(size),
+                'active': [int(value) for value in retained],
+                'rates': [round(float(value) / size * 100, 1) for value in retained]
+            })
+        return rows
+    
+    @staticmethod
+    def _mrr_movement(mrr, active):
+        """New, expansion, contraction, churned and reactivated MRR per month"""
+        previous = mrr.shift(1, axis=1, fill_value=0.0)
+        was_active = active.shift(1, axis=1, fill_value=False)
+        ever_before = active.astype(int).cumsum(axis=1).shift(1, axis=1, fill_value=0) > 0
+        
+        starting = (mrr > 0) & (previous == 0)
+        new = starting & ~ever_before
+        reactivated = starting & ever_before
+        expansion = (previous > 0) & (mrr > previous)
+        contraction = (mrr > 0) & (mrr < previous)
+        churned_mrr = (previous > 0) & (mrr == 0)
+        churned_users = was_active & ~active
+        
+        delta = mrr - previous
+        movement = pd.DataFrame({
+            'mrr': mrr.sum(axis=0),
+            'new': mrr.where(new, 0.0).sum(axis=0),
+            'reactivation': mrr.where(reactivated, 0.0).sum(axis=0),
+            'expansion': delta.where(expansion, 0.0).sum(axis=0),
+            'contraction': delta.where(contraction, 0.0).sum(axis=0),
+            'churn': (-previous).where(churned_mrr, 0.0).sum(axis=0),
+            'new_customers': (active & ~was_active & ~ever_before).sum(axis=0),
+            'churned_customers': churned_users.sum(axis=0),
+            'active_customers': active.sum(axis=0),
+        })
+        starting_customers = movement['active_customers'].shift(1, fill_value=0)
+        movement['logo_churn_rate'] = (movement['churned_customers'] / starting_customers.replace(0, np.nan) * 100).fillna(0.0)
+        
+        return [{
+            'month': CohortAnalyticsEngine._month_label(month),
+            'mrr': round(float(row['mrr']), 2),
+            'new': round(float(row['new']), 2),
+            'reactivation': round(float(row['reactivation']), 2),
+            'expansion': round(float(row['expansion']), 2),
+            'contraction': round(float(row['contraction']), 2),
+            'churn': round(float(row['churn']), 2),
+            'new_customers': int(row['new_customers']),
+            'churned_customers': int(row['churned_customers']),
+            'active_customers': int(row['active_customers']),
+            'logo_churn_rate': round(float(row['logo_churn_rate']), 1)
+        } for month, row in movement.iterrows()]
+
+
+cohort_engine = CohortAnalyticsEngine(app)
+
+
+def get_latest_churn_rate():
+    """Last completed month's logo churn from the cohort engine, or None if unavailable"""
+    try:
+        movement = cohort_engine.get_report().get('mrr_movement') or []
+    except Exception as e:
+        print(f"⚠️ Cohort engine unavailable: {e}")
+        return None
+    completed = movement[:-1]  # The current month is still in progress
+    return completed[-1]['logo_churn_rate'] if completed else None
+
 # Helper function to update revenue analytics daily
 @app.route('/api/admin/update-revenue-analytics', methods=['POST'])
 @login_required
@@ -3587,39 +5467,305 @@ def api_update_revenue_analytics():
         return jsonify({'error': 'Access denied'}), 403
     
     try:
-        update_revenue_analytics()
-        return jsonify({'success': True, 'message': 'Revenue analytics updated'})
+        days_updated = update_revenue_analytics()
+        return jsonify({'success': True, 'message': 'Revenue analytics updated', 'days_updated': days_updated})
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
-# Function to sync all subscription statuses with Stripe
-def sync_all_subscriptions_with_stripe():
-    """Sync all user subscriptions with Stripe - run this periodically"""
-    try:
-        print("🔄 Starting bulk subscription sync with Stripe...")
-        
-        # Get all users with Stripe customer IDs
-        users_with_stripe = User.query.filter(User.stripe_customer_id.isnot(None)).all()
+class StripeRateLimiter:
+    """Token bucket shared by sync workers so bulk jobs stay under Stripe's request rate"""
+    
+    def __init__(self, rate_per_second):
+        self.rate = float(rate_per_second)
+        self.tokens = self.rate
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class StripeSubscriptionSync:
+    """
+    Bulk subscription sync from Stripe, run as a tracked job.
+    
+    Full mode splits the subscription creation timeline into one window per
+    worker and pages a global Subscription.list for each window on a bounded
+    pool. Incremental mode reads customer.subscription.* events since the
+    previous run's watermark instead. Every Stripe call goes through one token
+    bucket, and rate-limit errors back off and retry. The newest subscription
+    per customer is written to users with bulk_update_mappings in batches.
+    Set STRIPE_API_BASE to a stripe-mock server to run it locally.
+    """
+    
+    WATERMARK = 'stripe_subscription_sync'  # last_source_id holds the unix time the last run covered
+    PAGE_SIZE = 100
+    UPDATE_BATCH_SIZE = 500
+    MAX_RETRIES = 5
+    EVENT_RETENTION_DAYS = 30  # Stripe only lists events from the last 30 days
+    SUBSCRIPTION_EVENT_TYPES = ['customer.subscription.created', 'customer.subscription.updated',
+                                'customer.subscription.deleted', 'customer.subscription.paused',
+                                'customer.subscription.resumed']
+    MAX_TRACKED_JOBS = 50
+    
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._limiter = None
+    
+    @property
+    def workers(self):
+        return self.app.config.get('STRIPE_SYNC_WORKERS', 4)
+    
+    def _new_job(self, incremental):
+        job = {
+            'job_id': uuid.uuid4().hex[:12],
+            'mode': 'incremental' if incremental else 'full',
+            'status': 'queued',
+            'pages_fetched': 0,
+            'subscriptions_seen': 0,
+            'customers_matched': 0,
+            'users_updated': 0,
+            'rate_limited': 0,
+            'errors': 0,
+            'error': None,
+            'queued_at': datetime.utcnow().isoformat(),
+            'started_at': None,
+            'finished_at': None
+        }
+        with self._lock:
+            self.jobs[job['job_id']] = job
+            while len(self.jobs) > self.MAX_TRACKED_JOBS:
+                self.jobs.popitem(last=False)
+        return job
+    
+    def get_job(self, job_id):
+        return self.jobs.get(job_id)
+    
+    def start(self, incremental=False):
+        """Start a background sync, or return the one already running"""
+        with self._lock:
+            running = next((job for job in self.jobs.values() if job['status'] in ('queued', 'running')), None)
+        if running:
+            return running
+        
+        job = self._new_job(incremental)
+        
+        def run():
+            with self.app.app_context():
+                try:
+                    self._execute(job)
+                finally:
+                    db.session.remove()
         
-        success_count = 0
-        error_count = 0
+        if socketio:
+            socketio.start_background_task(run)
+        else:
+            threading.Thread(target=run, name='stripe-subscription-sync', daemon=True).start()
+        return job
+    
+    def run(self, incremental=False):
+        """Run a sync in the caller's app context and return the finished job"""
+        job = self._new_job(incremental)
+        self._execute(job)
+        return job
+    
+    def _execute(self, job):
+        job['status'] = 'running'
+        job['started_at'] = datetime.utcnow().isoformat()
+        self._limiter = StripeRateLimiter(self.app.config.get('STRIPE_SYNC_RATE_LIMIT', 20))
+        print(f"🔄 Starting {job['mode']} subscription sync with Stripe (job {job['job_id']})...")
         
-        for user in users_with_stripe:
+        try:
+            watermark = db.session.get(RollupWatermark, self.WATERMARK) or RollupWatermark(name=self.WATERMARK, last_source_id=0)
+            since = watermark.last_source_id
+            oldest_listed_event = int(time.time()) - self.EVENT_RETENTION_DAYS * 86400
+            
+            if job['mode'] == 'incremental' and since > oldest_listed_event:
+                latest, covered_until = self._fetch_changed(job, since)
+            else:
+                job['mode'] = 'full'  # No usable watermark; events older than 30 days are gone
+                latest, covered_until = self._fetch_all(job)
+            
+            self._apply(job, latest)
+            
+            watermark.last_source_id = covered_until
+            watermark.last_run_at = datetime.utcnow()
+            db.session.add(watermark)
+            db.session.commit()
+            
+            invalidate_analytics_cache()
+            job['status'] = 'completed'
+            print(f"✅ Subscription sync completed: {job['users_updated']} users updated, "
+                  f"{job['pages_fetched']} pages, {job['rate_limited']} rate-limited retries")
+        except Exception as e:
+            db.session.rollback()
+            job['status'] = 'failed'
+            job['error'] = str(e)
+            job['errors'] += 1
+            print(f"❌ Error in bulk sync: {e}")
+        finally:
+            job['finished_at'] = datetime.utcnow().isoformat()
+        return job
+    
+    def _call(self, job, method, **params):
+        """One rate-limited Stripe request, retried with backoff on 429s"""
+        for attempt in range(self.MAX_RETRIES):
+            self._limiter.acquire()
             try:
-                if sync_user_with_stripe(user.id):
-                    success_count += 1
-                else:
-                    error_count += 1
-            except Exception as e:
-                print(f"Error syncing user {user.id}: {e}")
-                error_count += 1
+                return method(**params)
+            except stripe.error.RateLimitError:
+                if attempt == self.MAX_RETRIES - 1:
+                    raise
+                with self._lock:
+                    job['rate_limited'] += 1
+                time.sleep(min(2 ** attempt, 30))
+    
+    def _fetch_all(self, job):
+        """Newest subscription per customer across every creation-time window"""
+        covered_until = int(time.time())
+        first = int((get_first_signup_date() - timedelta(days=1)).timestamp())
+        step = max((covered_until + 1 - first) // self.workers, 1)
+        bounds = [first + step * i for i in range(self.workers)] + [covered_until + 1]
+        windows = [(None if i == 0 else bounds[i], bounds[i + 1]) for i in range(self.workers)]
+        
+        latest = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for window_latest in pool.map(lambda window: self._list_window(job, *window), windows):
+                for summary in window_latest.values():
+                    self._keep_newest(latest, summary)
+        return latest, covered_until
+    
+    def _list_window(self, job, created_gte, created_lt):
+        created = {'lt': created_lt}
+        if created_gte is not None:
+            created['gte'] = created_gte
+        
+        latest = {}
+        params = {'status': 'all', 'limit': self.PAGE_SIZE, 'created': created}
+        while True:
+            page = self._call(job, stripe.Subscription.list, **params)
+            with self._lock:
+                job['pages_fetched'] += 1
+                job['subscriptions_seen'] += len(page.data)
+            for subscription in page.data:
+                self._keep_newest(latest, self._summarize(subscription))
+            if not page.has_more or not page.data:
+                return latest
+            params['starting_after'] = page.data[-1].id
+    
+    def _fetch_changed(self, job, since):
+        """Latest state of subscriptions changed since the watermark, from their events"""
+        covered_until = since
+        by_subscription = {}
+        params = {'types': self.SUBSCRIPTION_EVENT_TYPES, 'created': {'gte': since}, 'limit': self.PAGE_SIZE}
+        while True:
+            page = self._call(job, stripe.Event.list, **params)
+            job['pages_fetched'] += 1
+            for event in page.data:  # Newest first, so the first event per subscription wins
+                covered_until = max(covered_until, event.created)
+                subscription = event.data.object
+                if subscription.id not in by_subscription:
+                    by_subscription[subscription.id] = self._summarize(subscription)
+            if not page.has_more or not page.data:
+                break
+            params['starting_after'] = page.data[-1].id
+        
+        job['subscriptions_seen'] = len(by_subscription)
+        latest = {}
+        for summary in by_subscription.values():
+            self._keep_newest(latest, summary)
+        return latest, covered_until
+    
+    @staticmethod
+    def _summarize(subscription):
+        items = (subscription.get('items') or {}).get('data') or []
+        customer = subscription.get('customer')
+        return {
+            'id': subscription['id'],
+            'customer': customer if isinstance(customer, str) else customer['id'],
+            'status': subscription.get('status'),
+            'created': subscription.get('created') or 0,
+            'current_period_start': subscription.get('current_period_start'),
+            'current_period_end': subscription.get('current_period_end'),
+            'cancel_at_period_end': bool(subscription.get('cancel_at_period_end')),
+            'price_id': items[0]['price']['id'] if items else None
+        }
+    
+    @staticmethod
+    def _keep_newest(latest, summary):
+        current = latest.get(summary['customer'])
+        if current is None or summary['created'] > current['created']:
+            latest[summary['customer']] = summary
+    
+    def _apply(self, job, latest):
+        price_plans = {price_id: plan for plan, price_id in initialize_stripe_price_ids().items()}
+        full = job['mode'] == 'full'
         
-        print(f"✅ Bulk sync completed: {success_count} successful, {error_count} errors")
-        return success_count, error_count
+        users = db.session.execute(db.select(
+            User.id, User.stripe_customer_id, User.stripe_subscription_id,
+            User.has_subscription, User.subscription_plan
+        ).where(User.stripe_customer_id.isnot(None))).all()
         
-    except Exception as e:
-        print(f"❌ Error in bulk sync: {e}")
-        return 0, 0
+        mappings = []
+        for user in users:
+            summary = latest.get(user.stripe_customer_id)
+            if summary is None:
+                # Full mode saw every subscription, so this customer has none; lifetime access is a one-off payment
+                if full and user.subscription_plan != 'lifetime' and (user.has_subscription or user.stripe_subscription_id):
+                    mappings.append({'id': user.id, 'has_subscription': False,
+                                     'subscription_status': None, 'stripe_subscription_id': None})
+                continue
+            
+            job['customers_matched'] += 1
+            # An older subscription changed; the user's current one is newer
+            if not full and user.stripe_subscription_id not in (None, summary['id']) \
+                    and summary['status'] not in ('active', 'trialing'):
+                continue
+            
+            period_end = datetime.fromtimestamp(summary['current_period_end']) if summary['current_period_end'] else None
+            mapping = {
+                'id': user.id,
+                'stripe_subscription_id': summary['id'],
+                'subscription_status': summary['status'],
+                'subscription_current_period_start': datetime.fromtimestamp(summary['current_period_start']) if summary['current_period_start'] else None,
+                'subscription_current_period_end': period_end,
+                'subscription_cancel_at_period_end': summary['cancel_at_period_end'],
+                'subscription_expires': period_end,
+                'has_subscription': summary['status'] in ['active', 'trialing']
+            }
+            if summary['price_id']:
+                mapping['subscription_price_id'] = summary['price_id']
+                if summary['price_id'] in price_plans:
+                    mapping['subscription_plan'] = price_plans[summary['price_id']]
+            mappings.append(mapping)
+        
+        for start in range(0, len(mappings), self.UPDATE_BATCH_SIZE):
+            batch = mappings[start:start + self.UPDATE_BATCH_SIZE]
+            db.session.bulk_update_mappings(User, batch)
+            db.session.commit()
+            job['users_updated'] += len(batch)
+
+
+stripe_subscription_sync = StripeSubscriptionSync(app)
+
+
+# Function to sync all subscription statuses with Stripe
+def sync_all_subscriptions_with_stripe(incremental=False):
+    """Sync all user subscriptions with Stripe - run this periodically"""
+    job = stripe_subscription_sync.run(incremental=incremental)
+    return job['users_updated'], job['errors']
 
 
 
@@ -3825,6 +5971,9 @@ if socketio:
                     'connected_at': time.time()
                 }
                 
+                if is_admin:
+                    join_room(STREAM_ADMIN_ROOM)
+                
                 print(f"✅ Authenticated user connected: {current_user.username} (Admin: {is_admin}, Can Stream: {can_stream})")
             else:
                 active_connections[client_id] = {
@@ -3846,6 +5995,22 @@ if socketio:
             print(f"❌ Error in connect handler: {e}")
             emit('error', {'message': 'Connection error'})
 
+    @socketio.on('join_stream_lobby')
+    def handle_join_stream_lobby(data=None):
+        """Subscribe a client to pushed stream status changes instead of polling /api/stream/status"""
+        try:
+            join_room(STREAM_LOBBY_ROOM)
+            # Send the current snapshot so the client doesn't need an initial fetch
+            emit('stream_status', build_stream_status_payload(reason='snapshot'))
+        except Exception as e:
+            print(f"❌ Error in join_stream_lobby handler: {e}")
+            emit('error', {'message': 'Failed to join stream lobby'})
+
+    @socketio.on('leave_stream_lobby')
+    def handle_leave_stream_lobby(data=None):
+        """Unsubscribe a client from stream status pushes"""
+        leave_room(STREAM_LOBBY_ROOM)
+
 @socketio.on('join_stream')
 def handle_join_stream(data):
     """Handle user joining a stream with automatic admin recording"""
@@ -3990,6 +6155,7 @@ def handle_media_published(data):
                     'message': 'Recording has started',
                     'egress_id': recording_result.get('egress_id')
                 }, room=room_id)
+                broadcast_stream_status('recording_started', stream_id=stream_id)
             else:
                 error_msg = recording_result.get('error', 'Unknown error') if recording_result else 'Unknown error'
                 print(f"⚠️ All recording strategies failed: {error_msg}")
@@ -4153,6 +6319,7 @@ def handle_media_published(data):
                         'client_id': client_id,
                         'viewer_count': len(stream_rooms[room_id]['viewers'])
                     }, room=room_id)
+                    broadcast_stream_status('viewer_count', stream_id=stream_rooms[room_id]['stream_id'])
                 
                 if stream_rooms[room_id]['admin_client'] == client_id:
                     stream_rooms[room_id]['admin_client'] = None
@@ -4211,7 +6378,7 @@ def handle_subscription_created(subscription):
         print(f"🆕 New subscription created: {subscription['id']}")
         
         # Find user by customer ID
-        user = User.query.filter_by(stripe_customer_id=subscription['customer']).first()
+        user = get_stripe_event_user(customer_id=subscription['customer'])
         if not user:
             print(f"⚠️ User not found for customer {subscription['customer']}")
             return
@@ -4281,7 +6448,7 @@ def handle_payment_succeeded(invoice):
         print(f"💰 Payment succeeded: {invoice['id']}")
         
         # Find user by customer ID
-        user = User.query.filter_by(stripe_customer_id=invoice['customer']).first()
+        user = get_stripe_event_user(customer_id=invoice['customer'])
         if not user:
             print(f"⚠️ User not found for customer {invoice['customer']}")
             return
@@ -4454,24 +6621,14 @@ def manage_subscription():
 def api_get_user_billing_history():
     """Get current user's billing history"""
     try:
-        invoices = []
-        
-        if current_user.stripe_customer_id:
-            # Get invoices from Stripe
-            stripe_invoices = stripe.Invoice.list(
-                customer=current_user.stripe_customer_id,
-                limit=20
-            )
-            
-            for invoice in stripe_invoices.data:
-                invoices.append({
-                    'id': invoice.id,
-                    'date': datetime.fromtimestamp(invoice.created).strftime('%m/%d/%Y'),
-                    'amount': f"{invoice.amount_paid / 100:.2f}",
-                    'status': invoice.status,
-                    'description': invoice.description or f"Subscription - {invoice.lines.data[0].price.nickname if invoice.lines.data else 'Premium'}",
-                    'pdf_url': invoice.invoice_pdf if invoice.status == 'paid' else None
-                })
+        invoices = [{
+            'id': invoice.stripe_invoice_id,
+            'date': invoice.created_at.strftime('%m/%d/%Y'),
+            'amount': f"{invoice.amount_paid:.2f}",
+            'status': invoice.status,
+            'description': invoice.description,
+            'pdf_url': invoice.invoice_pdf if invoice.status == 'paid' else None
+        } for invoice in get_billing_history(current_user, limit=20)]
         
         return jsonify({
             'success': True,
@@ -4733,6 +6890,7 @@ def api_start_stream():
             'message': f'{streamer_name} is now live!',
             'is_recording': False
         })
+    broadcast_stream_status('stream_started', stream_id=stream.id)
     
     # Send traditional notification
     broadcast_notification(
@@ -4760,6 +6918,308 @@ def api_start_stream():
 # 3. UPDATE YOUR EXISTING api_stop_stream ROUTE - ADD DISCORD WEBHOOK:
 # ==============================================================================
 
+def create_video_from_stream_recording(stream, recording_url, duration_minutes):
+    """Add a stopped stream's recording to the Live Trading Sessions course library"""
+    # Find or create the Live Trading Sessions category
+    live_sessions_category = Category.query.filter_by(
+        name='Live Trading Sessions'
+    ).first()
+    
+    if not live_sessions_category:
+        live_sessions_category = Category(
+            name='Live Trading Sessions',
+            description='Recorded live trading sessions from our professional traders',
+            order_index=1
+        )
+        db.session.add(live_sessions_category)
+        db.session.flush()
+        print("📁 Created Live Trading Sessions category")
+    
+    # Create enhanced video title: "{Streamer Name} - {MM-DD-YY} {Stream Title}"
+    stream_date = stream.started_at.strftime('%m-%d-%y') if stream.started_at else datetime.utcnow().strftime('%m-%d-%y')
+    
+    # Extract the core title (remove "streamer's" prefix if it exists)
+    core_title = stream.title
+    if f"{stream.streamer_name}'s " in core_title:
+        core_title = core_title.replace(f"{stream.streamer_name}'s ", "")
+    
+    video_title = f"{stream.streamer_name} - {stream_date} {core_title}"
+    
+    # Create comprehensive description
+    video_description = f"Live trading session with {stream.streamer_name}\n"
+    video_description += f"Original stream: {stream.title}\n"
+    video_description += f"Duration: {duration_minutes} minutes\n"
+    video_description += f"Stream Type: {stream.stream_type.replace('_', ' ').title()}\n"
+    video_description += f"Recorded: {stream.started_at.strftime('%B %d, %Y at %I:%M %p') if stream.started_at else 'Unknown'}\n"
+    
+    if stream.description:
+        video_description += f"\nDescription: {stream.description}"
+    
+    # Get the next order index for this category
+    max_order = db.session.query(db.func.max(Video.order_index)).filter_by(
+        category_id=live_sessions_category.id
+    ).scalar() or 0
+    
+    # Create the video entry
+    new_video = Video(
+        title=video_title,
+        description=video_description,
+        s3_url=recording_url,
+        thumbnail_url=None,  # Could auto-generate later
+        duration=duration_minutes * 60,  # Store in seconds
+        is_free=False,  # Premium content
+        order_index=max_order + 1,
+        category_id=live_sessions_category.id,
+        created_at=stream.started_at or datetime.utcnow()
+    )
+    db.session.add(new_video)
+    db.session.flush()
+    
+    # Add comprehensive tags
+    tags_to_add = [
+        stream.streamer_name,
+        'Live Session',
+        'Live Trading',
+        stream.started_at.strftime('%B %Y') if stream.started_at else datetime.utcnow().strftime('%B %Y'),
+        stream.stream_type.replace('_', ' ').title()
+    ]
+    
+    for tag_name in tags_to_add:
+        tag = get_or_create_tag(tag_name)
+        if tag and tag not in new_video.tags:
+            new_video.tags.append(tag)
+    
+    print(f"🎥 Created video entry: {video_title}")
+    print(f"🆔 Video ID: {new_video.id}")
+    return new_video
+
+
+class RecordingLifecycleWorker:
+    """
+    Background pipeline that finalizes a stopped stream's recording.
+    
+    Stages run in order: stop egress, verify the S3 file with exponential
+    backoff, create the course Video, notify (Discord + users), and clean up
+    the LiveKit room. Jobs live in recording_finalize_jobs: a worker claims a
+    job with a conditional UPDATE and a lease, and records each stage as it
+    starts. Jobs still queued, or running under an expired lease, are picked
+    up again after a restart and resume from their last recorded stage.
+    Progress goes to admins as 'recording_pipeline' events and to the
+    stream's Socket.IO room as 'recording_status'.
+    """
+    
+    STAGES = ['stop_egress', 'verify_s3', 'create_video', 'notify', 'cleanup']
+    LEASE_SECONDS = 900
+    POLL_SECONDS = 60
+    MAX_ATTEMPTS = 3
+    
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+    
+    def start(self):
+        """Start the worker once per process; it first resumes unfinished jobs"""
+        with self._lock:
+            if self._started:
+                return
+            if socketio:
+                socketio.start_background_task(self._run)
+            else:
+                threading.Thread(target=self._run, name='recording-lifecycle', daemon=True).start()
+            self._started = True
+    
+    def enqueue(self, stream_id, duration_minutes):
+        """Persist finalization for a stream and return the job record"""
+        job = RecordingFinalizeJob(
+            job_id=uuid.uuid4().hex[:12],
+            stream_id=stream_id,
+            duration_minutes=duration_minutes
+        )
+        db.session.add(job)
+        db.session.commit()
+        
+        self._queue.put(job.job_id)
+        self.start()
+        return job.to_dict()
+    
+    def get_job(self, job_id):
+        job = RecordingFinalizeJob.query.filter_by(job_id=job_id).first()
+        return job.to_dict() if job else None
+    
+    def _report(self, job, stage, status, **extra):
+        job.stage = stage
+        job.status = status
+        for key, value in extra.items():
+            setattr(job, key, value)
+        if status in ('completed', 'failed'):
+            job.finished_at = datetime.utcnow()
+        db.session.commit()
+        
+        if socketio:
+            job_info = job.to_dict()
+            progress = {key: job_info[key] for key in ('job_id', 'stream_id', 'stage', 'status')}
+            progress['stage_index'] = self.STAGES.index(stage) + 1 if stage in self.STAGES else 0
+            progress['stage_count'] = len(self.STAGES)
+            # The recording URL and video id are premium content; only admins get the full event
+            event = dict(progress, **{key: job_info[key] for key in ('recording_url', 'recording_saved', 'video_created', 'video_id', 'error')})
+            socketio.emit('recording_pipeline', event, room=STREAM_ADMIN_ROOM)
+            socketio.emit('recording_status', progress, room=f"stream_{job.stream_id}")
+    
+    def _due_job_ids(self):
+        """Jobs queued but never started, or left running by a process that died"""
+        now = datetime.utcnow()
+        rows = db.session.query(RecordingFinalizeJob.job_id).filter(db.or_(
+            RecordingFinalizeJob.status == 'queued',
+            db.and_(RecordingFinalizeJob.status == 'running', RecordingFinalizeJob.lease_until <= now)
+        )).order_by(RecordingFinalizeJob.id).all()
+        return [job_id for (job_id,) in rows]
+    
+    def _claim(self, job_id):
+        """Take a job with a conditional UPDATE so only one worker runs it"""
+        now = datetime.utcnow()
+        claimed = db.session.execute(db.update(RecordingFinalizeJob).where(
+            RecordingFinalizeJob.job_id == job_id,
+            db.or_(
+                RecordingFinalizeJob.status == 'queued',
+                db.and_(RecordingFinalizeJob.status == 'running', RecordingFinalizeJob.lease_until <= now)
+            )
+        ).values(
+            status='running',
+            lease_until=now + timedelta(seconds=self.LEASE_SECONDS),
+            attempts=RecordingFinalizeJob.attempts + 1
+        ))
+        db.session.commit()
+        return claimed.rowcount == 1
+    
+    def _run(self):
+        job_ids = None  # None scans the table, which picks up jobs from before a restart
+        while True:
+            try:
+                with self.app.app_context():
+                    try:
+                        for job_id in (self._due_job_ids() if job_ids is None else job_ids):
+                            self._run_job(job_id)
+                    finally:
+                        db.session.remove()
+            except Exception as e:
+                print(f"❌ Recording pipeline worker error: {e}")
+            
+            try:
+                job_ids = [self._queue.get(timeout=self.POLL_SECONDS)]
+            except queue.Empty:
+                job_ids = None
+    
+    def _run_job(self, job_id):
+        if not self._claim(job_id):
+            return
+        job = RecordingFinalizeJob.query.filter_by(job_id=job_id).first()
+        if job.attempts > self.MAX_ATTEMPTS:
+            self._report(job, job.stage, 'failed', error=f'Gave up after {self.MAX_ATTEMPTS} attempts')
+            return
+        
+        try:
+            self._process(job)
+        except Exception as e:
+            print(f"❌ Recording pipeline failed for stream {job.stream_id}: {e}")
+            import traceback
+            traceback.print_exc()
+            db.session.rollback()
+            job = RecordingFinalizeJob.query.filter_by(job_id=job_id).first()
+            self._report(job, job.stage, 'failed', error=str(e)[:500])
+    
+    def _process(self, job):
+        stream = Stream.query.get(job.stream_id)
+        if not stream:
+            self._report(job, None, 'failed', error='Stream not found')
+            return
+        
+        # Stages before the last one started finished on an earlier attempt
+        resume_from = self.STAGES.index(job.stage) if job.stage in self.STAGES else 0
+        if resume_from:
+            print(f"🔁 Resuming recording pipeline {job.job_id} at {job.stage}")
+        
+        def pending(stage):
+            return self.STAGES.index(stage) >= resume_from
+        
+        recording_url = job.recording_url
+        
+        # 1. Stop egress
+        if pending('stop_egress'):
+            self._report(job, 'stop_egress', 'running')
+            if stream.recording_id and stream.is_recording:
+                print(f"🔴 Stopping recording for egress {stream.recording_id}...")
+                stop_result = stop_livekit_egress_recording(stream.recording_id)
+                
+                if stop_result.get('success'):
+                    recording_url = stop_result.get('recording_url')
+                    print(f"✅ Recording stopped successfully: {recording_url}")
+                else:
+                    print(f"❌ Failed to stop recording: {stop_result.get('error')}")
+            
+            stream.is_recording = False
+            job.recording_url = recording_url
+            db.session.commit()
+            broadcast_stream_status('recording_stopped', stream_id=stream.id)
+        
+        # 2. Verify the S3 file, backing off 1s, 2s, 4s... between checks
+        if pending('verify_s3'):
+            self._report(job, 'verify_s3', 'running')
+            if recording_url and not job.recording_saved:
+                print("⏳ Verifying recording file exists in S3...")
+                if verify_s3_recording_exists(recording_url, max_wait_time=120, initial_delay=1, backoff_factor=2, max_delay=30):
+                    print("✅ Recording file verified and URL saved")
+                else:
+                    print("⚠️ Recording file not found in S3, but saving URL anyway")
+                stream.recording_url = recording_url
+                job.recording_saved = True
+                db.session.commit()
+        
+        # 3. Create the course library video
+        if pending('create_video'):
+            self._report(job, 'create_video', 'running')
+            if job.recording_saved and not job.video_created:
+                try:
+                    new_video = create_video_from_stream_recording(stream, recording_url, job.duration_minutes)
+                    db.session.commit()
+                    job.video_created = True
+                    job.video_id = new_video.id
+                    db.session.commit()
+                except Exception as e:
+                    print(f"❌ Error creating video entry: {e}")
+                    db.session.rollback()
+        
+        # 4. Notify Discord and users
+        if pending('notify'):
+            self._report(job, 'notify', 'running')
+            try:
+                webhook_success = send_live_stream_webhook(stream, action="ended")
+                if webhook_success:
+                    print(f"✅ Discord notified about stream ending: {stream.title}")
+            except Exception as e:
+                print(f"❌ Discord webhook error for stream ending: {e}")
+            
+            if job.video_created:
+                broadcast_notification(
+                    'New Live Session Recording Available!',
+                    f"{stream.streamer_name}'s live trading session is now available in the course library.",
+                    'new_video',
+                    target_users='all'
+                )
+        
+        # 5. Clean up the LiveKit room
+        self._report(job, 'cleanup', 'running')
+        if stream.room_name:
+            delete_livekit_room(stream.room_name)
+        
+        print(f"✅ Stream {stream.id} recording finalized and synced to course library")
+        self._report(job, 'cleanup', 'completed')
+
+
+recording_worker = RecordingLifecycleWorker(app)
+
+
 @app.route('/api/stream/stop', methods=['POST'])
 @login_required
 def api_stop_stream():
@@ -4784,33 +7244,7 @@ def api_stop_stream():
     if not stream:
         return jsonify({'error': 'No active stream found or access denied'}), 400
     
-    recording_url = None
-    recording_saved = False
-    video_created = False
-    
-    # Stop recording if active
-    if stream.is_recording and stream.recording_id:
-        print(f"🔴 Stopping recording for egress {stream.recording_id}...")
-        
-        stop_result = stop_livekit_egress_recording(stream.recording_id)
-        
-        if stop_result.get('success'):
-            recording_url = stop_result.get('recording_url')
-            print(f"✅ Recording stopped successfully: {recording_url}")
-            
-            # Verify the recording file exists in S3
-            if recording_url:
-                print("⏳ Verifying recording file exists in S3...")
-                if verify_s3_recording_exists(recording_url, max_wait_time=60):
-                    stream.recording_url = recording_url
-                    recording_saved = True
-                    print("✅ Recording file verified and URL saved")
-                else:
-                    print("⚠️ Recording file not found in S3, but saving URL anyway")
-                    stream.recording_url = recording_url
-                    recording_saved = True
-        else:
-            print(f"❌ Failed to stop recording: {stop_result.get('error')}")
+    has_recording = bool(stream.is_recording and stream.recording_id)
     
     # Calculate stream duration
     duration_minutes = 0
@@ -4819,103 +7253,6 @@ def api_stop_stream():
         duration = stream.ended_at - stream.started_at
         duration_minutes = int(duration.total_seconds() / 60)
     
-    # Send Discord notification BEFORE stopping stream
-    try:
-        webhook_success = send_live_stream_webhook(stream, action="ended")
-        if webhook_success:
-            print(f"✅ Discord notified about stream ending: {stream.title}")
-    except Exception as e:
-        print(f"❌ Discord webhook error for stream ending: {e}")
-    
-    # AUTO-SYNC TO COURSE LIBRARY with enhanced title format
-    if recording_saved and recording_url:
-        try:
-            # Find or create the Live Trading Sessions category
-            live_sessions_category = Category.query.filter_by(
-                name='Live Trading Sessions'
-            ).first()
-            
-            if not live_sessions_category:
-                live_sessions_category = Category(
-                    name='Live Trading Sessions',
-                    description='Recorded live trading sessions from our professional traders',
-                    order_index=1
-                )
-                db.session.add(live_sessions_category)
-                db.session.flush()
-                print("📁 Created Live Trading Sessions category")
-            
-            # Create enhanced video title: "{Streamer Name} - {MM-DD-YY} {Stream Title}"
-            stream_date = stream.started_at.strftime('%m-%d-%y') if stream.started_at else datetime.utcnow().strftime('%m-%d-%y')
-            
-            # Extract the core title (remove "streamer's" prefix if it exists)
-            core_title = stream.title
-            if f"{stream.streamer_name}'s " in core_title:
-                core_title = core_title.replace(f"{stream.streamer_name}'s ", "")
-            
-            video_title = f"{stream.streamer_name} - {stream_date} {core_title}"
-            
-            # Create comprehensive description
-            video_description = f"Live trading session with {stream.streamer_name}\n"
-            video_description += f"Original stream: {stream.title}\n"
-            video_description += f"Duration: {duration_minutes} minutes\n"
-            video_description += f"Stream Type: {stream.stream_type.replace('_', ' ').title()}\n"
-            video_description += f"Recorded: {stream.started_at.strftime('%B %d, %Y at %I:%M %p') if stream.started_at else 'Unknown'}\n"
-            
-            if stream.description:
-                video_description += f"\nDescription: {stream.description}"
-            
-            # Get the next order index for this category
-            max_order = db.session.query(db.func.max(Video.order_index)).filter_by(
-                category_id=live_sessions_category.id
-            ).scalar() or 0
-            
-            # Create the video entry
-            new_video = Video(
-                title=video_title,
-                description=video_description,
-                s3_url=recording_url,
-                thumbnail_url=None,  # Could auto-generate later
-                duration=duration_minutes * 60,  # Store in seconds
-                is_free=False,  # Premium content
-                order_index=max_order + 1,
-                category_id=live_sessions_category.id,
-                created_at=stream.started_at or datetime.utcnow()
-            )
-            db.session.add(new_video)
-            db.session.flush()
-            
-            # Add comprehensive tags
-            tags_to_add = [
-                stream.streamer_name,
-                'Live Session',
-                'Live Trading',
-                stream.started_at.strftime('%B %Y') if stream.started_at else datetime.utcnow().strftime('%B %Y'),
-                stream.stream_type.replace('_', ' ').title()
-            ]
-            
-            for tag_name in tags_to_add:
-                tag = get_or_create_tag(tag_name)
-                if tag and tag not in new_video.tags:
-                    new_video.tags.append(tag)
-            
-            video_created = True
-            print(f"🎥 Created video entry: {video_title}")
-            print(f"🆔 Video ID: {new_video.id}")
-            
-            # Send notification about new recording
-            broadcast_notification(
-                'New Live Session Recording Available!',
-                f"{stream.streamer_name}'s live trading session is now available in the course library.",
-                'new_video',
-                target_users='all'
-            )
-            
-        except Exception as e:
-            print(f"❌ Error creating video entry: {e}")
-            db.session.rollback()
-            video_created = False
-    
     # Notify viewers via WebSocket
     room_id = f"stream_{stream.id}"
     if socketio and room_id in stream_rooms:
@@ -4925,27 +7262,20 @@ def api_stop_stream():
             'redirect': True
         }
         
-        if recording_url:
+        if has_recording:
             end_message['recording_message'] = 'Recording has been saved and will be available in the course library shortly'
         
         socketio.emit('stream_ending', {
             'stream_id': stream.id,
             'message': 'Stream is ending in 3 seconds...'
         }, room=room_id)
-        
-        time.sleep(1)
         socketio.emit('stream_ended', end_message, room=room_id)
         
         if room_id in stream_rooms:
             del stream_rooms[room_id]
     
-    # Clean up LiveKit room
-    if stream.room_name:
-        delete_livekit_room(stream.room_name)
-    
-    # Update database
+    # Update database; is_recording is cleared by the worker once egress stops
     stream.is_active = False
-    stream.is_recording = False
     
     # Update viewer records
     StreamViewer.query.filter_by(stream_id=stream.id, is_active=True).update({
@@ -4953,23 +7283,41 @@ def api_stop_stream():
         'left_at': datetime.utcnow()
     })
     
-    # Commit all changes
     db.session.commit()
-    print(f"✅ Stream {stream.id} ended and synced to course library")
+    print(f"✅ Stream {stream.id} ended, queuing recording finalization")
+    
+    broadcast_stream_status('stream_stopped', stream_id=stream.id)
+    
+    # Egress stop, S3 verification, video creation, notifications and room
+    # cleanup all happen in the background; progress arrives over Socket.IO
+    job = recording_worker.enqueue(stream.id, duration_minutes)
     
     response_data = {
         'success': True,
         'message': f'{stream.streamer_name}\'s stream ended',
         'duration_minutes': duration_minutes,
+        'job_id': job['job_id'],
         'recording': {
-            'saved': recording_saved,
-            'url': recording_url if recording_saved else None,
-            'video_created': video_created,
-            'message': f'Recording saved and added to course library' if video_created else 'Recording saved but not added to courses'
+            'pending': has_recording,
+            'message': 'Recording is being finalized and will be added to the course library shortly' if has_recording else 'No recording for this stream'
         }
     }
     
-    return jsonify(response_data)
+    return jsonify(response_data), 202
+
+
+@app.route('/api/stream/finalize-status/<job_id>')
+@login_required
+def api_stream_finalize_status(job_id):
+    """Polling fallback for recording pipeline progress"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    job = recording_worker.get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    return jsonify({'success': True, 'job': job})
     
 # ==============================================================================
 # 4. UPDATE YOUR EXISTING admin_add_trading_signal ROUTE - ADD DISCORD WEBHOOK:
@@ -5766,8 +8114,6 @@ def api_get_subscription_timeline():
         
         timeline = []
         for event in events:
-            event_data = json.loads(event.event_data) if event.event_data else {}
-            
             # Map event types to user-friendly descriptions
             event_descriptions = {
                 'customer.subscription.created': 'Subscription started',
@@ -5902,32 +8248,93 @@ def api_reactivate_subscription():
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+INVOICE_BACKFILL_LIMIT = 100
+
+
+def mirror_stripe_invoice(invoice, source_time=None):
+    """Insert or update the local copy of a Stripe invoice; older states never overwrite newer ones"""
+    # Upcoming-invoice previews have no id, and there's nothing to file without a customer
+    if not invoice.get('id') or not invoice.get('customer'):
+        return None
+    
+    source_time = int(source_time or time.time())
+    row = Invoice.query.filter_by(stripe_invoice_id=invoice['id']).first()
+    if row is None:
+        row = Invoice(stripe_invoice_id=invoice['id'])
+    elif row.stripe_updated_at > source_time:
+        return row
+    
+    customer_id = invoice.get('customer')
+    if customer_id and not row.user_id:
+        user = get_stripe_event_user(customer_id=customer_id)
+        row.user_id = user.id if user else None
+    
+    row.stripe_customer_id = customer_id
+    row.stripe_subscription_id = invoice.get('subscription')
+    row.status = invoice.get('status')
+    row.amount_paid = Decimal(invoice.get('amount_paid') or 0) / 100
+    row.amount_due = Decimal(invoice.get('amount_due') or 0) / 100
+    row.currency = invoice.get('currency') or 'usd'
+    row.description = (invoice.get('description') or get_invoice_description(invoice))[:255]
+    row.invoice_pdf = invoice.get('invoice_pdf')
+    row.hosted_invoice_url = invoice.get('hosted_invoice_url')
+    row.created_at = datetime.fromtimestamp(invoice['created'])
+    row.stripe_updated_at = source_time
+    
+    db.session.add(row)
+    db.session.commit()
+    return row
+
+
+def backfill_invoices(stripe_customer_id):
+    """Copy a customer's invoice history from Stripe the first time it's needed"""
+    if db.session.get(StripeInvoiceBackfill, stripe_customer_id):
+        return 0
+    
+    fetched_at = time.time()
+    count = 0
+    for invoice in stripe.Invoice.list(customer=stripe_customer_id, limit=100).auto_paging_iter():
+        mirror_stripe_invoice(invoice, fetched_at)
+        count += 1
+        if count >= INVOICE_BACKFILL_LIMIT:
+            break
+    
+    try:
+        db.session.add(StripeInvoiceBackfill(stripe_customer_id=stripe_customer_id, invoice_count=count))
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()  # Another request backfilled the same customer
+    
+    print(f"🧾 Backfilled {count} invoices for {stripe_customer_id}")
+    return count
+
+
+def get_billing_history(user, limit=50):
+    """A user's newest invoices from the local mirror (uses ix_invoices_customer_created)"""
+    if not user.stripe_customer_id:
+        return []
+    
+    backfill_invoices(user.stripe_customer_id)
+    return Invoice.query.filter_by(
+        stripe_customer_id=user.stripe_customer_id
+    ).order_by(Invoice.created_at.desc()).limit(limit).all()
+
+
 @app.route('/api/subscription/billing-history', methods=['GET'])
 @login_required
 def api_get_billing_history():
-    """Get user's billing history from Stripe"""
-    try:
-        if not current_user.stripe_customer_id:
-            return jsonify({'success': True, 'invoices': []})
-        
-        # Get invoices from Stripe
-        invoices = stripe.Invoice.list(
-            customer=current_user.stripe_customer_id,
-            limit=50
-        )
-        
-        billing_history = []
-        for invoice in invoices.data:
-            billing_history.append({
-                'id': invoice.id,
-                'date': datetime.fromtimestamp(invoice.created).isoformat(),
-                'amount': invoice.amount_paid / 100,
-                'currency': invoice.currency.upper(),
-                'status': invoice.status,
-                'description': invoice.description or get_invoice_description(invoice),
-                'pdf_url': invoice.invoice_pdf if invoice.status == 'paid' else None,
-                'hosted_url': invoice.hosted_invoice_url
-            })
+    """Get user's billing history from the local invoice mirror"""
+    try:
+        billing_history = [{
+            'id': invoice.stripe_invoice_id,
+            'date': invoice.created_at.isoformat(),
+            'amount': float(invoice.amount_paid),
+            'currency': invoice.currency.upper(),
+            'status': invoice.status,
+            'description': invoice.description,
+            'pdf_url': invoice.invoice_pdf if invoice.status == 'paid' else None,
+            'hosted_url': invoice.hosted_invoice_url
+        } for invoice in get_billing_history(current_user, limit=50)]
         
         return jsonify({
             'success': True,
@@ -5937,14 +8344,16 @@ def api_get_billing_history():
     except stripe.error.StripeError as e:
         return jsonify({'error': f'Stripe error: {str(e)}'}), 400
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 def get_invoice_description(invoice):
     """Generate a user-friendly description for an invoice"""
-    if invoice.lines.data:
-        line_item = invoice.lines.data[0]
-        if line_item.price:
-            interval = line_item.price.recurring.interval if line_item.price.recurring else None
+    lines = (invoice.get('lines') or {}).get('data') or []
+    if lines:
+        price = lines[0].get('price')
+        if price:
+            interval = (price.get('recurring') or {}).get('interval')
             if interval == 'month':
                 return 'Monthly Subscription'
             elif interval == 'year':
@@ -5954,6 +8363,126 @@ def get_invoice_description(invoice):
     return 'TGFX Trade Lab Subscription'
 
 
+class AnalyticsResponseCache:
+    """
+    Stale-while-revalidate cache for admin analytics responses.
+    
+    Entries live in the Flask-Caching backend keyed by (endpoint, period,
+    date range). A fresh entry (younger than ANALYTICS_CACHE_TTL) is served
+    as-is; an older one is still served for up to ANALYTICS_CACHE_STALE_TTL
+    while one background task recomputes it. Keys include a generation token,
+    so invalidate() drops every entry at once and a refresh that started
+    before an invalidation can never overwrite newer data.
+    """
+    
+    KEY_PREFIX = 'analytics'
+    
+    def __init__(self, flask_app, backend):
+        self.app = flask_app
+        self.backend = backend
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.metrics = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0, 'refresh_errors': 0, 'invalidations': 0}
+    
+    @property
+    def ttl(self):
+        return self.app.config.get('ANALYTICS_CACHE_TTL', 300)
+    
+    @property
+    def stale_ttl(self):
+        return self.app.config.get('ANALYTICS_CACHE_STALE_TTL', 3600)
+    
+    def _key(self, endpoint, period, start, end):
+        generation = self.backend.get(f"{self.KEY_PREFIX}:generation") or 'initial'
+        return f"{self.KEY_PREFIX}:{generation}:{endpoint}:{period}:{start or ''}:{end or ''}"
+    
+    def get_or_compute(self, endpoint, compute, period=None, start=None, end=None):
+        """Cached result of compute() for this key; compute must not depend on the request"""
+        if self.backend is None:
+            return compute()
+        
+        key = self._key(endpoint, period, start, end)
+        entry = self.backend.get(key)
+        if entry is not None:
+            if time.time() - entry['computed_at'] < self.ttl:
+                self.metrics['hits'] += 1
+            else:
+                self.metrics['stale_hits'] += 1
+                self._refresh_in_background(key, compute)
+            return entry['value']
+        
+        self.metrics['misses'] += 1
+        value = compute()
+        self._store(key, value)
+        return value
+    
+    def _store(self, key, value):
+        self.backend.set(key, {'value': value, 'computed_at': time.time()}, timeout=self.ttl + self.stale_ttl)
+    
+    def _refresh_in_background(self, key, compute):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        
+        def refresh():
+            with self.app.app_context():
+                try:
+                    self._store(key, compute())
+                    self.metrics['refreshes'] += 1
+                except Exception as e:
+                    self.metrics['refresh_errors'] += 1
+                    print(f"⚠️ Analytics cache refresh failed for {key}: {e}")
+                finally:
+                    db.session.remove()
+                    with self._lock:
+                        self._refreshing.discard(key)
+        
+        if socketio:
+            socketio.start_background_task(refresh)
+        else:
+            threading.Thread(target=refresh, daemon=True).start()
+    
+    def invalidate(self):
+        """Drop every cached analytics response"""
+        if self.backend is None:
+            return
+        self.backend.set(f"{self.KEY_PREFIX}:generation", uuid.uuid4().hex[:12], timeout=0)
+        self.metrics['invalidations'] += 1
+    
+    def stats(self):
+        return dict(self.metrics, ttl=self.ttl, stale_ttl=self.stale_ttl, refreshing=len(self._refreshing))
+
+
+analytics_cache = AnalyticsResponseCache(app, cache)
+
+
+def invalidate_analytics_cache():
+    """
+    Called after subscription data changes (processed Stripe webhooks). Only
+    the response cache is dropped; the cohort report is a monthly view that
+    refreshes daily in the background rather than on every event.
+    """
+    analytics_cache.invalidate()
+
+
+def get_first_signup_date(default=None):
+    """Earliest user signup, for period=all ranges"""
+    first_signup = db.session.query(db.func.min(User.created_at)).scalar()
+    return first_signup or default or datetime.utcnow()
+
+
+def get_analytics_date_range(period, start_date=None, end_date=None):
+    """(start, end) datetimes for an analytics period or explicit YYYY-MM-DD range"""
+    if start_date and end_date:
+        return datetime.strptime(start_date, '%Y-%m-%d'), datetime.strptime(end_date, '%Y-%m-%d')
+    
+    end_dt = datetime.utcnow()
+    if period == 'all':
+        return get_first_signup_date(end_dt), end_dt
+    return end_dt - timedelta(days=int(period)), end_dt
+
+
 @app.route('/api/admin/analytics/dashboard', methods=['GET'])
 @login_required
 def api_admin_analytics_dashboard():
@@ -5963,88 +8492,149 @@ def api_admin_analytics_dashboard():
     
     try:
         period = request.args.get('period', '30')
-        end_date = datetime.utcnow()
-        
-        if period == 'all':
-            start_date = User.query.order_by(User.created_at).first().created_at
-        else:
-            days = int(period)
-            start_date = end_date - timedelta(days=days)
-        
-        # Calculate metrics
-        metrics = calculate_enhanced_analytics(start_date, end_date)
-        
-        # Get chart data
-        charts = generate_enhanced_chart_data(start_date, end_date)
-        
-        # Get recent events
-        recent_events = get_recent_revenue_events()
         
-        # Get top customers
-        top_customers = get_top_customers_by_revenue()
+        def build_dashboard():
+            start_date, end_date = get_analytics_date_range(period)
+            return {
+                'success': True,
+                'period': period,
+                'date_range': {
+                    'start': start_date.isoformat(),
+                    'end': end_date.isoformat()
+                },
+                'metrics': calculate_enhanced_analytics(start_date, end_date),
+                'charts': generate_enhanced_chart_data(start_date, end_date),
+                'recent_events': get_recent_revenue_events(),
+                'top_customers': get_top_customers_by_revenue()
+            }
         
-        return jsonify({
-            'success': True,
-            'period': period,
-            'date_range': {
-                'start': start_date.isoformat(),
-                'end': end_date.isoformat()
-            },
-            'metrics': metrics,
-            'charts': charts,
-            'recent_events': recent_events,
-            'top_customers': top_customers
-        })
+        return jsonify(analytics_cache.get_or_compute('dashboard', build_dashboard, period=period))
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Plan prices used for MRR; lifetime is a one-off payment and doesn't count toward MRR
+PLAN_MONTHLY_PRICE = 29
+PLAN_ANNUAL_PRICE = 299
+PLAN_LIFETIME_PRICE = 499
+
+
+def get_subscription_metrics(period_start=None, period_end=None, prev_start=None, prev_end=None, canceled_since=None):
+    """
+    Every user/revenue counter the analytics pages need, from one
+    conditional-aggregation query over users (plus an optional scalar
+    subquery for recent cancellation events). Results are memoized for the
+    request, so endpoints that build metrics and charts share one round trip.
+    """
+    cache_key = (period_start, period_end, prev_start, prev_end, canceled_since)
+    cache = g.setdefault('subscription_metrics', {})
+    if cache_key in cache:
+        return cache[cache_key]
+    
+    def count_if(condition):
+        return db.func.coalesce(db.func.sum(db.case((condition, 1), else_=0)), 0)
+    
+    def revenue_if(condition):
+        return db.func.coalesce(db.func.sum(db.case((condition, User.total_revenue), else_=0)), 0)
+    
+    subscribed = User.has_subscription == True
+    columns = [
+        db.func.count(User.id).label('total_users'),
+        count_if(subscribed).label('total_subscribers'),
+        db.func.coalesce(db.func.sum(User.total_revenue), 0).label('total_revenue'),
+        count_if(db.and_(subscribed, User.subscription_plan == 'monthly')).label('monthly_subscribers'),
+        count_if(db.and_(subscribed, User.subscription_plan == 'annual')).label('annual_subscribers'),
+        count_if(db.and_(subscribed, User.subscription_plan == 'lifetime')).label('lifetime_subscribers'),
+        count_if(User.has_subscription == False).label('free_users'),
+        count_if(User.subscription_status == 'canceled').label('canceled_users'),
+    ]
+    
+    if period_start is not None and period_end is not None:
+        in_period = User.created_at.between(period_start, period_end)
+        columns += [
+            count_if(in_period).label('period_users'),
+            count_if(db.and_(subscribed, in_period)).label('period_subscribers'),
+            revenue_if(in_period).label('period_revenue'),
+        ]
+    
+    if prev_start is not None and prev_end is not None:
+        in_prev = User.created_at.between(prev_start, prev_end)
+        columns += [
+            count_if(db.and_(subscribed, in_prev)).label('prev_subscribers'),
+            revenue_if(in_prev).label('prev_revenue'),
+        ]
+    
+    if canceled_since is not None:
+        columns.append(
+            db.select(db.func.count(SubscriptionEvent.id)).where(
+                SubscriptionEvent.event_type.like('%cancel%'),
+                SubscriptionEvent.created_at >= canceled_since
+            ).scalar_subquery().label('recent_cancellations')
+        )
+    
+    row = db.session.execute(db.select(*columns).select_from(User)).mappings().one()
+    
+    metrics = {}
+    for key, value in row.items():
+        metrics[key] = float(value or 0) if 'revenue' in key else int(value or 0)
+    
+    metrics['mrr'] = metrics['monthly_subscribers'] * PLAN_MONTHLY_PRICE + \
+        metrics['annual_subscribers'] * (PLAN_ANNUAL_PRICE / 12)
+    
+    cache[cache_key] = metrics
+    return metrics
+
+
+def get_plan_distribution():
+    """Subscriber counts per plan, reusing any metric vector already loaded this request"""
+    cached = g.get('subscription_metrics')
+    metrics = next(iter(cached.values())) if cached else get_subscription_metrics()
+    return metrics
+
+
+@contextmanager
+def count_queries():
+    """Count SQL statements executed inside the block: with count_queries() as stats: ..."""
+    stats = {'queries': 0, 'ms': 0.0}
+    
+    def before_cursor_execute(*args):
+        stats['queries'] += 1
+    
+    sqlalchemy_event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    started = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        stats['ms'] = round((time.perf_counter() - started) * 1000, 2)
+        sqlalchemy_event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
 def calculate_enhanced_analytics(start_date, end_date):
     """Calculate enhanced analytics metrics"""
     try:
-        # Current period metrics
-        current_users = User.query.filter(User.created_at.between(start_date, end_date)).count()
-        current_subscribers = User.query.filter(
-            and_(User.has_subscription == True, User.created_at.between(start_date, end_date))
-        ).count()
-        current_revenue = db.session.query(func.sum(User.total_revenue)).filter(
-            User.created_at.between(start_date, end_date)
-        ).scalar() or 0
-        
-        # Total metrics
-        total_users = User.query.count()
-        total_subscribers = User.query.filter_by(has_subscription=True).count()
-        total_revenue = db.session.query(func.sum(User.total_revenue)).scalar() or 0
-        
-        # Plan distribution
-        monthly_subs = User.query.filter_by(subscription_plan='monthly', has_subscription=True).count()
-        annual_subs = User.query.filter_by(subscription_plan='annual', has_subscription=True).count()
-        lifetime_subs = User.query.filter_by(subscription_plan='lifetime', has_subscription=True).count()
-        
-        # Calculate MRR (Monthly Recurring Revenue)
-        monthly_mrr = monthly_subs * 29
-        annual_mrr = annual_subs * (299 / 12)
-        total_mrr = monthly_mrr + annual_mrr
-        
-        # Calculate churn rate (simplified)
-        canceled_subs = User.query.filter_by(subscription_status='canceled').count()
-        churn_rate = (canceled_subs / max(total_subscribers, 1)) * 100 if total_subscribers > 0 else 0
-        
-        # Calculate ARPU
-        arpu = (total_revenue / max(total_users, 1)) if total_users > 0 else 0
-        
         # Previous period for comparison (simplified)
         prev_period_days = (end_date - start_date).days
         prev_start = start_date - timedelta(days=prev_period_days)
         prev_end = start_date
         
-        prev_revenue = db.session.query(func.sum(User.total_revenue)).filter(
-            User.created_at.between(prev_start, prev_end)
-        ).scalar() or 0
+        metrics = get_subscription_metrics(start_date, end_date, prev_start, prev_end)
         
-        prev_subscribers = User.query.filter(
-            and_(User.has_subscription == True, User.created_at.between(prev_start, prev_end))
-        ).count()
+        current_subscribers = metrics['period_subscribers']
+        current_revenue = metrics['period_revenue']
+        total_users = metrics['total_users']
+        total_subscribers = metrics['total_subscribers']
+        total_revenue = metrics['total_revenue']
+        prev_revenue = metrics['prev_revenue']
+        prev_subscribers = metrics['prev_subscribers']
+        
+        # Logo churn for the last completed month; fall back to canceled share of subscribers
+        churn_rate = get_latest_churn_rate()
+        if churn_rate is None:
+            canceled_subs = metrics['canceled_users']
+            churn_rate = (canceled_subs / max(total_subscribers, 1)) * 100 if total_subscribers > 0 else 0
+        
+        # Calculate ARPU
+        arpu = (total_revenue / max(total_users, 1)) if total_users > 0 else 0
         
         # Calculate changes
         revenue_change = ((current_revenue - prev_revenue) / max(prev_revenue, 1)) * 100 if prev_revenue > 0 else 0
@@ -6053,20 +8643,20 @@ def calculate_enhanced_analytics(start_date, end_date):
         return {
             'total_revenue': float(total_revenue),
             'revenue_change': round(revenue_change, 1),
-            'mrr': float(total_mrr),
+            'mrr': float(metrics['mrr']),
             'mrr_change': 8.3,  # You can calculate this properly
             'new_subscribers': current_subscribers,
             'subscribers_change': round(subscriber_change, 1),
             'churn_rate': round(churn_rate, 1),
             'churn_change': -2.1,  # You can calculate this properly
-            'lifetime_subscribers': lifetime_subs,
+            'lifetime_subscribers': metrics['lifetime_subscribers'],
             'total_users': total_users,
             'total_subscribers': total_subscribers,
             'arpu': round(float(arpu), 2),
             'plan_distribution': {
-                'monthly': monthly_subs,
-                'annual': annual_subs,
-                'lifetime': lifetime_subs
+                'monthly': metrics['monthly_subscribers'],
+                'annual': metrics['annual_subscribers'],
+                'lifetime': metrics['lifetime_subscribers']
             }
         }
         
@@ -6074,28 +8664,32 @@ def calculate_enhanced_analytics(start_date, end_date):
         print(f"Error calculating analytics: {e}")
         return {}
 
+
+def calculate_period_metrics(start_date, end_date):
+    """Metrics for the /api/admin/analytics date range"""
+    return calculate_enhanced_analytics(start_date, end_date)
+
 def generate_enhanced_chart_data(start_date, end_date):
     """Generate enhanced chart data"""
     try:
-        # Generate daily revenue data
-        days = (end_date - start_date).days
+        # Daily revenue data from the revenue_analytics rollup
+        series = get_revenue_series(start_date, end_date)
         daily_revenue = []
         cumulative_revenue = []
         labels = []
         
         running_total = 0
-        for i in range(days):
-            current_day = start_date + timedelta(days=i)
-            # Simulate daily revenue (in real app, query from database)
-            day_revenue = 150 + (i * 5) + (i % 7) * 50  # Mock data
-            daily_revenue.append(day_revenue)
-            running_total += day_revenue
-            cumulative_revenue.append(running_total)
-            labels.append(current_day.strftime('%m/%d'))
+        for day in series:
+            daily_revenue.append(day['revenue'])
+            running_total += day['revenue']
+            cumulative_revenue.append(round(running_total, 2))
+            labels.append(day['date'].strftime('%m/%d'))
         
         # Subscription trends
-        subscriber_data = [50 + i * 2 for i in range(days)]
-        churn_data = [5 - (i * 0.1) for i in range(days)]
+        subscriber_data = [day['new_subscriptions'] for day in series]
+        churn_data = [day['canceled_subscriptions'] for day in series]
+        
+        plans = get_plan_distribution()
         
         return {
             'revenue': {
@@ -6110,7 +8704,7 @@ def generate_enhanced_chart_data(start_date, end_date):
             },
             'plans': {
                 'labels': ['Monthly', 'Annual', 'Lifetime'],
-                'data': [45, 35, 20],
+                'data': [plans['monthly_subscribers'], plans['annual_subscribers'], plans['lifetime_subscribers']],
                 'colors': ['#10b981', '#3b82f6', '#FFD700']
             }
         }
@@ -6214,49 +8808,44 @@ def stripe_webhook_enhanced():
     except Exception as e:
         return jsonify({'error': f'Webhook error: {str(e)}'}), 400
     
-    try:
-        # Enhanced event handling
-        event_type = event['type']
-        event_data = event['data']['object']
-        
-        # Create or update subscription event record
-        subscription_event = SubscriptionEvent(
-            stripe_event_id=event['id'],
-            event_type=event_type,
-            event_data=json.dumps(event_data),
-            processed=False
-        )
-        
-        # Process the event
-        if event_type == 'customer.subscription.created':
-            handle_subscription_created_enhanced(event_data, subscription_event)
-        elif event_type == 'customer.subscription.updated':
-            handle_subscription_updated_enhanced(event_data, subscription_event)
-        elif event_type == 'customer.subscription.deleted':
-            handle_subscription_deleted_enhanced(event_data, subscription_event)
-        elif event_type == 'invoice.payment_succeeded':
-            handle_payment_succeeded_enhanced(event_data, subscription_event)
-        elif event_type == 'invoice.payment_failed':
-            handle_payment_failed_enhanced(event_data, subscription_event)
-        
-        subscription_event.processed = True
-        db.session.add(subscription_event)
-        db.session.commit()
-        
-        return jsonify({'success': True})
-        
-    except Exception as e:
-        if 'subscription_event' in locals():
-            subscription_event.processed = False
-            db.session.add(subscription_event)
-            db.session.commit()
-        
-        print(f"Webhook processing error: {e}")
-        return jsonify({'error': str(e)}), 500
+    # Store the verified event and acknowledge; a background worker processes it
+    if stripe_webhook_queue.ingest(event, payload, source='enhanced') is None:
+        return jsonify({'success': True, 'duplicate': True})
+    
+    return jsonify({'success': True, 'queued': True})
+
+def dispatch_enhanced_stripe_event(event):
+    """Process a stored event received on the enhanced webhook endpoint"""
+    # Enhanced event handling
+    event_type = event['type']
+    event_data = event['data']['object']
+    
+    # Reuse the analytics record when an event is replayed
+    subscription_event = SubscriptionEvent.query.filter_by(stripe_event_id=event['id']).first() \
+        or SubscriptionEvent(stripe_event_id=event['id'], event_type=event_type)
+    subscription_event.set_stripe_object(event_data)
+    subscription_event.processed = False
+    
+    # Process the event
+    if event_type == 'customer.subscription.created':
+        handle_subscription_created_enhanced(event_data, subscription_event)
+    elif event_type == 'customer.subscription.updated':
+        handle_subscription_updated(event_data)
+    elif event_type == 'customer.subscription.deleted':
+        handle_subscription_deleted(event_data)
+    elif event_type == 'invoice.payment_succeeded':
+        handle_payment_succeeded_enhanced(event_data, subscription_event)
+    elif event_type == 'invoice.payment_failed':
+        handle_payment_failed(event_data)
+    
+    subscription_event.processed = True
+    subscription_event.updated_at = datetime.utcnow()  # Re-roll the day even if nothing else changed
+    db.session.add(subscription_event)
+    db.session.commit()
 
 def handle_subscription_created_enhanced(subscription_data, event_record):
     """Enhanced subscription creation handler - NO Discord notification for subscribers"""
-    user = User.query.filter_by(stripe_customer_id=subscription_data['customer']).first()
+    user = get_stripe_event_user(customer_id=subscription_data['customer'])
     if not user:
         return
     
@@ -6284,7 +8873,7 @@ def handle_subscription_created_enhanced(subscription_data, event_record):
 
 def handle_payment_succeeded_enhanced(invoice_data, event_record):
     """Enhanced payment success handler - NO Discord notification for payments"""
-    user = User.query.filter_by(stripe_customer_id=invoice_data['customer']).first()
+    user = get_stripe_event_user(customer_id=invoice_data['customer'])
     if not user:
         return
     
@@ -6461,6 +9050,7 @@ def api_webhook_status():
     return jsonify({
         'configured': bool(webhook_url),
         'url_preview': webhook_url[:50] + '***' if webhook_url else None,
+        'dispatcher': dict(discord_dispatcher.metrics, queue_depth=discord_dispatcher.queue_depth()),
         'enabled_notifications': [
             'New Videos',
             'Live Streams', 
@@ -6481,24 +9071,19 @@ def api_webhook_status():
 def api_get_user_notifications():
     """Get user's notifications"""
     try:
-        notifications = Notification.query.filter_by(user_id=current_user.id)\
-                                         .order_by(Notification.created_at.desc())\
-                                         .limit(20).all()
-        
-        unread_count = Notification.query.filter_by(
-            user_id=current_user.id,
-            is_read=False
-        ).count()
+        notifications = get_user_notification_feed(current_user, limit=20)
+        unread_count = count_unread_notifications(current_user)
         
         notifications_data = []
         for notification in notifications:
             notifications_data.append({
-                'id': notification.id,
-                'title': notification.title,
-                'message': notification.message,
-                'notification_type': notification.notification_type,
-                'is_read': notification.is_read,
-                'created_at': notification.created_at.isoformat()
+                'id': notification['id'],
+                'source': notification['source'],
+                'title': notification['title'],
+                'message': notification['message'],
+                'notification_type': notification['notification_type'],
+                'is_read': notification['is_read'],
+                'created_at': notification['created_at'].isoformat()
             })
         
         return jsonify({
@@ -6515,15 +9100,38 @@ def api_get_user_notifications():
 def api_mark_notification_read(notification_id):
     """Mark a notification as read"""
     try:
-        notification = Notification.query.filter_by(
-            id=notification_id,
-            user_id=current_user.id
-        ).first()
+        if not mark_notification_read(current_user, notification_id):
+            return jsonify({'error': 'Notification not found'}), 404
+        
+        db.session.commit()
+        
+        return jsonify({'success': True})
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/user/notifications/unread-count')
+@login_required
+def api_get_unread_notification_count():
+    """Notification bell count without loading the feed"""
+    try:
+        return jsonify({
+            'success': True,
+            'unread_count': count_unread_notifications(current_user)
+        })
         
-        if not notification:
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/user/notifications/broadcast/<int:broadcast_id>/read', methods=['POST'])
+@login_required
+def api_mark_broadcast_read(broadcast_id):
+    """Mark a broadcast notification as read"""
+    try:
+        if not mark_broadcast_read(current_user, broadcast_id):
             return jsonify({'error': 'Notification not found'}), 404
         
-        notification.is_read = True
         db.session.commit()
         
         return jsonify({'success': True})
@@ -6537,11 +9145,7 @@ def api_mark_notification_read(notification_id):
 def api_mark_all_notifications_read():
     """Mark all notifications as read"""
     try:
-        Notification.query.filter_by(
-            user_id=current_user.id,
-            is_read=False
-        ).update({'is_read': True})
-        
+        mark_all_notifications_read(current_user)
         db.session.commit()
         
         return jsonify({'success': True})
@@ -6555,7 +9159,7 @@ def api_mark_all_notifications_read():
 def api_clear_all_notifications():
     """Clear all notifications for user"""
     try:
-        Notification.query.filter_by(user_id=current_user.id).delete()
+        clear_all_notifications(current_user)
         db.session.commit()
         
         return jsonify({'success': True})
@@ -7119,54 +9723,98 @@ def api_sync_user_with_stripe(user_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Columns the users CSV export can include, in default order: key -> (header, column, formatter)
+USER_EXPORT_COLUMNS = OrderedDict([
+    ('id', ('ID', User.id, None)),
+    ('username', ('Username', User.username, None)),
+    ('email', ('Email', User.email, None)),
+    ('display_name', ('Display Name', User.display_name, lambda value: value or '')),
+    ('timezone', ('Timezone', User.timezone, None)),
+    ('is_admin', ('Is Admin', User.is_admin, None)),
+    ('can_stream', ('Can Stream', User.can_stream, None)),
+    ('has_subscription', ('Has Subscription', User.has_subscription, None)),
+    ('subscription_plan', ('Subscription Plan', User.subscription_plan, lambda value: value or '')),
+    ('subscription_status', ('Subscription Status', User.subscription_status, lambda value: value or '')),
+    ('total_revenue', ('Total Revenue', User.total_revenue, lambda value: float(value or 0))),
+    ('created_at', ('Created At', User.created_at, lambda value: value.isoformat() if value else '')),
+])
+USER_EXPORT_BATCH_SIZE = 1000
+
+
+def stream_users_csv(column_keys, compress=False):
+    """
+    Yield the users CSV in chunks of USER_EXPORT_BATCH_SIZE rows.
+    
+    Rows come from a server-side cursor selecting only the exported columns,
+    so memory stays flat however many users there are. With compress=True
+    the chunks are one continuous gzip stream.
+    """
+    import io
+    import csv
+    
+    columns = [USER_EXPORT_COLUMNS[key] for key in column_keys]
+    formatters = [formatter for _, _, formatter in columns]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    gzipper = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits=31 writes a gzip header
+    
+    def flush():
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate(0)
+        return gzipper.compress(data) if gzipper else data
+    
+    writer.writerow([header for header, _, _ in columns])
+    
+    with db.engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(
+            db.select(*[column for _, column, _ in columns]).order_by(User.id)
+        )
+        for rows in result.partitions(USER_EXPORT_BATCH_SIZE):
+            writer.writerows(
+                [formatter(value) if formatter else value for formatter, value in zip(formatters, row)]
+                for row in rows
+            )
+            chunk = flush()
+            if chunk:
+                yield chunk
+    
+    chunk = flush()
+    if gzipper:
+        chunk += gzipper.flush()
+    if chunk:
+        yield chunk
+
+
 # Export users endpoint
 @app.route('/api/admin/users/export')
 @login_required
 def api_export_users():
-    """Export users to CSV"""
+    """Export users to CSV, streamed (?columns=id,email,... and ?compress=gzip are optional)"""
     if not current_user.is_admin:
         return redirect(url_for('admin'))
     
     try:
-        import io
-        import csv
-        from flask import Response
-        
-        output = io.StringIO()
-        writer = csv.writer(output)
+        from flask import Response, stream_with_context
         
-        # Write header
-        writer.writerow([
-            'ID', 'Username', 'Email', 'Display Name', 'Timezone',
-            'Is Admin', 'Can Stream', 'Has Subscription', 'Subscription Plan',
-            'Subscription Status', 'Total Revenue', 'Created At'
-        ])
-        
-        # Write user data
-        users = User.query.all()
-        for user in users:
-            writer.writerow([
-                user.id,
-                user.username,
-                user.email,
-                user.display_name or '',
-                user.timezone,
-                user.is_admin,
-                user.can_stream,
-                user.has_subscription,
-                user.subscription_plan or '',
-                user.subscription_status or '',
-                float(user.total_revenue or 0),
-                user.created_at.isoformat()
-            ])
+        requested = request.args.get('columns')
+        column_keys = [key.strip() for key in requested.split(',') if key.strip()] if requested else list(USER_EXPORT_COLUMNS)
+        unknown = [key for key in column_keys if key not in USER_EXPORT_COLUMNS]
+        if unknown or not column_keys:
+            return jsonify({
+                'error': f"Unknown export columns: {', '.join(unknown)}" if unknown else 'No columns selected',
+                'available_columns': list(USER_EXPORT_COLUMNS)
+            }), 400
         
-        output.seek(0)
+        compress = request.args.get('compress') == 'gzip'
+        filename = f'users_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv' + ('.gz' if compress else '')
         
         return Response(
-            output.getvalue(),
-            mimetype='text/csv',
+            stream_with_context(stream_users_csv(column_keys, compress=compress)),
+            mimetype='application/gzip' if compress else 'text/csv',
             headers={
-                'Content-Disposition': f'attachment; filename=users_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+                'Content-Disposition': f'attachment; filename={filename}',
+                'X-Accel-Buffering': 'no'  # Let proxies pass chunks through as they're produced
             }
         )
         
@@ -7282,18 +9930,31 @@ def api_sync_all_subscriptions():
         return jsonify({'error': 'Access denied'}), 403
     
     try:
-        success_count, error_count = sync_all_subscriptions_with_stripe()
+        data = request.get_json(silent=True) or {}
+        incremental = data.get('incremental', request.args.get('incremental') == 'true')
+        job = stripe_subscription_sync.start(incremental=bool(incremental))
         
         return jsonify({
             'success': True,
-            'synced': success_count,
-            'errors': error_count,
-            'message': f'Synced {success_count} users, {error_count} errors'
-        })
+            'job': job,
+            'message': f"Subscription sync {job['status']} ({job['mode']})"
+        }), 202
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/admin/sync-all-subscriptions/<job_id>')
+@login_required
+def api_sync_all_subscriptions_status(job_id):
+    """Progress of a bulk subscription sync job"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    job = stripe_subscription_sync.get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job})
+
 @app.route('/api/user/subscription-status')
 @login_required
 def api_get_subscription_status():
@@ -7338,6 +9999,88 @@ def subscription():
                          selected_plan=selected_plan)
 
 
+USER_PAGE_SIZE = 50
+
+
+def get_user_list_filters(args):
+    """Admin user list filters from query args; empty values mean no filter"""
+    return {
+        'q': (args.get('q') or '').strip(),
+        'status': args.get('status') or '',
+        'plan': args.get('plan') or '',
+        'admin': args.get('admin') or ''
+    }
+
+
+def encode_user_cursor(user):
+    return base64.urlsafe_b64encode(f"{user.created_at.isoformat()}|{user.id}".encode('utf-8')).decode('ascii')
+
+
+def decode_user_cursor(cursor):
+    """(created_at, id) from a page cursor, or None when it is missing or malformed"""
+    if not cursor:
+        return None
+    try:
+        created_at, user_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        return datetime.fromisoformat(created_at), int(user_id)
+    except ValueError:
+        # binascii.Error and Unicode errors are ValueErrors too; a tampered
+        # or stale cursor falls back to the first page
+        return None
+
+
+def query_user_page(filters, cursor=None, limit=USER_PAGE_SIZE):
+    """
+    One page of users ordered by (created_at, id) descending, and the cursor
+    for the next page (None on the last page). Each filter lines up with a
+    (column, created_at, id) index, and search is a prefix match so the
+    username/email indexes apply.
+    """
+    query = User.query
+    
+    if filters['q']:
+        pattern = filters['q'].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        query = query.filter(db.or_(User.username.like(pattern, escape='\\'), User.email.like(pattern, escape='\\')))
+    if filters['status']:
+        query = query.filter(User.subscription_status.is_(None) if filters['status'] == 'free'
+                             else User.subscription_status == filters['status'])
+    if filters['plan']:
+        query = query.filter(User.subscription_plan.is_(None) if filters['plan'] == 'free'
+                             else User.subscription_plan == filters['plan'])
+    if filters['admin'] in ('true', 'false'):
+        query = query.filter(User.is_admin == (filters['admin'] == 'true'))
+    
+    position = decode_user_cursor(cursor)
+    if position:
+        query = query.filter(db.tuple_(User.created_at, User.id) < position)
+    
+    users = query.order_by(User.created_at.desc(), User.id.desc()).limit(limit + 1).all()
+    if len(users) > limit:
+        return users[:limit], encode_user_cursor(users[limit - 1])
+    return users, None
+
+
+def get_user_activity_counts(user_ids):
+    """Completed-video and favorite counts for a page of users, in two grouped queries"""
+    counts = {user_id: {'completed': 0, 'favorites': 0} for user_id in user_ids}
+    if not user_ids:
+        return counts
+    
+    completed = db.session.query(UserProgress.user_id, db.func.count(UserProgress.id)).filter(
+        UserProgress.user_id.in_(user_ids), UserProgress.completed == True
+    ).group_by(UserProgress.user_id).all()
+    for user_id, count in completed:
+        counts[user_id]['completed'] = count
+    
+    favorites = db.session.query(UserFavorite.user_id, db.func.count(UserFavorite.id)).filter(
+        UserFavorite.user_id.in_(user_ids)
+    ).group_by(UserFavorite.user_id).all()
+    for user_id, count in favorites:
+        counts[user_id]['favorites'] = count
+    
+    return counts
+
+
 # Admin routes referenced in navigation
 @app.route('/admin/users')
 @login_required
@@ -7347,8 +10090,55 @@ def admin_users():
         flash('Access denied', 'error')
         return redirect(url_for('dashboard'))
     
-    users = User.query.order_by(User.created_at.desc()).all()
-    return render_template('admin/user_management.html', users=users)
+    filters = get_user_list_filters(request.args)
+    users, next_cursor = query_user_page(filters, request.args.get('cursor'))
+    
+    return render_template(
+        'admin/user_management.html',
+        users=users,
+        filters=filters,
+        next_cursor=next_cursor,
+        is_first_page=decode_user_cursor(request.args.get('cursor')) is None,
+        stats=get_subscription_metrics(),
+        activity_counts=get_user_activity_counts([user.id for user in users])
+    )
+
+@app.route('/api/admin/users')
+@login_required
+def api_admin_users():
+    """One page of users, newest first (?q=, status, plan, admin, cursor, limit)"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    try:
+        filters = get_user_list_filters(request.args)
+        limit = max(1, min(int(request.args.get('limit', USER_PAGE_SIZE)), 200))
+        users, next_cursor = query_user_page(filters, request.args.get('cursor'), limit)
+        
+        return jsonify({
+            'success': True,
+            'users': [{
+                'id': user.id,
+                'username': user.username,
+                'email': user.email,
+                'display_name': user.display_name,
+                'is_admin': user.is_admin,
+                'can_stream': user.can_stream,
+                'has_subscription': user.has_subscription,
+                'subscription_status': user.subscription_status,
+                'subscription_plan': user.subscription_plan,
+                'subscription_expires': user.subscription_expires.isoformat() if user.subscription_expires else None,
+                'total_revenue': float(user.total_revenue or 0),
+                'created_at': user.created_at.isoformat()
+            } for user in users],
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
+        })
+        
+    except ValueError as e:
+        return jsonify({'error': f'Invalid parameter: {e}'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/admin/revenue')
 @login_required
@@ -7390,39 +10180,104 @@ def stripe_webhook():
         print(f"❌ Invalid signature: {e}")
         return jsonify({'error': 'Invalid signature'}), 400
     
-    # Handle the event
+    # Store the verified event and acknowledge; a background worker processes it
+    if stripe_webhook_queue.ingest(event, payload, source='stripe') is None:
+        print(f"↩️ Duplicate Stripe event {event['id']} acknowledged")
+        return jsonify({'success': True, 'duplicate': True})
+    
+    return jsonify({'success': True, 'queued': True})
+
+
+def dispatch_stripe_event(event):
+    """Process a stored event received on the main webhook endpoint"""
+    if event['type'] == 'customer.subscription.created':
+        handle_subscription_created(event['data']['object'])
+    
+    elif event['type'] == 'customer.subscription.updated':
+        handle_subscription_updated(event['data']['object'])
+    
+    elif event['type'] == 'customer.subscription.deleted':
+        handle_subscription_deleted(event['data']['object'])
+    
+    elif event['type'] == 'invoice.payment_succeeded':
+        handle_payment_succeeded(event['data']['object'])
+    
+    elif event['type'] == 'invoice.payment_failed':
+        handle_payment_failed(event['data']['object'])
+    
+    elif event['type'] == 'customer.subscription.trial_will_end':
+        handle_trial_will_end(event['data']['object'])
+    
+    elif event['type'] == 'checkout.session.completed':
+        handle_checkout_completed(event['data']['object'])
+    
+    else:
+        print(f"ℹ️ Unhandled event type: {event['type']}")
+    
+    # Log all events for analytics
+    log_stripe_event(event)
+
+
+@app.route('/api/admin/stripe-events')
+@login_required
+def api_admin_stripe_events():
+    """Stored webhook events and queue status (admin only)"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+    
     try:
-        if event['type'] == 'customer.subscription.created':
-            handle_subscription_created(event['data']['object'])
-        
-        elif event['type'] == 'customer.subscription.updated':
-            handle_subscription_updated(event['data']['object'])
-        
-        elif event['type'] == 'customer.subscription.deleted':
-            handle_subscription_deleted(event['data']['object'])
-        
-        elif event['type'] == 'invoice.payment_succeeded':
-            handle_payment_succeeded(event['data']['object'])
+        status = request.args.get('status')
+        limit = min(int(request.args.get('limit', 50)), 200)
         
-        elif event['type'] == 'invoice.payment_failed':
-            handle_payment_failed(event['data']['object'])
+        query = StripeWebhookInbox.query
+        if status:
+            query = query.filter_by(status=status)
+        rows = query.order_by(StripeWebhookInbox.id.desc()).limit(limit).all()
         
-        elif event['type'] == 'customer.subscription.trial_will_end':
-            handle_trial_will_end(event['data']['object'])
+        return jsonify({
+            'success': True,
+            'queue': stripe_webhook_queue.stats(),
+            'events': [{
+                'id': row.id,
+                'stripe_event_id': row.stripe_event_id,
+                'event_type': row.event_type,
+                'source': row.source,
+                'status': row.status,
+                'attempts': row.attempts,
+                'last_error': row.last_error,
+                'received_at': row.received_at.isoformat(),
+                'processed_at': row.processed_at.isoformat() if row.processed_at else None
+            } for row in rows]
+        })
         
-        elif event['type'] == 'checkout.session.completed':
-            handle_checkout_completed(event['data']['object'])
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/admin/stripe-events/replay', methods=['POST'])
+@login_required
+def api_admin_replay_stripe_events():
+    """Requeue stored webhook events by id, or every failed event (admin only)"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    try:
+        data = request.get_json() or {}
+        event_ids = data.get('event_ids') or []
         
+        query = StripeWebhookInbox.query
+        if event_ids:
+            query = query.filter(StripeWebhookInbox.stripe_event_id.in_(event_ids))
         else:
-            print(f"ℹ️ Unhandled event type: {event['type']}")
+            query = query.filter_by(status='failed')
         
-        # Log all events for analytics
-        log_stripe_event(event)
+        queued = stripe_webhook_queue.replay(query)
+        stripe_webhook_queue.start()
         
-        return jsonify({'success': True})
+        return jsonify({'success': True, 'queued': queued})
         
     except Exception as e:
-        print(f"❌ Error handling webhook: {e}")
+        db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 
@@ -7519,40 +10374,32 @@ def api_grant_user_subscription():
 def calculate_analytics_summary():
     """Calculate summary analytics - updated for lifetime and fixed data types"""
     try:
-        # Basic metrics
-        total_users = User.query.count()
-        premium_users = User.query.filter_by(has_subscription=True).count()
+        # Churn rate (last 30 days) - lifetime users can't churn
+        thirty_days_ago = datetime.utcnow() - timedelta(days=30)
         
-        # Revenue calculation
-        total_revenue = db.session.query(db.func.sum(User.total_revenue)).scalar() or 0
+        # One query for every counter on the page
+        metrics = get_subscription_metrics(canceled_since=thirty_days_ago)
         
-        # MRR calculation (Monthly Recurring Revenue) - lifetime doesn't count toward MRR
-        monthly_subscribers = User.query.filter_by(subscription_plan='monthly', has_subscription=True).count()
-        annual_subscribers = User.query.filter_by(subscription_plan='annual', has_subscription=True).count()
-        lifetime_subscribers = User.query.filter_by(subscription_plan='lifetime', has_subscription=True).count()
+        total_users = metrics['total_users']
+        premium_users = metrics['total_subscribers']
+        total_revenue = metrics['total_revenue']
         
-        monthly_mrr = monthly_subscribers * 29  # $29/month
-        annual_mrr = annual_subscribers * (299 / 12)  # $299/year = ~$24.92/month
-        total_mrr = monthly_mrr + annual_mrr
+        # MRR calculation (Monthly Recurring Revenue) - lifetime doesn't count toward MRR
+        monthly_subscribers = metrics['monthly_subscribers']
+        annual_subscribers = metrics['annual_subscribers']
+        lifetime_subscribers = metrics['lifetime_subscribers']
+        total_mrr = metrics['mrr']
         
         # Calculate lifetime revenue impact
-        lifetime_revenue = lifetime_subscribers * 499
-        
-        # Churn rate (last 30 days) - lifetime users can't churn
-        thirty_days_ago = datetime.utcnow() - timedelta(days=30)
+        lifetime_revenue = lifetime_subscribers * PLAN_LIFETIME_PRICE
         
-        # Get canceled subscriptions (if you have the SubscriptionEvent model)
-        try:
-            canceled_last_30_days = SubscriptionEvent.query.filter(
-                SubscriptionEvent.event_type.like('%cancel%'),
-                SubscriptionEvent.created_at >= thirty_days_ago
-            ).count()
-        except:
-            canceled_last_30_days = 0
+        canceled_last_30_days = metrics['recent_cancellations']
         
         # Only count non-lifetime users for churn calculation
         non_lifetime_subscribers = premium_users - lifetime_subscribers
-        churn_rate = (canceled_last_30_days / non_lifetime_subscribers * 100) if non_lifetime_subscribers > 0 else 0
+        churn_rate = get_latest_churn_rate()
+        if churn_rate is None:
+            churn_rate = (canceled_last_30_days / non_lifetime_subscribers * 100) if non_lifetime_subscribers > 0 else 0
         
         # FIXED: Return numeric values for change calculations
         return {
@@ -7613,36 +10460,35 @@ def calculate_analytics_summary():
 def generate_chart_data(start_date, end_date):
     """Generate data for analytics charts - updated for lifetime"""
     try:
-        # Daily revenue data (same as before)
+        # Daily revenue data from the revenue_analytics rollup
         daily_revenue = []
         cumulative_revenue = []
         labels = []
         
-        current_date = start_date
         running_total = 0
-        
-        while current_date <= end_date:
-            day_revenue = 150  # Mock daily revenue
-            daily_revenue.append(day_revenue)
-            running_total += day_revenue
-            cumulative_revenue.append(running_total)
-            labels.append(current_date.strftime('%m/%d'))
-            current_date += timedelta(days=1)
+        for day in get_revenue_series(start_date, end_date):
+            daily_revenue.append(day['revenue'])
+            running_total += day['revenue']
+            cumulative_revenue.append(round(running_total, 2))
+            labels.append(day['date'].strftime('%m/%d'))
         
         # Subscription plans distribution - now includes lifetime
-        monthly_subs = User.query.filter_by(subscription_plan='monthly', has_subscription=True).count()
-        annual_subs = User.query.filter_by(subscription_plan='annual', has_subscription=True).count()
-        lifetime_subs = User.query.filter_by(subscription_plan='lifetime', has_subscription=True).count()
-        free_users = User.query.filter_by(has_subscription=False).count()
-        
-        # Cohort analysis (mock data)
-        cohort_labels = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun']
-        new_subs = [15, 22, 18, 25, 30, 28]
-        churned_subs = [3, 5, 4, 6, 8, 7]
-        
-        # ARPU data (mock)
-        arpu_labels = ['Week 1', 'Week 2', 'Week 3', 'Week 4']
-        arpu_data = [25.50, 27.20, 26.80, 28.30]
+        plans = get_plan_distribution()
+        monthly_subs = plans['monthly_subscribers']
+        annual_subs = plans['annual_subscribers']
+        lifetime_subs = plans['lifetime_subscribers']
+        free_users = plans['free_users']
+        
+        # Cohort movement and ARPU for the last six months from the cohort engine
+        cohort_report = cohort_engine.get_report()
+        movement = (cohort_report.get('mrr_movement') or [])[-6:]
+        cohort_labels = [month['month'] for month in movement]
+        new_subs = [month['new_customers'] for month in movement]
+        churned_subs = [month['churned_customers'] for month in movement]
+        
+        arpu_months = (cohort_report.get('arpu') or [])[-6:]
+        arpu_labels = [month['month'] for month in arpu_months]
+        arpu_data = [month['arpu'] for month in arpu_months]
         
         return {
             'revenue': {
@@ -7953,9 +10799,12 @@ def stop_livekit_egress_recording(egress_id):
         print(f"❌ Error stopping recording: {e}")
         return {'success': False, 'error': str(e)}
 
-def verify_s3_recording_exists(s3_url, max_wait_time=60):
+def verify_s3_recording_exists(s3_url, max_wait_time=60, initial_delay=5, backoff_factor=1.0, max_delay=30):
     """
     Verify that the recording file exists in S3 before syncing
+    
+    Polls head_object every initial_delay seconds; a backoff_factor above 1
+    grows the delay exponentially up to max_delay between checks.
     """
     print(f"⏳ Verifying recording file exists: {s3_url}")
     
@@ -7970,15 +10819,13 @@ def verify_s3_recording_exists(s3_url, max_wait_time=60):
         s3_key = '/'.join(url_parts[1:])
         bucket = bucket_and_region.split('.s3.')[0]
         
-        # Initialize S3 client
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=app.config['AWS_ACCESS_KEY_ID'],
-            aws_secret_access_key=app.config['AWS_SECRET_ACCESS_KEY'],
-            region_name=app.config.get('AWS_REGION', 'us-east-1')
-        )
+        # Reuse the shared client for the bucket's region
+        region_part = bucket_and_region.split('.s3.')[1] if '.s3.' in bucket_and_region else ''
+        bucket_region = region_part.replace('.amazonaws.com', '') or None
+        s3_client = get_s3_client(bucket_region)
         
         start_time = time.time()
+        delay = initial_delay
         while time.time() - start_time < max_wait_time:
             try:
                 # Check if file exists and has content
@@ -7996,7 +10843,11 @@ def verify_s3_recording_exists(s3_url, max_wait_time=60):
             except Exception as e:
                 print(f"⚠️ Error checking file: {e}")
             
-            time.sleep(5)  # Check every 5 seconds
+            remaining = max_wait_time - (time.time() - start_time)
+            if remaining <= 0:
+                break
+            time.sleep(min(delay, remaining))
+            delay = min(delay * backoff_factor, max_delay)
         
         print(f"⚠️ Timeout waiting for recording file after {max_wait_time}s")
         return False
@@ -8094,31 +10945,31 @@ def get_or_create_tag(tag_name):
     return tag
 
 def broadcast_notification(title, message, notification_type, target_users='all'):
-    """Send notification to multiple users"""
-    try:
-        if target_users == 'all':
-            users = User.query.all()
-        elif target_users == 'premium':
-            users = User.query.filter_by(has_subscription=True).all()
-        elif target_users == 'free':
-            users = User.query.filter_by(has_subscription=False).all()
-        else:
-            users = []
-        
-        for user in users:
-            notification = Notification(
-                user_id=user.id,
-                title=title,
-                message=message,
-                notification_type=notification_type
-            )
-            db.session.add(notification)
-        
-        db.session.flush()
-        print(f"📢 Sent notification to {len(users)} users: {title}")
+    """
+    Send notification to multiple users.
+    
+    Stores one broadcast_messages row for the audience; users see it through
+    get_user_notification_feed and track read state with their watermarks.
+    """
+    if target_users not in ('all', 'premium', 'free'):
+        return None
+    
+    try:
+        broadcast = BroadcastMessage(
+            title=title,
+            message=message,
+            notification_type=notification_type,
+            audience=target_users
+        )
+        db.session.add(broadcast)
+        db.session.commit()
+        print(f"📢 Broadcast notification {broadcast.id} to '{target_users}' users: {title}")
+        return broadcast
         
     except Exception as e:
         print(f"Error sending notifications: {e}")
+        db.session.rollback()
+        return None
 
 # Routes (keeping all existing routes but updating stream-related ones)
 @app.route('/')
@@ -8140,14 +10991,10 @@ def dashboard():
     favorite_count = UserFavorite.query.filter_by(user_id=current_user.id).count()
     
     # Get recent activity
-    recent_activity = UserActivity.query.filter_by(user_id=current_user.id)\
-                                       .order_by(UserActivity.timestamp.desc())\
-                                       .limit(5).all()
+    recent_activity = get_recent_user_activity(current_user.id, limit=5)
     
     # Get notifications
-    notifications = Notification.query.filter_by(user_id=current_user.id, is_read=False)\
-                                     .order_by(Notification.created_at.desc())\
-                                     .limit(5).all()
+    notifications = get_user_notification_feed(current_user, limit=5, unread_only=True)
     
     return render_template('dashboard.html',
                          progress_percentage=progress_percentage,
@@ -8558,33 +11405,179 @@ def api_get_analytics():
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
         
-        # Calculate date range
-        if start_date and end_date:
-            start_dt = datetime.strptime(start_date, '%Y-%m-%d')
-            end_dt = datetime.strptime(end_date, '%Y-%m-%d')
-        else:
-            end_dt = datetime.utcnow()
-            if period == 'all':
-                start_dt = User.query.order_by(User.created_at).first().created_at
-            else:
-                days = int(period)
-                start_dt = end_dt - timedelta(days=days)
+        if not (start_date and end_date):
+            start_date = end_date = None
+        
+        def build_analytics():
+            start_dt, end_dt = get_analytics_date_range(period, start_date, end_date)
+            return {
+                'success': True,
+                'metrics': calculate_period_metrics(start_dt, end_dt),
+                'charts': generate_chart_data(start_dt, end_dt)
+            }
+        
+        return jsonify(analytics_cache.get_or_compute(
+            'analytics', build_analytics, period=period, start=start_date, end=end_date
+        ))
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/analytics/benchmark')
+@login_required
+def api_benchmark_analytics():
+    """Query count and timing for each analytics computation (admin only)"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    try:
+        end_dt = datetime.utcnow()
+        start_dt = end_dt - timedelta(days=int(request.args.get('period', 30)))
+        
+        runs = {
+            'calculate_analytics_summary': lambda: calculate_analytics_summary(),
+            'calculate_enhanced_analytics': lambda: calculate_enhanced_analytics(start_dt, end_dt),
+            'generate_chart_data': lambda: generate_chart_data(start_dt, end_dt),
+            'analytics_api_load': lambda: (calculate_period_metrics(start_dt, end_dt), generate_chart_data(start_dt, end_dt)),
+        }
+        
+        results = {}
+        for name, run in runs.items():
+            g.pop('subscription_metrics', None)  # Measure each one cold
+            with count_queries() as stats:
+                run()
+            results[name] = stats
         
-        # Get metrics
-        metrics = calculate_period_metrics(start_dt, end_dt)
+        return jsonify({'success': True, 'benchmark': results, 'response_cache': analytics_cache.stats()})
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/analytics/cohorts')
+@login_required
+def api_cohort_analytics():
+    """Cohort retention, MRR movement and ARPU by month (admin only)"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    try:
+        if request.args.get('refresh') == 'true':
+            cohort_engine.invalidate()  # Rebuilt in the background; this response is the current report
         
-        # Get chart data
-        charts = generate_chart_data(start_dt, end_dt)
+        started = time.perf_counter()
+        report = cohort_engine.get_report()
         
         return jsonify({
             'success': True,
-            'metrics': metrics,
-            'charts': charts
+            'report': report,
+            'duration_ms': round((time.perf_counter() - started) * 1000, 1)
         })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+RECENT_TRANSACTIONS_LIMIT = 50
+LIVE_TRANSACTIONS_CACHE_SECONDS = 60
+
+
+def get_plan_for_payment(price_id=None, amount=None):
+    """Plan name for a payment from its Stripe price, falling back to the amount"""
+    price_plan_mapping = {
+        app.config.get('STRIPE_MONTHLY_PRICE_ID'): 'monthly',
+        app.config.get('STRIPE_ANNUAL_PRICE_ID'): 'annual',
+        app.config.get('STRIPE_LIFETIME_PRICE_ID'): 'lifetime'
+    }
+    if price_id and price_id in price_plan_mapping:
+        return price_plan_mapping[price_id]
+    if amount is None:
+        return 'unknown'
+    
+    amount = float(amount)
+    if amount >= PLAN_LIFETIME_PRICE:
+        return 'lifetime'
+    if amount >= PLAN_ANNUAL_PRICE:
+        return 'annual'
+    return 'monthly'
+
+
+def get_recent_transactions(limit=RECENT_TRANSACTIONS_LIMIT):
+    """Latest successful payments from webhook-fed subscription_events (uses ix_subscription_events_type_created)"""
+    rows = db.session.execute(
+        db.select(
+            SubscriptionEvent.stripe_object_id,
+            SubscriptionEvent.stripe_customer_id,
+            SubscriptionEvent.stripe_price_id,
+            SubscriptionEvent.amount,
+            SubscriptionEvent.object_status,
+            SubscriptionEvent.created_at,
+            User.username,
+            User.email
+        ).outerjoin(User, User.id == SubscriptionEvent.user_id).where(
+            SubscriptionEvent.event_type.in_(REVENUE_EVENT_TYPES),
+            SubscriptionEvent.amount > 0
+        ).order_by(SubscriptionEvent.created_at.desc(), SubscriptionEvent.id.desc()).limit(limit)
+    ).all()
+    
+    return [{
+        'id': row.stripe_object_id,
+        'date': row.created_at.strftime('%m/%d/%Y'),
+        'created_at': row.created_at.isoformat(),
+        'customer_name': row.username or 'Unknown',
+        'customer_email': row.email or 'Unknown',
+        'amount': f"{row.amount:.2f}",
+        'status': 'succeeded' if row.object_status in (None, 'paid') else row.object_status,
+        'plan': get_plan_for_payment(row.stripe_price_id, row.amount)
+    } for row in rows]
+
+
+def fetch_live_transactions(days=30, limit=RECENT_TRANSACTIONS_LIMIT):
+    """
+    Recent payments straight from Stripe: one global PaymentIntent list
+    paged with a created cursor (customers expanded inline), then a single
+    local lookup for usernames. Cached briefly so repeated loads don't
+    spend the Stripe rate limit.
+    """
+    cache_key = f"live_transactions:{days}:{limit}"
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+    
+    since = int((datetime.utcnow() - timedelta(days=days)).timestamp())
+    payments = []
+    intents = stripe.PaymentIntent.list(limit=100, created={'gte': since}, expand=['data.customer'])
+    for payment in intents.auto_paging_iter():  # Newest first; stops paging once we have enough
+        if payment.status in ['succeeded', 'processing']:
+            payments.append(payment)
+            if len(payments) >= limit:
+                break
+    
+    customer_ids = {payment.customer.id for payment in payments if payment.customer}
+    users = {}
+    if customer_ids:
+        users = {user.stripe_customer_id: user for user in User.query.filter(User.stripe_customer_id.in_(customer_ids)).all()}
+    
+    transactions = []
+    for payment in payments:
+        customer = payment.customer
+        user = users.get(customer.id) if customer else None
+        amount = payment.amount / 100
+        transactions.append({
+            'id': payment.id,
+            'date': datetime.utcfromtimestamp(payment.created).strftime('%m/%d/%Y'),
+            'created_at': datetime.utcfromtimestamp(payment.created).isoformat(),
+            'customer_name': user.username if user else (customer.name if customer else None) or 'Unknown',
+            'customer_email': user.email if user else (customer.email if customer else None) or 'Unknown',
+            'amount': f"{amount:.2f}",
+            'status': payment.status,
+            'plan': get_plan_for_payment(amount=amount)
+        })
+    
+    if cache is not None:
+        cache.set(cache_key, transactions, timeout=LIVE_TRANSACTIONS_CACHE_SECONDS)
+    return transactions
+
+
 @app.route('/api/admin/recent-transactions')
 @login_required
 def api_get_recent_transactions():
@@ -8592,40 +11585,17 @@ def api_get_recent_transactions():
         return jsonify({'error': 'Access denied'}), 403
     
     try:
-        # Get recent transactions from Stripe
-        transactions = []
-        
-        # Get all customers
-        customers = stripe.Customer.list(limit=100)
-        
-        for customer in customers.data:
-            # Get recent payment intents for this customer
-            payments = stripe.PaymentIntent.list(
-                customer=customer.id,
-                limit=10
-            )
-            
-            for payment in payments.data:
-                if payment.status in ['succeeded', 'processing']:
-                    # Find associated user
-                    user = User.query.filter_by(stripe_customer_id=customer.id).first()
-                    
-                    transactions.append({
-                        'id': payment.id,
-                        'date': datetime.fromtimestamp(payment.created).strftime('%m/%d/%Y'),
-                        'customer_name': user.username if user else customer.name or 'Unknown',
-                        'customer_email': user.email if user else customer.email or 'Unknown',
-                        'amount': f"{payment.amount / 100:.2f}",
-                        'status': payment.status,
-                        'plan': determine_plan_from_payment(payment)
-                    })
+        limit = min(int(request.args.get('limit', RECENT_TRANSACTIONS_LIMIT)), 200)
         
-        # Sort by date (most recent first)
-        transactions.sort(key=lambda x: x['date'], reverse=True)
+        # Stored webhook events by default; ?source=stripe asks Stripe directly
+        if request.args.get('source') == 'stripe':
+            transactions = fetch_live_transactions(days=int(request.args.get('days', 30)), limit=limit)
+        else:
+            transactions = get_recent_transactions(limit)
         
         return jsonify({
             'success': True,
-            'transactions': transactions[:50]  # Return last 50 transactions
+            'transactions': transactions
         })
         
     except Exception as e:
@@ -8638,20 +11608,17 @@ def api_refresh_analytics():
         return jsonify({'error': 'Access denied'}), 403
     
     try:
-        # Sync all users with Stripe
-        users_with_stripe = User.query.filter(User.stripe_customer_id.isnot(None)).all()
-        synced_count = 0
-        
-        for user in users_with_stripe:
-            if sync_user_with_stripe(user.id):
-                synced_count += 1
+        # Pick up subscription changes in the background
+        job = stripe_subscription_sync.start(incremental=True)
         
         # Update revenue analytics
         update_revenue_analytics()
+        invalidate_analytics_cache()
         
         return jsonify({
             'success': True,
-            'message': f'Refreshed analytics for {synced_count} users'
+            'job': job,
+            'message': f"Revenue analytics refreshed; subscription sync {job['status']}"
         })
         
     except Exception as e:
@@ -8757,6 +11724,7 @@ def api_stream_join():
                         'stream_id': stream_id,
                         'message': 'Recording has started'
                     }, room=f"stream_{stream_id}")
+                broadcast_stream_status('recording_started', stream_id=stream_id)
             else:
                 print(f"⚠️ Recording failed to start")
                 result['recording'] = {
@@ -9679,29 +12647,21 @@ def livestream():
     active_streams = Stream.query.filter_by(is_active=True).all()
     
     streams_by_streamer = {}
-    tokens_by_stream = {}
     
     for stream in active_streams:
         streamer = stream.streamer_name or 'Unknown'
         streams_by_streamer[streamer] = stream
-        
-        # Generate viewer token for each active stream
-        participant_identity = f"viewer-{current_user.id}-{uuid.uuid4().hex[:8]}"
-        participant_name = current_user.username
-        
-        viewer_token = generate_livekit_token(
-            stream.room_name,
-            participant_identity,
-            participant_name,
-            is_publisher=False
-        )
-        
-        if viewer_token:
-            tokens_by_stream[stream.id] = {
-                'token': viewer_token,
-                'participant_identity': participant_identity,
-                'room_name': stream.room_name
-            }
+    
+    # Tokens are reused per browser session until near expiry; another device
+    # has its own session and so its own identity
+    if 'livekit_client_id' not in session:
+        session['livekit_client_id'] = uuid.uuid4().hex
+    tokens_by_stream = livekit_tokens.issue_viewer_tokens(
+        current_user.id,
+        current_user.username,
+        active_streams,
+        client_id=session['livekit_client_id']
+    )
     
     active_streams_dict = [stream.to_dict() for stream in active_streams] if active_streams else []
     
@@ -10222,6 +13182,21 @@ def initialize_complete_app():
             
             # Existing migrations
             migrate_user_timezones()
+            migrate_notification_indexes()
+            migrate_subscription_event_ids()
+            migrate_user_indexes()
+            
+            # Deliver any Discord embeds left queued by a previous run
+            discord_dispatcher.start()
+            
+            # Process Stripe events stored but not handled before the last shutdown
+            stripe_webhook_queue.start()
+            
+            # Keep the daily revenue rollup current
+            start_revenue_rollup()
+            
+            # Resume recording finalization left unfinished by a previous run
+            recording_worker.start()
             
             # NEW: Enhanced livestream initialization
             if not initialize_enhanced_livestream():
@@ -10403,13 +13378,7 @@ def upload_stream_recording():
         
         print(f"📤 Uploading recording to S3: {s3_key}")
         
-        # Initialize S3 client
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=app.config['AWS_ACCESS_KEY_ID'],
-            aws_secret_access_key=app.config['AWS_SECRET_ACCESS_KEY'],
-            region_name=app.config.get('AWS_REGION', 'us-east-1')
-        )
+        s3_client = get_s3_client()
         
         # Upload to S3
         s3_client.upload_fileobj(
@@ -10446,6 +13415,313 @@ def upload_stream_recording():
         print(f"❌ Upload error: {e}")
         return jsonify({'error': str(e)}), 500
 
+# Resumable multipart recording upload
+#
+# 1. POST   /api/stream/upload-recording/multipart                    -> upload_id, part_size
+# 2. PUT    /api/stream/upload-recording/multipart/<upload_id>/parts/<n>  (raw part bytes, ?final=true on the last)
+#    or POST /api/stream/upload-recording/multipart/<upload_id>/part-urls for presigned S3 URLs
+# 3. GET    /api/stream/upload-recording/multipart/<upload_id>        -> uploaded parts, to resume
+# 4. POST   /api/stream/upload-recording/multipart/<upload_id>/complete
+#    DELETE /api/stream/upload-recording/multipart/<upload_id>        -> abort
+RECORDING_UPLOAD_PART_SIZE = 8 * 1024 * 1024
+RECORDING_UPLOAD_MIN_PART_SIZE = 5 * 1024 * 1024  # S3 minimum for every part but the last
+RECORDING_UPLOAD_MAX_PARTS = 10000
+
+
+def get_recording_upload_or_404(upload_id):
+    """Load an in-progress upload owned by the current admin"""
+    upload = RecordingUpload.query.filter_by(upload_id=upload_id, user_id=current_user.id).first()
+    if not upload:
+        return None, (jsonify({'error': 'Upload not found'}), 404)
+    if upload.status != 'in_progress':
+        return None, (jsonify({'error': f'Upload is already {upload.status}'}), 409)
+    return upload, None
+
+
+@app.route('/api/stream/upload-recording/multipart', methods=['POST'])
+@login_required
+def api_start_recording_upload():
+    """Start a resumable multipart upload for a client-side recording"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    try:
+        data = request.get_json() or {}
+        stream_id = data.get('stream_id')
+        streamer_name = secure_filename(data.get('streamer_name') or current_user.display_name or current_user.username)
+        content_type = data.get('content_type', 'video/webm')
+        extension = 'mp4' if content_type == 'video/mp4' else 'webm'
+        
+        bucket = app.config.get('STREAM_RECORDINGS_BUCKET', 'tgfx-tradelab')
+        timestamp = datetime.utcnow().strftime('%Y%m%d-%H%M%S')
+        s3_key = f"livestream-recordings/{streamer_name}/{streamer_name}-stream-{stream_id}-{timestamp}.{extension}"
+        
+        s3_client = get_s3_client()
+        response = s3_client.create_multipart_upload(
+            Bucket=bucket,
+            Key=s3_key,
+            ContentType=content_type,
+            Metadata={
+                'streamer': streamer_name,
+                'stream_id': str(stream_id)
+            }
+        )
+        
+        upload = RecordingUpload(
+            upload_id=response['UploadId'],
+            bucket=bucket,
+            s3_key=s3_key,
+            content_type=content_type,
+            stream_id=stream_id,
+            user_id=current_user.id
+        )
+        db.session.add(upload)
+        db.session.commit()
+        
+        print(f"📤 Started multipart recording upload: {s3_key}")
+        
+        return jsonify({
+            'success': True,
+            'upload_id': upload.upload_id,
+            'key': s3_key,
+            'part_size': RECORDING_UPLOAD_PART_SIZE,
+            'max_parts': RECORDING_UPLOAD_MAX_PARTS
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Multipart upload start error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/stream/upload-recording/multipart/<upload_id>/parts/<int:part_number>', methods=['PUT'])
+@login_required
+def api_upload_recording_part(upload_id, part_number):
+    """Forward one part straight to S3 and record its ETag"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    if part_number < 1 or part_number > RECORDING_UPLOAD_MAX_PARTS:
+        return jsonify({'error': f'Part number must be between 1 and {RECORDING_UPLOAD_MAX_PARTS}'}), 400
+    
+    upload, error_response = get_recording_upload_or_404(upload_id)
+    if error_response:
+        return error_response
+    
+    content_length = request.content_length or 0
+    if content_length <= 0:
+        return jsonify({'error': 'Empty part'}), 400
+    if content_length > RECORDING_UPLOAD_PART_SIZE * 2:
+        return jsonify({'error': f'Part exceeds {RECORDING_UPLOAD_PART_SIZE * 2} bytes'}), 413
+    if content_length < RECORDING_UPLOAD_MIN_PART_SIZE and request.args.get('final') != 'true':
+        # S3 would only reject this at completion, after every other part was sent
+        return jsonify({'error': f'Only the final part (?final=true) may be smaller than {RECORDING_UPLOAD_MIN_PART_SIZE} bytes'}), 400
+    
+    try:
+        # Only this part is held in memory; the whole recording never is
+        body = request.get_data(cache=False)
+        
+        response = get_s3_client().upload_part(
+            Bucket=upload.bucket,
+            Key=upload.s3_key,
+            UploadId=upload.upload_id,
+            PartNumber=part_number,
+            Body=body
+        )
+        etag = response['ETag']
+        
+        # Re-sent parts replace the previous ETag
+        part = RecordingUploadPart.query.filter_by(
+            recording_upload_id=upload.id,
+            part_number=part_number
+        ).first()
+        if part:
+            part.etag = etag
+            part.size = len(body)
+            part.uploaded_at = datetime.utcnow()
+        else:
+            db.session.add(RecordingUploadPart(
+                recording_upload_id=upload.id,
+                part_number=part_number,
+                etag=etag,
+                size=len(body)
+            ))
+        db.session.commit()
+        
+        return jsonify({'success': True, 'part_number': part_number, 'etag': etag})
+        
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Multipart part {part_number} upload error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/stream/upload-recording/multipart/<upload_id>/part-urls', methods=['POST'])
+@login_required
+def api_recording_upload_part_urls(upload_id):
+    """Presign part URLs so the browser can PUT parts to S3 directly"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    upload, error_response = get_recording_upload_or_404(upload_id)
+    if error_response:
+        return error_response
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        part_numbers = [int(n) for n in data.get('part_numbers', [])][:100]
+    except (AttributeError, TypeError, ValueError):
+        return jsonify({'error': 'Invalid part_numbers'}), 400
+    if not part_numbers or any(n < 1 or n > RECORDING_UPLOAD_MAX_PARTS for n in part_numbers):
+        return jsonify({'error': 'Invalid part_numbers'}), 400
+    
+    s3_client = get_s3_client()
+    urls = {
+        part_number: s3_client.generate_presigned_url(
+            'upload_part',
+            Params={
+                'Bucket': upload.bucket,
+                'Key': upload.s3_key,
+                'UploadId': upload.upload_id,
+                'PartNumber': part_number
+            },
+            ExpiresIn=3600
+        )
+        for part_number in part_numbers
+    }
+    
+    return jsonify({'success': True, 'urls': urls, 'expires_in': 3600})
+
+
+@app.route('/api/stream/upload-recording/multipart/<upload_id>', methods=['GET'])
+@login_required
+def api_recording_upload_status(upload_id):
+    """List the parts already uploaded so an interrupted client can resume"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    upload = RecordingUpload.query.filter_by(upload_id=upload_id, user_id=current_user.id).first()
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+    
+    return jsonify({
+        'success': True,
+        'upload_id': upload.upload_id,
+        'status': upload.status,
+        'key': upload.s3_key,
+        'url': upload.s3_url,
+        'part_size': RECORDING_UPLOAD_PART_SIZE,
+        'parts': [
+            {'part_number': part.part_number, 'etag': part.etag, 'size': part.size}
+            for part in upload.parts
+        ],
+        'uploaded_bytes': sum(part.size for part in upload.parts)
+    })
+
+
+def list_s3_upload_parts(upload):
+    """Fetch every uploaded part's ETag from S3 (covers parts sent via presigned URLs)"""
+    s3_client = get_s3_client()
+    parts = []
+    kwargs = {'Bucket': upload.bucket, 'Key': upload.s3_key, 'UploadId': upload.upload_id}
+    
+    while True:
+        response = s3_client.list_parts(**kwargs)
+        parts.extend(
+            {'PartNumber': part['PartNumber'], 'ETag': part['ETag']}
+            for part in response.get('Parts', [])
+        )
+        if not response.get('IsTruncated'):
+            break
+        kwargs['PartNumberMarker'] = response['NextPartNumberMarker']
+    
+    return parts
+
+
+@app.route('/api/stream/upload-recording/multipart/<upload_id>/complete', methods=['POST'])
+@login_required
+def api_complete_recording_upload(upload_id):
+    """Assemble the uploaded parts and attach the recording to its stream"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    upload, error_response = get_recording_upload_or_404(upload_id)
+    if error_response:
+        return error_response
+    
+    try:
+        parts = list_s3_upload_parts(upload)
+        if not parts:
+            return jsonify({'error': 'No parts uploaded'}), 400
+        
+        get_s3_client().complete_multipart_upload(
+            Bucket=upload.bucket,
+            Key=upload.s3_key,
+            UploadId=upload.upload_id,
+            MultipartUpload={'Parts': sorted(parts, key=lambda part: part['PartNumber'])}
+        )
+        
+        s3_url = f"https://{upload.bucket}.s3.amazonaws.com/{upload.s3_key}"
+        upload.status = 'completed'
+        upload.s3_url = s3_url
+        upload.completed_at = datetime.utcnow()
+        
+        # Update stream record with recording URL
+        stream = Stream.query.get(upload.stream_id) if upload.stream_id else None
+        if stream:
+            stream.recording_url = s3_url
+            stream.is_recording = False
+        
+        db.session.commit()
+        print(f"✅ Multipart recording upload completed: {s3_url}")
+        
+        return jsonify({
+            'success': True,
+            'url': s3_url,
+            'parts': len(parts),
+            'message': 'Recording saved to S3'
+        })
+        
+    except ClientError as e:
+        db.session.rollback()
+        print(f"❌ Multipart upload completion error: {e}")
+        if e.response.get('Error', {}).get('Code') == 'EntityTooSmall':
+            # Parts sent through presigned URLs skip the size check above
+            return jsonify({'error': f'Every part but the last must be at least {RECORDING_UPLOAD_MIN_PART_SIZE} bytes'}), 400
+        return jsonify({'error': str(e)}), 500
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Multipart upload completion error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/stream/upload-recording/multipart/<upload_id>', methods=['DELETE'])
+@login_required
+def api_abort_recording_upload(upload_id):
+    """Abort an upload and release the parts stored in S3"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    upload, error_response = get_recording_upload_or_404(upload_id)
+    if error_response:
+        return error_response
+    
+    try:
+        get_s3_client().abort_multipart_upload(
+            Bucket=upload.bucket,
+            Key=upload.s3_key,
+            UploadId=upload.upload_id
+        )
+        upload.status = 'aborted'
+        db.session.commit()
+        
+        return jsonify({'success': True, 'message': 'Upload aborted'})
+        
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Multipart upload abort error: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/admin/test-discord-webhook', methods=['POST'])
 @login_required
 def api_test_discord_webhook():
@@ -10549,43 +13825,78 @@ def api_test_discord_webhook():
         return jsonify({'error': str(e)}), 500
         
     
-@app.route('/api/stream/status')
-@login_required
-def api_stream_status():
+# Socket.IO room that receives stream start/stop, viewer and recording changes
+STREAM_LOBBY_ROOM = 'stream_lobby'
+# Admin sockets join this on connect; it carries recording pipeline details
+STREAM_ADMIN_ROOM = 'stream_admins'
+
+
+def build_stream_status_payload(reason=None):
+    """Build the active stream snapshot shared by /api/stream/status and the lobby push"""
     active_streams = Stream.query.filter_by(is_active=True).all()
     
     if not active_streams:
-        return jsonify({'active': False, 'streams': []})
-    
-    streams_data = []
-    for stream in active_streams:
-        active_viewers = StreamViewer.query.filter_by(
-            stream_id=stream.id,
-            is_active=True
-        ).count()
+        payload = {'active': False, 'count': 0, 'streams': []}
+    else:
+        # One grouped count instead of a COUNT per stream
+        viewer_counts = dict(
+            db.session.query(StreamViewer.stream_id, db.func.count(StreamViewer.id))
+            .filter(
+                StreamViewer.stream_id.in_([stream.id for stream in active_streams]),
+                StreamViewer.is_active == True
+            )
+            .group_by(StreamViewer.stream_id)
+            .all()
+        )
         
-        stream.viewer_count = active_viewers
+        streams_data = []
+        for stream in active_streams:
+            streams_data.append({
+                'id': stream.id,
+                'title': stream.title,
+                'description': stream.description,
+                'streamer_name': stream.streamer_name,
+                'stream_type': stream.stream_type,
+                'viewer_count': viewer_counts.get(stream.id, 0),
+                'started_at': stream.started_at.isoformat() if stream.started_at else None,
+                'is_recording': stream.is_recording,
+                'created_by': stream.created_by,
+                'stream_color': stream.creator.stream_color if stream.creator else '#10B981'
+            })
         
-        streams_data.append({
-            'id': stream.id,
-            'title': stream.title,
-            'description': stream.description,
-            'streamer_name': stream.streamer_name,
-            'stream_type': stream.stream_type,
-            'viewer_count': stream.viewer_count,
-            'started_at': stream.started_at.isoformat() if stream.started_at else None,
-            'is_recording': stream.is_recording,
-            'created_by': stream.created_by,
-            'stream_color': stream.creator.stream_color if stream.creator else '#10B981'
-        })
+        payload = {
+            'active': True,
+            'count': len(active_streams),
+            'streams': streams_data
+        }
     
-    db.session.commit()
+    if reason:
+        payload['reason'] = reason
+    payload['timestamp'] = time.time()
+    return payload
+
+
+def broadcast_stream_status(reason, stream_id=None):
+    """Push the current stream snapshot to every client in the lobby room"""
+    if not socketio:
+        return False
     
-    return jsonify({
-        'active': True,
-        'count': len(active_streams),
-        'streams': streams_data
-    })
+    try:
+        payload = build_stream_status_payload(reason=reason)
+        if stream_id is not None:
+            payload['stream_id'] = stream_id
+        socketio.emit('stream_status', payload, room=STREAM_LOBBY_ROOM)
+        return True
+    except Exception as e:
+        print(f"⚠️ Failed to broadcast stream status ({reason}): {e}")
+        return False
+
+
+@app.route('/api/stream/status')
+@login_required
+def api_stream_status():
+    """Polling fallback for clients that can't hold a Socket.IO connection"""
+    return jsonify(build_stream_status_payload())
 
 @app.route('/api/stream/recording/start', methods=['POST'])
 @login_required
@@ -10636,6 +13947,7 @@ def api_start_stream_recording():
                 'message': 'Recording has started',
                 'egress_id': recording_result.get('egress_id')
             }, room=f"stream_{stream.id}")
+        broadcast_stream_status('recording_started', stream_id=stream.id)
         
         return jsonify({
             'success': True,
@@ -10685,6 +13997,7 @@ def api_stop_recording():
                 stream.recording_url = recording_url
             
             db.session.commit()
+            broadcast_stream_status('recording_stopped', stream_id=stream.id)
             
             return jsonify({
                 'success': True, 
@@ -10820,6 +14133,15 @@ def signal_handler(signum, frame):
     """Handle shutdown signals gracefully"""
     print(f"\n📡 Received signal {signum}, shutting down gracefully...")
     
+    # Write buffered activity before the connections go away
+    try:
+        with app.app_context():
+            flushed = activity_log.flush()
+        if flushed:
+            print(f"✓ Flushed {flushed} buffered user activities")
+    except Exception as e:
+        print(f"⚠ Activity log flush warning: {e}")
+    
     # Close database connections
     if db:
         try:
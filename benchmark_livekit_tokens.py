@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+LiveKit Token Benchmark for TGFX Trade Lab
+Measures viewer token signing against cached lookups
+
+Runs against the app's LiveKitTokenService with the configured
+LIVEKIT_API_KEY / LIVEKIT_API_SECRET. Without credentials the service hands
+out development tokens, which are never cached, so the numbers are only
+meaningful with real credentials set.
+
+Usage:
+    python benchmark_livekit_tokens.py                      # 1000 iterations
+    python benchmark_livekit_tokens.py --iterations 10000
+"""
+
+import os
+import sys
+import time
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app, LiveKitTokenService
+
+
+def parse_args(args):
+    options = {'iterations': 1000}
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == '--iterations' and i + 1 < len(args):
+            options['iterations'] = max(int(args[i + 1]), 1)
+            i += 1
+        i += 1
+    return options
+
+
+def run_benchmark(options):
+    """Time signing fresh tokens and cached lookups, in microseconds per token"""
+    iterations = options['iterations']
+    # A separate service so the benchmark doesn't touch the app's token cache
+    tokens = LiveKitTokenService(app)
+
+    start = time.perf_counter()
+    for i in range(iterations):
+        tokens.sign('benchmark-room', f'benchmark-{i}', 'Benchmark', is_publisher=False)
+    sign_us = (time.perf_counter() - start) * 1_000_000 / iterations
+
+    tokens.get_viewer_token(0, 'benchmark-room', 'Benchmark', client_id='benchmark')
+    start = time.perf_counter()
+    for _ in range(iterations):
+        tokens.get_viewer_token(0, 'benchmark-room', 'Benchmark', client_id='benchmark')
+    cached_us = (time.perf_counter() - start) * 1_000_000 / iterations
+
+    print(f"🔑 {iterations} iterations")
+    print(f"   sign:   {sign_us:.2f}µs per token")
+    print(f"   cached: {cached_us:.2f}µs per token ({tokens.stats['cache_hits']} cache hits)")
+    return True
+
+
+if __name__ == "__main__":
+    success = run_benchmark(parse_args(sys.argv[1:]))
+    sys.exit(0 if success else 1)
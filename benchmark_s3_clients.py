@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+S3 Client Benchmark for TGFX Trade Lab
+Measures building an S3 client per call against the shared get_s3_client()
+
+Client construction is timed locally and needs no network access. With
+--bucket and --key, each approach also makes HEAD requests for that object,
+which shows the shared client reusing its pooled connections instead of a
+new TLS handshake per call.
+
+Usage:
+    python benchmark_s3_clients.py                          # 50 iterations, construction only
+    python benchmark_s3_clients.py --iterations 200
+    python benchmark_s3_clients.py --bucket tgfx-tradelab --key livestream-recordings/example.webm
+"""
+
+import os
+import sys
+import time
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import boto3
+from botocore.exceptions import ClientError
+
+from app import app, get_s3_client
+
+
+def parse_args(args):
+    options = {'iterations': 50, 'bucket': None, 'key': None}
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == '--iterations' and i + 1 < len(args):
+            options['iterations'] = max(int(args[i + 1]), 1)
+            i += 1
+        elif arg == '--bucket' and i + 1 < len(args):
+            options['bucket'] = args[i + 1]
+            i += 1
+        elif arg == '--key' and i + 1 < len(args):
+            options['key'] = args[i + 1]
+            i += 1
+        i += 1
+    return options
+
+
+def build_client():
+    """A fresh client, the way each call site used to build one"""
+    return boto3.client(
+        's3',
+        aws_access_key_id=app.config['AWS_ACCESS_KEY_ID'],
+        aws_secret_access_key=app.config['AWS_SECRET_ACCESS_KEY'],
+        region_name=app.config.get('AWS_REGION', 'us-east-1')
+    )
+
+
+def time_calls(label, iterations, call):
+    """Run call() iterations times and print the mean in milliseconds"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        call()
+    mean_ms = (time.perf_counter() - start) * 1000 / iterations
+    print(f"   {label:<28} {mean_ms:.3f}ms per call")
+    return mean_ms
+
+
+def head_object(s3_client, options):
+    try:
+        s3_client.head_object(Bucket=options['bucket'], Key=options['key'])
+    except ClientError:
+        pass  # A missing object still costs the same round trip
+
+
+def run_benchmark(options):
+    iterations = options['iterations']
+    print(f"🪣 {iterations} iterations")
+
+    per_call = time_calls('new client per call', iterations, build_client)
+    shared = time_calls('get_s3_client()', iterations, get_s3_client)
+    print(f"   same object every call: {get_s3_client() is get_s3_client()}")
+    print(f"   construction saved: {per_call - shared:.3f}ms per call")
+
+    if options['bucket'] and options['key']:
+        print(f"🌐 HEAD s3://{options['bucket']}/{options['key']}")
+        time_calls('new client per request', iterations, lambda: head_object(build_client(), options))
+        time_calls('shared pooled client', iterations, lambda: head_object(get_s3_client(), options))
+
+    return True
+
+
+if __name__ == "__main__":
+    success = run_benchmark(parse_args(sys.argv[1:]))
+    sys.exit(0 if success else 1)
@@ -75,9 +75,18 @@ class Config:
     S3_BUCKET = os.environ.get('S3_BUCKET')
     AWS_REGION = os.environ.get('AWS_REGION', 'us-east-1')
     
+    # Shared S3 client tuning - one pooled client per region is reused app-wide
+    S3_MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 50))
+    S3_CONNECT_TIMEOUT = int(os.environ.get('S3_CONNECT_TIMEOUT', 5))
+    S3_READ_TIMEOUT = int(os.environ.get('S3_READ_TIMEOUT', 60))
+    S3_MAX_ATTEMPTS = int(os.environ.get('S3_MAX_ATTEMPTS', 3))
+    
     # Stripe Configuration
     STRIPE_PUBLISHABLE_KEY = os.environ.get('STRIPE_PUBLISHABLE_KEY')
     STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY')
+    STRIPE_API_BASE = os.environ.get('STRIPE_API_BASE')  # e.g. http://localhost:12111 for stripe-mock
+    STRIPE_SYNC_WORKERS = int(os.environ.get('STRIPE_SYNC_WORKERS', 4))
+    STRIPE_SYNC_RATE_LIMIT = int(os.environ.get('STRIPE_SYNC_RATE_LIMIT', 20))  # Requests per second across workers
     
     # Email Configuration
     MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
@@ -109,9 +118,24 @@ class Config:
     VIDEOS_PER_PAGE = 12
     USERS_PER_PAGE = 25
     
+    # Data Retention - rows older than these are archived (or deleted) by retention.py
+    RETENTION_USER_ACTIVITY_DAYS = int(os.environ.get('RETENTION_USER_ACTIVITY_DAYS', 180))
+    RETENTION_NOTIFICATION_DAYS = int(os.environ.get('RETENTION_NOTIFICATION_DAYS', 90))  # Read notifications only
+    RETENTION_RECOMMENDATION_CLICK_DAYS = int(os.environ.get('RETENTION_RECOMMENDATION_CLICK_DAYS', 365))
+    # Off unless set: the revenue rollup, cohort/MRR engine and transaction feed all read every
+    # payment event, so pruning subscription_events rewrites history (old cohorts show false churn)
+    RETENTION_SUBSCRIPTION_EVENT_DAYS = int(os.environ['RETENTION_SUBSCRIPTION_EVENT_DAYS']) if os.environ.get('RETENTION_SUBSCRIPTION_EVENT_DAYS') else None
+    RETENTION_STRIPE_INBOX_DAYS = int(os.environ.get('RETENTION_STRIPE_INBOX_DAYS', 30))  # Processed webhook payloads
+    RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', 1000))
+    RETENTION_ARCHIVE_DIR = os.environ.get('RETENTION_ARCHIVE_DIR', 'archives')
+    RETENTION_ARCHIVE_BUCKET = os.environ.get('RETENTION_ARCHIVE_BUCKET')  # Optional S3 copy of archive files
+    RETENTION_ARCHIVE_PREFIX = os.environ.get('RETENTION_ARCHIVE_PREFIX', 'retention-archives/')
+    
     # Cache Configuration - Simple for Heroku
     CACHE_TYPE = 'simple'
     CACHE_DEFAULT_TIMEOUT = 300
+    ANALYTICS_CACHE_TTL = int(os.environ.get('ANALYTICS_CACHE_TTL', 300))  # Seconds a response is served as fresh
+    ANALYTICS_CACHE_STALE_TTL = int(os.environ.get('ANALYTICS_CACHE_STALE_TTL', 3600))  # Extra seconds served stale while refreshing
 
     # ===== LIVEKIT STREAMING CONFIGURATION =====
     
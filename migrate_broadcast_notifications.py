@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Database Migration Script for TGFX Trade Lab
+Moves per-user copies of broadcast notifications into broadcast_messages
+
+Every broadcast used to insert the same title/message once per user. This
+script finds those copies (same title, message and type, sent within a few
+minutes of each other), stores the text once in broadcast_messages and keeps
+only a compact (user_id, broadcast_id, is_read) receipt per recipient.
+
+Usage:
+    python migrate_broadcast_notifications.py            # migrate
+    python migrate_broadcast_notifications.py --dry-run  # report only
+"""
+
+import os
+import sys
+from datetime import timedelta
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app, db, Notification, BroadcastMessage, BroadcastReceipt
+
+# Copies further apart than this are treated as separate broadcasts
+BROADCAST_WINDOW = timedelta(minutes=10)
+# Only groups with at least this many copies are considered broadcasts
+MIN_RECIPIENTS = 2
+BATCH_SIZE = 1000
+
+
+def find_duplicate_groups():
+    """(title, message, type) combinations stored for more than one user"""
+    return db.session.query(
+        Notification.title,
+        Notification.message,
+        Notification.notification_type,
+        db.func.count(Notification.id)
+    ).group_by(
+        Notification.title,
+        Notification.message,
+        Notification.notification_type
+    ).having(db.func.count(Notification.id) >= MIN_RECIPIENTS).all()
+
+
+def cluster_copies(title, message, notification_type):
+    """Split a group's rows into clusters sent within BROADCAST_WINDOW of each other"""
+    rows = db.session.query(
+        Notification.id,
+        Notification.user_id,
+        Notification.is_read,
+        Notification.created_at
+    ).filter(
+        Notification.title == title,
+        Notification.message == message,
+        Notification.notification_type == notification_type
+    ).order_by(Notification.created_at, Notification.id).all()  # Materialized; clusters commit as they go
+
+    cluster = []
+    for row in rows:
+        if cluster and row.created_at - cluster[-1].created_at > BROADCAST_WINDOW:
+            yield cluster
+            cluster = []
+        cluster.append(row)
+    if cluster:
+        yield cluster
+
+
+def migrate_cluster(title, message, notification_type, cluster):
+    """Replace one cluster of copies with a broadcast row and receipts"""
+    broadcast = BroadcastMessage(
+        title=title,
+        message=message,
+        notification_type=notification_type,
+        audience='direct',  # Original audience is unknown, so recipients keep explicit receipts
+        created_at=cluster[0].created_at
+    )
+    db.session.add(broadcast)
+    db.session.flush()
+
+    # A user may have received the same text twice; keep one receipt each
+    receipts = {}
+    for row in cluster:
+        receipts[row.user_id] = receipts.get(row.user_id, True) and row.is_read
+
+    receipt_rows = [
+        {'broadcast_id': broadcast.id, 'user_id': user_id, 'is_read': is_read, 'is_cleared': False}
+        for user_id, is_read in receipts.items()
+    ]
+    for start in range(0, len(receipt_rows), BATCH_SIZE):
+        db.session.execute(db.insert(BroadcastReceipt.__table__), receipt_rows[start:start + BATCH_SIZE])
+
+    notification_ids = [row.id for row in cluster]
+    for start in range(0, len(notification_ids), BATCH_SIZE):
+        Notification.query.filter(
+            Notification.id.in_(notification_ids[start:start + BATCH_SIZE])
+        ).delete(synchronize_session=False)
+
+    db.session.commit()
+    return len(notification_ids), len(receipt_rows)
+
+
+def run_migration(dry_run=False):
+    """Run the broadcast notification migration"""
+    with app.app_context():
+        try:
+            db.create_all()
+            print("✓ Broadcast notification tables ready")
+
+            groups = find_duplicate_groups()
+            print(f"Found {len(groups)} repeated notification texts")
+
+            broadcasts_created = 0
+            rows_removed = 0
+            receipts_created = 0
+
+            for title, message, notification_type, copies in groups:
+                for cluster in cluster_copies(title, message, notification_type):
+                    if len(cluster) < MIN_RECIPIENTS:
+                        continue
+
+                    if dry_run:
+                        print(f"   Would migrate {len(cluster)} copies of '{title}' ({cluster[0].created_at})")
+                        broadcasts_created += 1
+                        rows_removed += len(cluster)
+                        continue
+
+                    removed, receipts = migrate_cluster(title, message, notification_type, cluster)
+                    broadcasts_created += 1
+                    rows_removed += removed
+                    receipts_created += receipts
+                    print(f"✅ Migrated {removed} copies of '{title}' → broadcast {broadcasts_created}")
+
+            if dry_run:
+                print(f"ℹ️ Dry run: {broadcasts_created} broadcasts would replace {rows_removed} notification rows")
+            else:
+                print(f"🚀 Migration completed! {broadcasts_created} broadcasts replaced "
+                      f"{rows_removed} notification rows ({receipts_created} receipts)")
+            return True
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Migration failed: {e}")
+            return False
+
+
+if __name__ == "__main__":
+    success = run_migration(dry_run='--dry-run' in sys.argv)
+    sys.exit(0 if success else 1)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Database Migration Script for TGFX Trade Lab
+Moves Stripe payloads out of subscription_events.event_data
+
+log_stripe_event used to store the whole Stripe object as JSON text on every
+row. This script extracts the columns the dashboards filter on
+(stripe_object_id, object_status, stripe_price_id), stores the object
+zlib-compressed in subscription_event_payloads and clears event_data, in
+small batches. App-generated rows (cancellations, admin grants) keep their
+short event_data as-is.
+
+Usage:
+    python migrate_subscription_event_payloads.py            # migrate
+    python migrate_subscription_event_payloads.py --dry-run  # report only
+"""
+
+import os
+import sys
+import json
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app, db, SubscriptionEvent, migrate_subscription_event_ids
+
+BATCH_SIZE = 500
+
+
+def stripe_events_with_inline_payload():
+    """Rows whose event_data holds a Stripe object (Stripe event types contain a dot)"""
+    return SubscriptionEvent.query.filter(
+        SubscriptionEvent.event_data.isnot(None),
+        SubscriptionEvent.event_type.like('%.%')
+    )
+
+
+def run_migration(dry_run=False):
+    """Run the subscription event payload migration"""
+    migrate_subscription_event_ids()
+
+    with app.app_context():
+        try:
+            db.create_all()
+            print("✓ subscription_event_payloads table ready")
+
+            total = stripe_events_with_inline_payload().count()
+            print(f"Found {total} events with inline Stripe payloads")
+
+            if dry_run:
+                size = db.session.query(
+                    db.func.sum(db.func.length(SubscriptionEvent.event_data))
+                ).filter(
+                    SubscriptionEvent.event_data.isnot(None),
+                    SubscriptionEvent.event_type.like('%.%')
+                ).scalar() or 0
+                print(f"ℹ️ Dry run: {total} rows ({size / 1024 / 1024:.1f} MB of JSON) would be compacted")
+                return True
+
+            migrated = 0
+            skipped = 0
+            last_id = 0
+            while True:
+                events = stripe_events_with_inline_payload().filter(
+                    SubscriptionEvent.id > last_id
+                ).options(db.undefer(SubscriptionEvent.event_data)).order_by(SubscriptionEvent.id).limit(BATCH_SIZE).all()
+                if not events:
+                    break
+
+                for event in events:
+                    last_id = event.id
+                    try:
+                        event_object = json.loads(event.event_data)
+                    except ValueError:
+                        skipped += 1
+                        continue
+                    if not isinstance(event_object, dict):
+                        skipped += 1
+                        continue
+
+                    event.set_stripe_object(event_object)
+                    migrated += 1
+
+                db.session.commit()
+                db.session.expunge_all()
+                print(f"   Compacted {migrated}/{total} events")
+
+            print(f"🚀 Migration completed! {migrated} payloads compressed, {skipped} left as-is")
+            return True
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Migration failed: {e}")
+            return False
+
+
+if __name__ == "__main__":
+    success = run_migration(dry_run='--dry-run' in sys.argv)
+    sys.exit(0 if success else 1)
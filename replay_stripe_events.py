@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Stripe Event Replay Tool for TGFX Trade Lab
+Reprocesses webhook events stored in stripe_webhook_inbox
+
+Events are replayed through the same dispatch code the webhook worker uses.
+Handlers are not idempotent (payments add to total_revenue, notifications
+are sent again), so replay events that failed or were never applied rather
+than ones that already succeeded.
+
+Usage:
+    python replay_stripe_events.py --failed                 # every failed event
+    python replay_stripe_events.py --event evt_123 --event evt_456
+    python replay_stripe_events.py --type invoice.payment_succeeded --since 2024-01-01
+    python replay_stripe_events.py --failed --queue         # hand to the running worker instead
+    python replay_stripe_events.py --failed --dry-run       # list matching events only
+"""
+
+import os
+import sys
+from datetime import datetime
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app, db, StripeWebhookInbox, stripe_webhook_queue
+
+
+def parse_args(args):
+    options = {'event_ids': [], 'event_type': None, 'since': None, 'failed': False,
+               'queue': False, 'dry_run': False}
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == '--event' and i + 1 < len(args):
+            options['event_ids'].append(args[i + 1])
+            i += 1
+        elif arg == '--type' and i + 1 < len(args):
+            options['event_type'] = args[i + 1]
+            i += 1
+        elif arg == '--since' and i + 1 < len(args):
+            options['since'] = datetime.strptime(args[i + 1], '%Y-%m-%d')
+            i += 1
+        elif arg == '--failed':
+            options['failed'] = True
+        elif arg == '--queue':
+            options['queue'] = True
+        elif arg == '--dry-run':
+            options['dry_run'] = True
+        i += 1
+    return options
+
+
+def build_query(options):
+    query = StripeWebhookInbox.query
+    if options['event_ids']:
+        query = query.filter(StripeWebhookInbox.stripe_event_id.in_(options['event_ids']))
+    if options['event_type']:
+        query = query.filter(StripeWebhookInbox.event_type == options['event_type'])
+    if options['since']:
+        query = query.filter(StripeWebhookInbox.received_at >= options['since'])
+    if options['failed']:
+        query = query.filter(StripeWebhookInbox.status == 'failed')
+    return query
+
+
+def run_replay(options):
+    """Replay matching stored events inline, or requeue them for the worker"""
+    if not (options['event_ids'] or options['event_type'] or options['since'] or options['failed']):
+        print("❌ Nothing selected - pass --failed, --event, --type or --since")
+        return False
+
+    with app.app_context():
+        try:
+            query = build_query(options)
+
+            if options['dry_run']:
+                rows = query.order_by(StripeWebhookInbox.id).all()
+                for row in rows:
+                    print(f"   {row.stripe_event_id} {row.event_type} [{row.status}] attempts={row.attempts}")
+                print(f"ℹ️ Dry run: {len(rows)} events would be replayed")
+                return True
+
+            if options['queue']:
+                queued = stripe_webhook_queue.replay(query)
+                print(f"✅ Requeued {queued} events for the webhook worker")
+                return True
+
+            # Lease the rows to this script so the running worker skips them, then process them here in id order
+            event_ids = [row.id for row in query.filter(StripeWebhookInbox.status != 'running').order_by(StripeWebhookInbox.id).all()]
+            stripe_webhook_queue.replay(StripeWebhookInbox.query.filter(StripeWebhookInbox.id.in_(event_ids)), hold=True)
+
+            processed = 0
+            for inbox_id in event_ids:
+                if stripe_webhook_queue.process(inbox_id):
+                    processed += 1
+                db.session.remove()
+
+            print(f"🚀 Replayed {processed}/{len(event_ids)} events")
+            return processed == len(event_ids)
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Replay failed: {e}")
+            return False
+
+
+if __name__ == "__main__":
+    success = run_replay(parse_args(sys.argv[1:]))
+    sys.exit(0 if success else 1)
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+Data Retention Script for TGFX Trade Lab
+Archives and prunes old rows from the append-only tables
+
+Each table has a retention policy (see RETENTION_* in config.py); a policy
+whose days setting is None is skipped. Rows older
+than the cutoff are copied to compressed archive files and then deleted in
+small id-ordered batches, committing after each batch so no long lock is held
+on the table. Archive files go to RETENTION_ARCHIVE_DIR and, when
+RETENTION_ARCHIVE_BUCKET is set, are copied to S3 as well.
+
+On MySQL, user_activities and recommendation_clicks can be converted to
+monthly RANGE partitions. Expired months are then exported and removed with
+DROP PARTITION instead of row-by-row deletes. Partitioned InnoDB tables can't
+carry foreign keys, so --partition drops the FKs on those tables; user
+deletion still cascades through the ORM relationships.
+
+Usage:
+    python retention.py                        # archive + prune every table
+    python retention.py --dry-run              # report what would be removed
+    python retention.py --table user_activities
+    python retention.py --format parquet       # parquet archives (needs pyarrow)
+    python retention.py --no-archive           # delete without exporting
+    python retention.py --partition            # MySQL: switch to monthly partitions
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import zlib
+from datetime import datetime, date, timedelta
+from decimal import Decimal
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app, db, UserActivity, Notification, RecommendationClick, SubscriptionEvent, SubscriptionEventPayload, StripeWebhookInbox, get_s3_client
+
+# Pause between batches so replicas and concurrent writers can keep up
+BATCH_PAUSE_SECONDS = 0.2
+# Monthly partitions created ahead of the current month
+PARTITION_MONTHS_AHEAD = 3
+
+
+class RetentionPolicy:
+    """How long rows of one table are kept and how they are removed"""
+
+    def __init__(self, model, timestamp_column, days, archive=True, extra_filter=None, partitionable=False,
+                 dependents=None):
+        self.model = model
+        self.table = model.__tablename__
+        self.timestamp_column = timestamp_column
+        self.days = days
+        self.archive = archive
+        self.extra_filter = extra_filter
+        self.partitionable = partitionable
+        # (model, foreign key column) pairs whose rows are archived alongside and deleted first
+        self.dependents = dependents or []
+
+    @property
+    def cutoff(self):
+        return datetime.utcnow() - timedelta(days=self.days)
+
+    def expired_filter(self):
+        column = getattr(self.model, self.timestamp_column)
+        conditions = [column < self.cutoff]
+        if self.extra_filter is not None:
+            conditions.append(self.extra_filter(self.model))
+        return db.and_(*conditions)
+
+
+def get_policies():
+    """Retention policies built from the app configuration"""
+    config = app.config
+    return [
+        RetentionPolicy(UserActivity, 'timestamp', config.get('RETENTION_USER_ACTIVITY_DAYS', 180),
+                        partitionable=True),
+        # Unread notifications are kept so the cached unread counters stay correct
+        RetentionPolicy(Notification, 'created_at', config.get('RETENTION_NOTIFICATION_DAYS', 90),
+                        extra_filter=lambda model: model.is_read.is_(True)),
+        RetentionPolicy(RecommendationClick, 'clicked_at', config.get('RETENTION_RECOMMENDATION_CLICK_DAYS', 365),
+                        partitionable=True),
+        # Billing history is always archived before it is removed; disabled (None) unless configured
+        RetentionPolicy(SubscriptionEvent, 'created_at', config.get('RETENTION_SUBSCRIPTION_EVENT_DAYS'),
+                        dependents=[(SubscriptionEventPayload, 'event_id')]),
+        # Raw webhook payloads are only needed for replays; failed ones are kept for inspection
+        RetentionPolicy(StripeWebhookInbox, 'received_at', config.get('RETENTION_STRIPE_INBOX_DAYS', 30),
+                        archive=False, extra_filter=lambda model: model.status == 'processed'),
+    ]
+
+
+def serialize_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+    return value
+
+
+def attach_dependents(policy, rows, ids):
+    """Add each dependent table's rows to the archived parent rows"""
+    for model, fk_column in policy.dependents:
+        table = model.__table__
+        children = db.session.execute(
+            db.select(table).where(table.c[fk_column].in_(ids))
+        ).mappings().all()
+
+        by_parent = {}
+        for child in children:
+            child = dict(child)
+            if child.get('encoding') == 'zlib':
+                # Archive compressed payloads as readable JSON
+                child['data'] = json.loads(zlib.decompress(child['data']).decode('utf-8'))
+            by_parent.setdefault(child[fk_column], []).append(child)
+
+        for row in rows:
+            row[model.__tablename__] = by_parent.get(row['id'], [])
+
+
+class ArchiveWriter:
+    """Writes archived rows to one compressed file per batch"""
+
+    def __init__(self, table, file_format='jsonl'):
+        self.table = table
+        self.file_format = file_format
+        self.run_stamp = datetime.utcnow().strftime('%Y%m%d-%H%M%S')
+        self.directory = os.path.join(app.config.get('RETENTION_ARCHIVE_DIR', 'archives'), table)
+        self.part = 0
+        self.files = []
+
+        if file_format == 'parquet':
+            try:
+                import pandas  # noqa: F401
+                import pyarrow  # noqa: F401
+            except ImportError:
+                print("⚠️ pandas/pyarrow not available, falling back to jsonl.gz archives")
+                self.file_format = 'jsonl'
+
+    def write(self, rows):
+        """Persist a batch and return its path; must succeed before the rows are deleted"""
+        os.makedirs(self.directory, exist_ok=True)
+        self.part += 1
+        extension = 'parquet' if self.file_format == 'parquet' else 'jsonl.gz'
+        path = os.path.join(self.directory, f"{self.table}-{self.run_stamp}-{self.part:05d}.{extension}")
+
+        if self.file_format == 'parquet':
+            import pandas as pd
+            pd.DataFrame(rows).to_parquet(path, compression='zstd', index=False)
+        else:
+            with gzip.open(path, 'wt', encoding='utf-8') as archive:
+                for row in rows:
+                    archive.write(json.dumps({key: serialize_value(value) for key, value in row.items()}))
+                    archive.write('\n')
+
+        self.upload(path)
+        self.files.append(path)
+        return path
+
+    def upload(self, path):
+        bucket = app.config.get('RETENTION_ARCHIVE_BUCKET')
+        if not bucket:
+            return
+        key = f"{app.config.get('RETENTION_ARCHIVE_PREFIX', 'retention-archives/')}{self.table}/{os.path.basename(path)}"
+        get_s3_client().upload_file(path, bucket, key)
+
+
+def prune_table(policy, batch_size, archive=True, file_format='jsonl', dry_run=False):
+    """Archive and delete expired rows in id-ordered batches; returns rows removed"""
+    table = policy.model.__table__
+    expired = policy.expired_filter()
+
+    if dry_run:
+        count = db.session.query(db.func.count(table.c.id)).filter(expired).scalar()
+        print(f"   {policy.table}: {count} rows older than {policy.days} days would be removed")
+        return count
+
+    writer = ArchiveWriter(policy.table, file_format) if archive and policy.archive else None
+    removed = 0
+
+    while True:
+        # Old rows have the lowest ids, so walking the primary key touches only the head of the table
+        rows = db.session.execute(
+            db.select(table).where(expired).order_by(table.c.id).limit(batch_size)
+        ).mappings().all()
+        if not rows:
+            break
+
+        ids = [row['id'] for row in rows]
+        if writer:
+            archived = [dict(row) for row in rows]
+            attach_dependents(policy, archived, ids)
+            writer.write(archived)
+
+        for model, fk_column in policy.dependents:
+            db.session.execute(db.delete(model.__table__).where(model.__table__.c[fk_column].in_(ids)))
+        db.session.execute(db.delete(table).where(table.c.id.in_(ids)))
+        db.session.commit()
+
+        removed += len(ids)
+        print(f"   {policy.table}: removed {removed} rows so far")
+
+        if len(rows) < batch_size:
+            break
+        time.sleep(BATCH_PAUSE_SECONDS)
+
+    if writer and writer.files:
+        print(f"📦 {policy.table}: archived to {len(writer.files)} file(s) in {writer.directory}")
+    return removed
+
+
+# ===== MySQL monthly partitioning =====
+
+def is_mysql():
+    return db.engine.dialect.name == 'mysql'
+
+
+def month_start(value, offset=0):
+    month_index = value.year * 12 + value.month - 1 + offset
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"p{month.strftime('%Y%m')}"
+
+
+def get_partitions(table_name):
+    """Existing partitions as (name, upper bound) ordered by position"""
+    rows = db.session.execute(db.text("""
+        SELECT PARTITION_NAME, PARTITION_DESCRIPTION
+        FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+    """), {'table': table_name}).fetchall()
+    return [(row[0], row[1]) for row in rows]
+
+
+def enable_monthly_partitions(policy):
+    """Convert a table to RANGE COLUMNS partitions by month (MySQL only)"""
+    table_name = policy.table
+    column = policy.timestamp_column
+
+    if get_partitions(table_name):
+        print(f"ℹ️ {table_name} is already partitioned")
+        return ensure_future_partitions(policy)
+
+    foreign_keys = db.session.execute(db.text("""
+        SELECT CONSTRAINT_NAME FROM information_schema.REFERENTIAL_CONSTRAINTS
+        WHERE CONSTRAINT_SCHEMA = DATABASE() AND TABLE_NAME = :table
+    """), {'table': table_name}).fetchall()
+    for (constraint_name,) in foreign_keys:
+        db.session.execute(db.text(f"ALTER TABLE {table_name} DROP FOREIGN KEY {constraint_name}"))
+        print(f"✅ Dropped foreign key {constraint_name} on {table_name}")
+
+    oldest = db.session.execute(db.text(f"SELECT MIN({column}) FROM {table_name}")).scalar() or datetime.utcnow()
+    first_month = month_start(oldest)
+    last_month = month_start(datetime.utcnow(), PARTITION_MONTHS_AHEAD)
+
+    partitions = []
+    month = first_month
+    while month <= last_month:
+        upper = month_start(month, 1)
+        partitions.append(f"PARTITION {partition_name(month)} VALUES LESS THAN ('{upper.isoformat()}')")
+        month = upper
+    partitions.append("PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+
+    # The partition column has to be part of every unique key
+    db.session.execute(db.text(f"ALTER TABLE {table_name} DROP PRIMARY KEY, ADD PRIMARY KEY (id, {column})"))
+    db.session.execute(db.text(
+        f"ALTER TABLE {table_name} PARTITION BY RANGE COLUMNS({column}) ({', '.join(partitions)})"
+    ))
+    db.session.commit()
+    print(f"✅ {table_name} partitioned into {len(partitions)} monthly partitions")
+    return True
+
+
+def ensure_future_partitions(policy):
+    """Split pmax so the next PARTITION_MONTHS_AHEAD months have their own partitions"""
+    existing = {name for name, _ in get_partitions(policy.table)}
+    if 'pmax' not in existing:
+        return False
+
+    new_partitions = []
+    for offset in range(PARTITION_MONTHS_AHEAD + 1):
+        month = month_start(datetime.utcnow(), offset)
+        if partition_name(month) not in existing:
+            upper = month_start(month, 1)
+            new_partitions.append(f"PARTITION {partition_name(month)} VALUES LESS THAN ('{upper.isoformat()}')")
+
+    if new_partitions:
+        new_partitions.append("PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+        db.session.execute(db.text(
+            f"ALTER TABLE {policy.table} REORGANIZE PARTITION pmax INTO ({', '.join(new_partitions)})"
+        ))
+        db.session.commit()
+        print(f"✅ Added {len(new_partitions) - 1} future partitions to {policy.table}")
+    return True
+
+
+def drop_expired_partitions(policy, archive=True, file_format='jsonl', dry_run=False):
+    """Export and drop whole months that are entirely past the cutoff"""
+    cutoff = policy.cutoff
+    expired = []
+    for name, description in get_partitions(policy.table):
+        if name == 'pmax':
+            continue
+        upper = datetime.strptime(description.strip("'")[:10], '%Y-%m-%d')
+        if upper <= cutoff:
+            expired.append(name)
+
+    if not expired:
+        return 0
+
+    if dry_run:
+        print(f"   {policy.table}: would drop partitions {', '.join(expired)}")
+        return len(expired)
+
+    writer = ArchiveWriter(policy.table, file_format) if archive and policy.archive else None
+    batch_size = app.config.get('RETENTION_BATCH_SIZE', 1000)
+
+    for name in expired:
+        if writer:
+            last_id = 0
+            while True:
+                rows = db.session.execute(db.text(
+                    f"SELECT * FROM {policy.table} PARTITION ({name}) WHERE id > :last_id ORDER BY id LIMIT :limit"
+                ), {'last_id': last_id, 'limit': batch_size}).mappings().all()
+                if not rows:
+                    break
+                writer.write([dict(row) for row in rows])
+                last_id = rows[-1]['id']
+
+        db.session.execute(db.text(f"ALTER TABLE {policy.table} DROP PARTITION {name}"))
+        db.session.commit()
+        print(f"✅ Dropped partition {policy.table}.{name}")
+
+    ensure_future_partitions(policy)
+    return len(expired)
+
+
+def run_retention(tables=None, archive=True, file_format='jsonl', dry_run=False, partition=False):
+    """Apply every retention policy (or only those for the given tables)"""
+    with app.app_context():
+        try:
+            batch_size = app.config.get('RETENTION_BATCH_SIZE', 1000)
+            policies = [p for p in get_policies() if not tables or p.table in tables]
+
+            if partition:
+                if not is_mysql():
+                    print("❌ Monthly partitioning is only supported on MySQL")
+                    return False
+                for policy in policies:
+                    if policy.partitionable:
+                        enable_monthly_partitions(policy)
+
+            for policy in policies:
+                if policy.days is None:
+                    print(f"ℹ️ {policy.table}: retention disabled, skipping")
+                    continue
+                print(f"🧹 {policy.table}: keeping {policy.days} days (cutoff {policy.cutoff:%Y-%m-%d})")
+
+                if policy.partitionable and is_mysql() and get_partitions(policy.table):
+                    drop_expired_partitions(policy, archive, file_format, dry_run)
+
+                # Rows in partially expired months (or unpartitioned tables) go row by row
+                removed = prune_table(policy, batch_size, archive, file_format, dry_run)
+                if not dry_run:
+                    print(f"✅ {policy.table}: {removed} rows removed")
+
+            print("🚀 Retention run completed!")
+            return True
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Retention run failed: {e}")
+            return False
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    selected_tables = [args[i + 1] for i, arg in enumerate(args) if arg == '--table' and i + 1 < len(args)]
+    selected_format = 'parquet' if '--format' in args and 'parquet' in args else 'jsonl'
+
+    success = run_retention(
+        tables=selected_tables or None,
+        archive='--no-archive' not in args,
+        file_format=selected_format,
+        dry_run='--dry-run' in args,
+        partition='--partition' in args
+    )
+    sys.exit(0 if success else 1)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Broadcast Notification Check for TGFX Trade Lab
+Verifies that broadcast_notification commits its rows and times the write
+
+Sends a test broadcast, throws the session away, and reads the broadcast
+back from a new session, so the check fails if the caller would have had to
+commit. The audience size is counted from users. The test broadcast is
+deleted again unless --keep is passed; until then it shows up in the
+audience's notification feeds.
+
+Usage:
+    python verify_broadcast_notifications.py                 # audience 'all', 10 runs
+    python verify_broadcast_notifications.py --audience premium --runs 50
+    python verify_broadcast_notifications.py --keep          # leave the test broadcasts in place
+"""
+
+import os
+import sys
+import time
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app, db, User, BroadcastMessage, broadcast_notification
+
+
+def parse_args(args):
+    options = {'audience': 'all', 'runs': 10, 'keep': False}
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == '--audience' and i + 1 < len(args):
+            options['audience'] = args[i + 1]
+            i += 1
+        elif arg == '--runs' and i + 1 < len(args):
+            options['runs'] = max(int(args[i + 1]), 1)
+            i += 1
+        elif arg == '--keep':
+            options['keep'] = True
+        i += 1
+    return options
+
+
+def count_audience(audience):
+    query = User.query
+    if audience == 'premium':
+        query = query.filter(User.has_subscription == True)
+    elif audience == 'free':
+        query = query.filter(User.has_subscription == False)
+    return query.count()
+
+
+def run_check(options):
+    """Send test broadcasts and confirm each one is committed"""
+    if options['audience'] not in ('all', 'premium', 'free'):
+        print("❌ --audience must be all, premium or free")
+        return False
+
+    with app.app_context():
+        broadcast_ids = []
+        timings_ms = []
+        try:
+            audience_size = count_audience(options['audience'])
+
+            for run in range(options['runs']):
+                start = time.perf_counter()
+                broadcast = broadcast_notification(
+                    'Notification check',
+                    f'Test broadcast {run + 1} from verify_broadcast_notifications.py',
+                    'system',
+                    target_users=options['audience']
+                )
+                timings_ms.append((time.perf_counter() - start) * 1000)
+                if broadcast is None:
+                    print(f"❌ Run {run + 1}: broadcast_notification returned nothing")
+                    return False
+                broadcast_ids.append(broadcast.id)
+
+                # Anything left uncommitted is gone after this
+                db.session.remove()
+
+            committed = BroadcastMessage.query.filter(BroadcastMessage.id.in_(broadcast_ids)).count()
+            print(f"📢 {options['runs']} broadcasts to '{options['audience']}' ({audience_size} users)")
+            print(f"   committed: {committed}/{len(broadcast_ids)}")
+            print(f"   write: mean {sum(timings_ms) / len(timings_ms):.2f}ms, slowest {max(timings_ms):.2f}ms")
+            return committed == len(broadcast_ids)
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Check failed: {e}")
+            return False
+
+        finally:
+            if broadcast_ids and not options['keep']:
+                BroadcastMessage.query.filter(BroadcastMessage.id.in_(broadcast_ids)).delete(synchronize_session=False)
+                db.session.commit()
+                print(f"🧹 Removed {len(broadcast_ids)} test broadcasts")
+
+
+if __name__ == "__main__":
+    success = run_check(parse_args(sys.argv[1:]))
+    sys.exit(0 if success else 1)